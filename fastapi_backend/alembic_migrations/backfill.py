@@ -0,0 +1,226 @@
+"""Batched, throttled and resumable data backfills for migrations.
+
+A single UPDATE over a large table holds its row locks until it commits and
+writes all of its WAL at once. A backfill instead walks the table in key order,
+updating one batch per statement, so each batch commits on its own:
+
+    from alembic_migrations.backfill import Backfill, forget_backfill, run_backfill
+
+    BACKFILL = Backfill(
+        name="1f2e3d4c5b6a_default_quantity",
+        table="items",
+        set="quantity = 0",
+        where="quantity IS NULL",
+    )
+
+    def upgrade():
+        op.add_column(...)
+        run_backfill(BACKFILL)
+
+    def downgrade():
+        forget_backfill(BACKFILL.name)
+        op.drop_column(...)
+
+The schema changes made before `run_backfill` are committed first. Progress is
+recorded in the alembic_backfill table along with each batch, so an
+interrupted backfill (a build that timed out, say) resumes where it stopped
+when the migration runs again, and a finished one is skipped.
+
+With ALEMBIC_DEFER_BACKFILLS=1 the migration only registers the backfill, so
+deploys just change the schema; `python -m commands.run_backfills` then runs
+the pending backfills outside the deploy. A later migration that relies on
+the data, e.g. to add a NOT NULL constraint, calls `require_backfill` first.
+"""
+
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+
+from alembic import op
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(f"alembic.{__name__}")
+
+PROGRESS_TABLE = "alembic_backfill"
+
+CREATE_PROGRESS_TABLE = text(
+    f"CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} ("
+    "name text PRIMARY KEY, "
+    "definition jsonb NOT NULL, "
+    "last_key text, "
+    "rows_updated bigint NOT NULL DEFAULT 0, "
+    "started_at timestamptz NOT NULL DEFAULT now(), "
+    "updated_at timestamptz NOT NULL DEFAULT now(), "
+    "finished_at timestamptz)"
+)
+
+REPLICATION_LAG = text(
+    "SELECT coalesce(extract(epoch FROM max(replay_lag)), 0) FROM pg_stat_replication"
+)
+
+REPLICATION_POLL_SECONDS = 1.0
+
+
+@dataclass(frozen=True)
+class Backfill:
+    """An UPDATE of `table` run in batches of rows ordered by `key`.
+
+    `key` must be unique and indexed. `set` and `where` are SQL fragments for
+    the UPDATE's SET and WHERE clauses; rows not matching `where` are skipped
+    without being locked.
+    """
+
+    name: str
+    table: str
+    set: str
+    where: str = "true"
+    key: str = "id"
+    # Rows per batch; halved while batches take longer than
+    # target_batch_seconds, and grown back once they speed up
+    batch_size: int = 1000
+    target_batch_seconds: float = 0.5
+    # Pause after each batch, as a multiple of the time it took, so the
+    # backfill uses at most 1 / (1 + pause_ratio) of a connection's time
+    pause_ratio: float = 1.0
+    # Wait while any streaming replica replays further behind than this
+    max_replication_lag_seconds: float = 10.0
+
+
+def batch_statement(backfill: Backfill, key_type: str, first: bool):
+    """Update the next batch and record it, in one statement.
+
+    Returns the batch's last key as text, or NULL when no rows are left, and
+    the number of rows updated.
+    """
+    after = "" if first else f"AND {backfill.key} > CAST(:after AS {key_type}) "
+    return text(
+        f"WITH batch AS ("
+        f"SELECT {backfill.key} FROM {backfill.table} "
+        f"WHERE ({backfill.where}) {after}"
+        f"ORDER BY {backfill.key} LIMIT :limit"
+        f"), updated AS ("
+        f"UPDATE {backfill.table} SET {backfill.set} FROM batch "
+        f"WHERE {backfill.table}.{backfill.key} = batch.{backfill.key} "
+        f"RETURNING 1"
+        f"), last AS ("
+        f"SELECT CAST({backfill.key} AS text) AS key FROM batch "
+        f"ORDER BY {backfill.key} DESC LIMIT 1"
+        f"), progress AS ("
+        f"UPDATE {PROGRESS_TABLE} SET last_key = last.key, "
+        f"rows_updated = rows_updated + (SELECT count(*) FROM updated), "
+        f"updated_at = now() FROM last WHERE name = :name"
+        f") "
+        f"SELECT (SELECT key FROM last), (SELECT count(*) FROM updated)"
+    )
+
+
+def key_type(connection: Connection, backfill: Backfill) -> str:
+    return connection.execute(
+        text(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = CAST(:table AS regclass) AND attname = :key"
+        ),
+        {"table": backfill.table, "key": backfill.key},
+    ).scalar_one()
+
+
+def register_backfill(connection: Connection, backfill: Backfill) -> None:
+    connection.execute(CREATE_PROGRESS_TABLE)
+    connection.execute(
+        text(
+            f"INSERT INTO {PROGRESS_TABLE} (name, definition) "
+            "VALUES (:name, CAST(:definition AS jsonb)) "
+            "ON CONFLICT (name) DO UPDATE SET definition = excluded.definition"
+        ),
+        {"name": backfill.name, "definition": json.dumps(asdict(backfill))},
+    )
+
+
+def wait_for_replicas(connection: Connection, max_lag: float) -> None:
+    while (lag := connection.execute(REPLICATION_LAG).scalar()) > max_lag:
+        logger.info("Replicas are %.1fs behind, waiting", lag)
+        time.sleep(REPLICATION_POLL_SECONDS)
+
+
+def run_batches(connection: Connection, backfill: Backfill) -> int:
+    """Run a registered backfill to the end on an autocommit connection.
+
+    Returns the number of rows updated by this run.
+    """
+    progress = connection.execute(
+        text(f"SELECT last_key, finished_at FROM {PROGRESS_TABLE} WHERE name = :name"),
+        {"name": backfill.name},
+    ).one()
+    if progress.finished_at is not None:
+        return 0
+
+    last_key = progress.last_key
+    if last_key is not None:
+        logger.info("Resuming backfill %s after %s", backfill.name, last_key)
+    batch_type = key_type(connection, backfill)
+    batch_size, updated = backfill.batch_size, 0
+    while True:
+        wait_for_replicas(connection, backfill.max_replication_lag_seconds)
+        started = time.monotonic()
+        last_key, rows = connection.execute(
+            batch_statement(backfill, batch_type, first=last_key is None),
+            {"name": backfill.name, "after": last_key, "limit": batch_size},
+        ).one()
+        elapsed = time.monotonic() - started
+        if last_key is None:
+            break
+        updated += rows
+        logger.info("Backfill %s: %d rows, up to %s", backfill.name, updated, last_key)
+
+        if elapsed > backfill.target_batch_seconds:
+            batch_size = max(batch_size // 2, 1)
+        elif elapsed < backfill.target_batch_seconds / 2:
+            batch_size = min(batch_size * 2, backfill.batch_size)
+        time.sleep(elapsed * backfill.pause_ratio)
+
+    connection.execute(
+        text(f"UPDATE {PROGRESS_TABLE} SET finished_at = now() WHERE name = :name"),
+        {"name": backfill.name},
+    )
+    logger.info("Backfill %s finished", backfill.name)
+    return updated
+
+
+def run_backfill(backfill: Backfill) -> None:
+    """Run (or with ALEMBIC_DEFER_BACKFILLS, register) a backfill from a migration."""
+    register_backfill(op.get_bind(), backfill)
+    if os.environ.get("ALEMBIC_DEFER_BACKFILLS"):
+        logger.info("Deferring backfill %s", backfill.name)
+        return
+    # Commits the schema changes so far and runs each batch in its own
+    # transaction
+    with op.get_context().autocommit_block():
+        run_batches(op.get_bind(), backfill)
+
+
+def require_backfill(name: str) -> None:
+    """Fail the migration unless the named backfill has finished."""
+    connection = op.get_bind()
+    connection.execute(CREATE_PROGRESS_TABLE)
+    finished = connection.execute(
+        text(
+            f"SELECT finished_at IS NOT NULL FROM {PROGRESS_TABLE} WHERE name = :name"
+        ),
+        {"name": name},
+    ).scalar()
+    if not finished:
+        raise RuntimeError(
+            f"Backfill {name} has not finished; run python -m commands.run_backfills"
+        )
+
+
+def forget_backfill(name: str) -> None:
+    """Drop a backfill's progress, so upgrading again runs it again."""
+    connection = op.get_bind()
+    connection.execute(CREATE_PROGRESS_TABLE)
+    connection.execute(
+        text(f"DELETE FROM {PROGRESS_TABLE} WHERE name = :name"), {"name": name}
+    )
@@ -1,5 +1,6 @@
 import asyncio
 import os
+import re
 from urllib.parse import urlparse
 
 from logging.config import fileConfig
@@ -9,6 +10,7 @@ from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config
 
 from alembic import context
+from alembic_migrations.backfill import PROGRESS_TABLE
 from app.models import Base
 from dotenv import load_dotenv
 
@@ -28,6 +30,15 @@ if config.config_file_name is not None:
 target_metadata = Base.metadata
 # target_metadata = None
 
+
+def include_name(name, type_, parent_names):
+    # The items partitions are created with the table rather than modelled, and
+    # backfill progress is kept alongside alembic_version
+    if type_ == "table":
+        return not re.fullmatch(r"items_p\d+", name) and name != PROGRESS_TABLE
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -67,6 +78,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_name=include_name,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -76,7 +88,11 @@ def run_migrations_offline() -> None:
 
 
 def do_run_migrations(connection: Connection) -> None:
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_name=include_name,
+    )
 
     with context.begin_transaction():
         context.run_migrations()
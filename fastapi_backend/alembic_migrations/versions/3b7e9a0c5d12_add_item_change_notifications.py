@@ -0,0 +1,88 @@
+"""Add item change notifications
+
+Revision ID: 3b7e9a0c5d12
+Revises: d2a6f3b9c184
+Create Date: 2026-10-19 14:26:03.118254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3b7e9a0c5d12"
+down_revision: Union[str, None] = "d2a6f3b9c184"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NOTIFY_ITEM_CHANGES = """
+CREATE OR REPLACE FUNCTION notify_item_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    changed_rows bigint;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT count(*) INTO changed_rows FROM old_items;
+    ELSE
+        SELECT count(*) INTO changed_rows FROM new_items;
+    END IF;
+
+    IF changed_rows > 100 AND TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('item_changes', json_build_object(
+            'event_id', nextval('item_change_event_id_seq'),
+            'op', 'reset', 'user_id', user_id
+        )::text)
+        FROM (SELECT DISTINCT user_id FROM old_items) u;
+    ELSIF changed_rows > 100 THEN
+        PERFORM pg_notify('item_changes', json_build_object(
+            'event_id', nextval('item_change_event_id_seq'),
+            'op', 'reset', 'user_id', user_id
+        )::text)
+        FROM (SELECT DISTINCT user_id FROM new_items) u;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('item_changes', json_build_object(
+            'event_id', nextval('item_change_event_id_seq'),
+            'op', 'delete', 'user_id', user_id, 'id', id, 'version', version
+        )::text)
+        FROM old_items;
+    ELSE
+        PERFORM pg_notify('item_changes', json_build_object(
+            'event_id', nextval('item_change_event_id_seq'),
+            'op', lower(TG_OP), 'user_id', user_id, 'id', id, 'version', version
+        )::text)
+        FROM new_items;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence("item_change_event_id_seq")))
+    op.execute(NOTIFY_ITEM_CHANGES)
+    op.execute(
+        "CREATE TRIGGER items_notify_insert AFTER INSERT ON items "
+        "REFERENCING NEW TABLE AS new_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_item_changes()"
+    )
+    op.execute(
+        "CREATE TRIGGER items_notify_update AFTER UPDATE ON items "
+        "REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_item_changes()"
+    )
+    op.execute(
+        "CREATE TRIGGER items_notify_delete AFTER DELETE ON items "
+        "REFERENCING OLD TABLE AS old_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_item_changes()"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER items_notify_delete ON items")
+    op.execute("DROP TRIGGER items_notify_update ON items")
+    op.execute("DROP TRIGGER items_notify_insert ON items")
+    op.execute("DROP FUNCTION notify_item_changes()")
+    op.execute(sa.schema.DropSequence(sa.Sequence("item_change_event_id_seq")))
@@ -0,0 +1,202 @@
+"""Partition items by user_id
+
+Revision ID: a7d41c9e2b60
+Revises: cc9011a402f7
+Create Date: 2026-10-19 00:12:08.415372
+
+The rows are moved online: a partitioned copy of the table is created and kept
+in sync by a trigger on the old one while the existing rows are copied over in
+batches, each in its own short transaction. Only the final swap takes a lock
+on items, for as long as it takes to drop the old table and rename the new one.
+
+"""
+import logging
+import os
+import time
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a7d41c9e2b60"
+down_revision: Union[str, None] = "cc9011a402f7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger(f"alembic.{__name__}")
+
+# Read from the environment like the app's ITEMS_PARTITION_COUNT setting, which
+# must match it for new databases created from the models
+PARTITION_COUNT = int(os.environ.get("ITEMS_PARTITION_COUNT", "16"))
+BATCH_SIZE = 5000
+# Pause between batches so the copy doesn't starve regular traffic
+BATCH_PAUSE_SECONDS = 0.05
+
+COLUMNS = (
+    "id, name, description, quantity, user_id, version, created_at, updated_at, "
+    "change_xid"
+)
+
+INDEXES = [
+    ("ix_items_user_id_name", ["user_id", "name", "id"], {}),
+    ("ix_items_user_id_quantity", ["user_id", "quantity", "id"], {}),
+    (
+        "ix_items_user_id_lower_name",
+        ["user_id", sa.text("lower(name) text_pattern_ops")],
+        {},
+    ),
+    ("ix_items_user_id_change_xid", ["user_id", "change_xid", "id"], {}),
+    ("ix_items_search_vector", ["search_vector"], {"postgresql_using": "gin"}),
+    (
+        "ix_items_name_trgm",
+        ["name"],
+        {"postgresql_using": "gin", "postgresql_ops": {"name": "gin_trgm_ops"}},
+    ),
+]
+
+TRIGGERS = [
+    "CREATE TRIGGER items_summary_insert AFTER INSERT ON items "
+    "REFERENCING NEW TABLE AS new_items "
+    "FOR EACH STATEMENT EXECUTE FUNCTION apply_item_summary_delta()",
+    "CREATE TRIGGER items_summary_update AFTER UPDATE ON items "
+    "REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items "
+    "FOR EACH STATEMENT EXECUTE FUNCTION apply_item_summary_delta()",
+    "CREATE TRIGGER items_summary_delete AFTER DELETE ON items "
+    "REFERENCING OLD TABLE AS old_items "
+    "FOR EACH STATEMENT EXECUTE FUNCTION apply_item_summary_delta()",
+    "CREATE TRIGGER items_notify_insert AFTER INSERT ON items "
+    "REFERENCING NEW TABLE AS new_items "
+    "FOR EACH STATEMENT EXECUTE FUNCTION notify_item_changes()",
+    "CREATE TRIGGER items_notify_update AFTER UPDATE ON items "
+    "REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items "
+    "FOR EACH STATEMENT EXECUTE FUNCTION notify_item_changes()",
+    "CREATE TRIGGER items_notify_delete AFTER DELETE ON items "
+    "REFERENCING OLD TABLE AS old_items "
+    "FOR EACH STATEMENT EXECUTE FUNCTION notify_item_changes()",
+    "CREATE TRIGGER items_touch BEFORE UPDATE ON items "
+    "FOR EACH ROW EXECUTE FUNCTION touch_item()",
+    "CREATE TRIGGER items_tombstone_delete AFTER DELETE ON items "
+    "REFERENCING OLD TABLE AS old_items "
+    "FOR EACH STATEMENT EXECUTE FUNCTION record_item_tombstones()",
+]
+
+MIRROR_ITEM_CHANGES = f"""
+CREATE FUNCTION mirror_item_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM items_partitioned WHERE id = OLD.id AND user_id = OLD.user_id;
+        RETURN NULL;
+    END IF;
+    INSERT INTO items_partitioned ({COLUMNS})
+    VALUES (
+        NEW.id, NEW.name, NEW.description, NEW.quantity, NEW.user_id,
+        NEW.version, NEW.created_at, NEW.updated_at, NEW.change_xid
+    )
+    ON CONFLICT (id, user_id) DO UPDATE SET
+        name = excluded.name,
+        description = excluded.description,
+        quantity = excluded.quantity,
+        version = excluded.version,
+        created_at = excluded.created_at,
+        updated_at = excluded.updated_at,
+        change_xid = excluded.change_xid;
+    RETURN NULL;
+END
+$$
+"""
+
+# FOR SHARE holds off updates and deletes of the batch's rows until it
+# commits, so the mirror trigger can't run against a row that is only half
+# copied; rows the trigger already wrote win over the older copy.
+COPY_BATCH = f"""
+WITH batch AS (
+    SELECT {COLUMNS} FROM items
+    WHERE id > :after
+    ORDER BY id
+    LIMIT :limit
+    FOR SHARE
+), copied AS (
+    INSERT INTO items_partitioned ({COLUMNS})
+    SELECT {COLUMNS} FROM batch
+    ON CONFLICT (id, user_id) DO NOTHING
+)
+SELECT id, count(*) OVER () FROM batch ORDER BY id DESC LIMIT 1
+"""
+
+
+def create_items_table(name: str, partitioned: bool) -> None:
+    """Create an empty copy of items, with its constraints and indexes."""
+    partition_by = " PARTITION BY HASH (user_id)" if partitioned else ""
+    op.execute(
+        f"CREATE TABLE {name} (LIKE items INCLUDING DEFAULTS INCLUDING GENERATED)"
+        + partition_by
+    )
+    primary_key = "id, user_id" if partitioned else "id"
+    op.execute(
+        f"ALTER TABLE {name} ADD CONSTRAINT {name}_pkey PRIMARY KEY ({primary_key})"
+    )
+    op.create_foreign_key(f"{name}_user_id_fkey", name, "user", ["user_id"], ["id"])
+    if partitioned:
+        for remainder in range(PARTITION_COUNT):
+            op.execute(
+                f"CREATE TABLE items_p{remainder} PARTITION OF {name} "
+                f"FOR VALUES WITH (MODULUS {PARTITION_COUNT}, REMAINDER {remainder})"
+            )
+    for index_name, columns, options in INDEXES:
+        op.create_index(f"{index_name}_new", name, columns, unique=False, **options)
+
+
+def replace_items_table(name: str) -> None:
+    """Swap the table `name` in for items and give it items' names and triggers."""
+    op.execute("LOCK TABLE items IN ACCESS EXCLUSIVE MODE")
+    op.execute("DROP TABLE items")
+    op.execute(f"ALTER TABLE {name} RENAME TO items")
+    op.execute(f"ALTER TABLE items RENAME CONSTRAINT {name}_pkey TO items_pkey")
+    op.execute(
+        f"ALTER TABLE items RENAME CONSTRAINT {name}_user_id_fkey "
+        "TO items_user_id_fkey"
+    )
+    for index_name, _, _ in INDEXES:
+        op.execute(f"ALTER INDEX {index_name}_new RENAME TO {index_name}")
+    for trigger in TRIGGERS:
+        op.execute(trigger)
+
+
+def upgrade() -> None:
+    create_items_table("items_partitioned", partitioned=True)
+    op.execute(MIRROR_ITEM_CHANGES)
+    op.execute(
+        "CREATE TRIGGER items_mirror AFTER INSERT OR UPDATE OR DELETE ON items "
+        "FOR EACH ROW EXECUTE FUNCTION mirror_item_changes()"
+    )
+
+    # Commit the new table and the trigger, then copy in separate transactions
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        after, copied = "00000000-0000-0000-0000-000000000000", 0
+        while True:
+            batch = connection.execute(
+                sa.text(COPY_BATCH), {"after": after, "limit": BATCH_SIZE}
+            ).first()
+            if batch is None:
+                break
+            after, copied = batch[0], copied + batch[1]
+            logger.info("Copied %d items into partitions", copied)
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+    # Changes made since the last batch are already mirrored
+    replace_items_table("items_partitioned")
+    op.execute("DROP FUNCTION mirror_item_changes()")
+
+
+def downgrade() -> None:
+    # Not online: items is locked while the rows are copied back
+    create_items_table("items_unpartitioned", partitioned=False)
+    op.execute("LOCK TABLE items IN SHARE MODE")
+    op.execute(
+        f"INSERT INTO items_unpartitioned ({COLUMNS}) SELECT {COLUMNS} FROM items"
+    )
+    replace_items_table("items_unpartitioned")
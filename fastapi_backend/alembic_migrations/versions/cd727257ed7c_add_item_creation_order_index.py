@@ -0,0 +1,54 @@
+"""Add item creation order index
+
+Revision ID: cd727257ed7c
+Revises: 50a25ccaaa73
+Create Date: 2026-10-19 00:12:58.584916
+
+The index is built on each partition with CREATE INDEX CONCURRENTLY, so items
+stay writable, and then attached to an index on the partitioned table.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "cd727257ed7c"
+down_revision: Union[str, None] = "50a25ccaaa73"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX = "ix_items_user_id_created_at"
+COLUMNS = "user_id, created_at, id"
+
+
+def upgrade() -> None:
+    # Only covers the parent, and stays invalid until every partition's index
+    # is attached
+    op.execute(f"CREATE INDEX {INDEX} ON ONLY items ({COLUMNS})")
+    partitions = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT CAST(inhrelid AS regclass)::text FROM pg_inherits "
+                "WHERE inhparent = CAST('items' AS regclass) ORDER BY 1"
+            )
+        )
+        .scalars()
+        .all()
+    )
+    with op.get_context().autocommit_block():
+        for partition in partitions:
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_{INDEX} "
+                f"ON {partition} ({COLUMNS})"
+            )
+    for partition in partitions:
+        op.execute(f"ALTER INDEX {INDEX} ATTACH PARTITION {partition}_{INDEX}")
+
+
+def downgrade() -> None:
+    # Drops the partitions' indexes along with it
+    op.drop_index(INDEX, table_name="items")
@@ -0,0 +1,45 @@
+"""Add item tombstone retention
+
+Revision ID: e5b8c2f4a913
+Revises: cd727257ed7c
+Create Date: 2026-10-19 10:41:05.218734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e5b8c2f4a913"
+down_revision: Union[str, None] = "cd727257ed7c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+class XID8(sa.types.UserDefinedType):
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "XID8"
+
+
+def upgrade() -> None:
+    op.create_table(
+        "pruned_item_tombstones",
+        sa.Column("user_id", sa.UUID(), nullable=False),
+        sa.Column("change_xid", XID8(), nullable=False),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+    op.create_index(
+        "ix_item_tombstones_deleted_at",
+        "item_tombstones",
+        ["deleted_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_item_tombstones_deleted_at", table_name="item_tombstones")
+    op.drop_table("pruned_item_tombstones")
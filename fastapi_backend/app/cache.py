@@ -0,0 +1,576 @@
+"""Caches for data that's expensive to compute and safe to share.
+
+Each worker has its own memory, so a cache kept in the worker is duplicated
+N times behind the load balancer and goes stale when another worker changes
+what it caches. With CACHE_URL set, the workers share a cache on a server
+speaking the Redis protocol (Redis, Valkey, KeyDB, ...). A small local LRU
+cache sits in front of it for the hottest keys: every write is published on
+a channel that all the workers subscribe to, and each drops its local copy
+of the changed key. Without CACHE_URL, the local LRU cache is used on its own.
+
+Values are bytes; callers choose how to encode them.
+"""
+
+import asyncio
+import logging
+import ssl
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import unquote, urlparse
+from uuid import uuid4
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY_SECONDS = 1.0
+MAX_RECONNECT_DELAY_SECONDS = 30.0
+
+
+class RedisError(Exception):
+    """An error reply from the cache server."""
+
+
+# What a shared cache operation can fail with; the caller gets a miss instead
+CACHE_ERRORS = (OSError, EOFError, asyncio.TimeoutError, RedisError)
+
+
+class CacheStats:
+    """Operations on one tier of a cache and how they went."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.deletes = 0
+        self.cas_conflicts = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "sets": self.sets,
+            "deletes": self.deletes,
+            "cas_conflicts": self.cas_conflicts,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+
+class CacheBackend:
+    """What every cache offers; values are bytes, TTLs are in seconds."""
+
+    tier: str
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    async def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        """Store `value`, for `ttl` seconds or until evicted if None."""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def compare_and_set(
+        self, key: str, expected: bytes | None, value: bytes, ttl: float | None = None
+    ) -> bool:
+        """Store `value` only if the key holds `expected` (None: is missing).
+
+        Returns whether it was stored.
+        """
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def tier_stats(self) -> dict:
+        return {self.tier: self.stats.as_dict()}
+
+
+class LRUCache(CacheBackend):
+    """A cache in this worker's memory, dropping the least recently used
+    entries beyond `max_entries`."""
+
+    tier = "local"
+
+    def __init__(self, max_entries: int):
+        super().__init__()
+        self.max_entries = max_entries
+        # Values with the monotonic time they expire at, least recently used first
+        self._entries: OrderedDict[str, tuple[bytes, float | None]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _live_value(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            self.stats.expirations += 1
+            return None
+        return value
+
+    def _store(self, key: str, value: bytes, ttl: float | None):
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        self.stats.sets += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def get(self, key: str) -> bytes | None:
+        value = self._live_value(key)
+        if value is None:
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        self._store(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self.stats.deletes += 1
+
+    async def compare_and_set(
+        self, key: str, expected: bytes | None, value: bytes, ttl: float | None = None
+    ) -> bool:
+        if self._live_value(key) != expected:
+            self.stats.cas_conflicts += 1
+            return False
+        self._store(key, value, ttl)
+        return True
+
+    def invalidate(self, key: str):
+        """Drop a key another worker changed."""
+        if self._entries.pop(key, None) is not None:
+            self.stats.invalidations += 1
+
+    def clear(self):
+        self.stats.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def tier_stats(self) -> dict:
+        return {self.tier: {**self.stats.as_dict(), "entries": len(self)}}
+
+
+def encode_command(*args) -> bytes:
+    """A command as a RESP array of bulk strings."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+class RedisConnection:
+    """One connection to a server speaking RESP2, the Redis protocol."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, url: str) -> "RedisConnection":
+        """Connect to a redis:// or rediss:// URL, with its password and
+        database number if it has them."""
+        parsed = urlparse(url)
+        reader, writer = await asyncio.open_connection(
+            parsed.hostname or "localhost",
+            parsed.port or 6379,
+            ssl=ssl.create_default_context() if parsed.scheme == "rediss" else None,
+        )
+        connection = cls(reader, writer)
+        try:
+            if parsed.password is not None:
+                credentials = [unquote(parsed.password)]
+                if parsed.username:
+                    credentials.insert(0, unquote(parsed.username))
+                await connection.execute("AUTH", *credentials)
+            database = parsed.path.lstrip("/")
+            if database and database != "0":
+                await connection.execute("SELECT", database)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    async def read_reply(self):
+        """Read one reply; error replies nested in arrays are returned as
+        RedisError instances rather than raised."""
+        line = await self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("The cache server closed the connection")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            return RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            return (await self.reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self.read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from the cache server: {line!r}")
+
+    async def execute(self, *args):
+        self.writer.write(encode_command(*args))
+        await self.writer.drain()
+        reply = await self.read_reply()
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    async def execute_pipeline(self, *commands: tuple) -> list:
+        """Send several commands at once and read all their replies, raising
+        the first error reply once they're all read."""
+        self.writer.write(b"".join(encode_command(*args) for args in commands))
+        await self.writer.drain()
+        replies = [await self.read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    @property
+    def closed(self) -> bool:
+        return self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+def expiry_args(ttl: float | None) -> tuple:
+    # PX takes whole milliseconds, and 0 is an error
+    return () if ttl is None else ("PX", max(int(ttl * 1000), 1))
+
+
+class RedisCache(CacheBackend):
+    """A cache on a Redis-protocol server, shared by every worker.
+
+    Commands run on a pool of up to `pool_size` connections. An operation
+    taking longer than `timeout` is abandoned, and its connection closed, so
+    a slow or unreachable server can't hold up requests for long.
+    """
+
+    tier = "shared"
+
+    def __init__(self, url: str, pool_size: int, timeout: float):
+        super().__init__()
+        self.url = url
+        self.timeout = timeout
+        self._idle: list[RedisConnection] = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self._slots:
+            connection = None
+            while self._idle and connection is None:
+                connection = self._idle.pop()
+                # Closed by the server while idle, e.g. as it restarted
+                if connection.reader.at_eof():
+                    connection.close()
+                    connection = None
+            if connection is None:
+                connection = await RedisConnection.open(self.url)
+            try:
+                yield connection
+            except BaseException as e:
+                # An error reply leaves the connection usable, unless the
+                # user closed it; anything else may have left a reply unread
+                if isinstance(e, RedisError) and not connection.closed:
+                    self._idle.append(connection)
+                else:
+                    connection.close()
+                raise
+            self._idle.append(connection)
+
+    async def execute(self, *args):
+        async def run():
+            async with self.connection() as connection:
+                return await connection.execute(*args)
+
+        return await asyncio.wait_for(run(), self.timeout)
+
+    def _count_lookup(self, value: bytes | None):
+        if value is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+
+    async def get(self, key: str) -> bytes | None:
+        value = await self.execute("GET", key)
+        self._count_lookup(value)
+        return value
+
+    async def get_with_ttl(self, key: str) -> tuple[bytes | None, float | None]:
+        """The value and the seconds it has left, None if it doesn't expire."""
+
+        async def run() -> list:
+            async with self.connection() as connection:
+                return await connection.execute_pipeline(("GET", key), ("PTTL", key))
+
+        value, ttl_ms = await asyncio.wait_for(run(), self.timeout)
+        self._count_lookup(value)
+        if ttl_ms == -1:
+            return value, None
+        # -2: expired between the two commands
+        return value, max(ttl_ms, 0) / 1000
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        await self.execute("SET", key, value, *expiry_args(ttl))
+        self.stats.sets += 1
+
+    async def delete(self, key: str) -> None:
+        await self.execute("DEL", key)
+        self.stats.deletes += 1
+
+    async def compare_and_set(
+        self, key: str, expected: bytes | None, value: bytes, ttl: float | None = None
+    ) -> bool:
+        """WATCH the key, check it and set it in a MULTI; the server refuses
+        the transaction if the key changed after the WATCH."""
+
+        async def run() -> bool:
+            async with self.connection() as connection:
+                await connection.execute("WATCH", key)
+                try:
+                    if await connection.execute("GET", key) != expected:
+                        await connection.execute("UNWATCH")
+                        return False
+                    await connection.execute("MULTI")
+                    await connection.execute("SET", key, value, *expiry_args(ttl))
+                    return await connection.execute("EXEC") is not None
+                except RedisError:
+                    # E.g. WRONGTYPE: the connection may still be watching the
+                    # key or inside MULTI, so it isn't pooled for the next user
+                    connection.close()
+                    raise
+
+        stored = await asyncio.wait_for(run(), self.timeout)
+        if stored:
+            self.stats.sets += 1
+        else:
+            self.stats.cas_conflicts += 1
+        return stored
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self.execute("PUBLISH", channel, message)
+
+    async def subscribe(self, channel: str) -> RedisConnection:
+        """A new connection subscribed to `channel`; read its messages with
+        `read_reply`."""
+        connection = await RedisConnection.open(self.url)
+        try:
+            await asyncio.wait_for(
+                connection.execute("SUBSCRIBE", channel), self.timeout
+            )
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+class NearCache(CacheBackend):
+    """A local LRU cache in front of a shared one, kept coherent by pub/sub.
+
+    Reads try the local cache first, then the shared cache, keeping what they
+    find locally for at most `local_ttl` seconds, and no longer than it has
+    left in the shared cache. Writes go to the shared
+    cache, and then the key is published on `channel`: every other worker
+    drops its local copy. The local cache is only used while the
+    subscription is up, and is cleared whenever it (re)connects, as
+    invalidations may have been missed in between. `local_ttl` bounds how
+    stale a local copy can be if a message is lost anyway.
+
+    A failing shared cache makes reads miss and writes be skipped, and is
+    counted in the shared tier's errors.
+    """
+
+    tier = "near"
+
+    def __init__(
+        self, local: LRUCache, shared: RedisCache, channel: str, local_ttl: float
+    ):
+        super().__init__()
+        self.local = local
+        self.shared = shared
+        self.channel = channel
+        self.local_ttl = local_ttl
+        # Tags this worker's own invalidations, which it doesn't need to apply
+        self.origin = uuid4().hex
+        self._subscribed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def _local_ttl(self, ttl: float | None) -> float:
+        return self.local_ttl if ttl is None else min(ttl, self.local_ttl)
+
+    def _shared_failed(self, operation: str, key: str):
+        self.shared.stats.errors += 1
+        logger.warning("Shared cache %s failed", operation, extra={"cache_key": key})
+
+    async def get(self, key: str) -> bytes | None:
+        if self._subscribed.is_set():
+            value = await self.local.get(key)
+            if value is not None:
+                return value
+        try:
+            value, ttl = await self.shared.get_with_ttl(key)
+        except CACHE_ERRORS:
+            self._shared_failed("get", key)
+            return None
+        ttl = self._local_ttl(ttl)
+        if value is not None and ttl > 0 and self._subscribed.is_set():
+            await self.local.set(key, value, ttl)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        try:
+            await self.shared.set(key, value, ttl)
+        except CACHE_ERRORS:
+            self._shared_failed("set", key)
+            await self.local.delete(key)
+            return
+        await self.local.set(key, value, self._local_ttl(ttl))
+        await self._invalidate_others(key)
+
+    async def delete(self, key: str) -> None:
+        await self.local.delete(key)
+        try:
+            await self.shared.delete(key)
+        except CACHE_ERRORS:
+            self._shared_failed("delete", key)
+            return
+        await self._invalidate_others(key)
+
+    async def compare_and_set(
+        self, key: str, expected: bytes | None, value: bytes, ttl: float | None = None
+    ) -> bool:
+        try:
+            stored = await self.shared.compare_and_set(key, expected, value, ttl)
+        except CACHE_ERRORS:
+            self._shared_failed("compare-and-set", key)
+            stored = False
+        if not stored:
+            # Whatever is cached locally didn't match the shared value
+            await self.local.delete(key)
+            return False
+        await self.local.set(key, value, self._local_ttl(ttl))
+        await self._invalidate_others(key)
+        return True
+
+    async def _invalidate_others(self, key: str):
+        try:
+            await self.shared.publish(self.channel, f"{self.origin} {key}")
+        except CACHE_ERRORS:
+            # Other workers' copies expire after local_ttl at the latest
+            self._shared_failed("invalidation", key)
+
+    def _on_invalidation(self, message: bytes):
+        origin, _, key = message.decode().partition(" ")
+        if origin != self.origin:
+            self.local.invalidate(key)
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+
+    async def wait_until_subscribed(self, timeout: float):
+        await asyncio.wait_for(self._subscribed.wait(), timeout)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.shared.close()
+
+    async def _listen(self):
+        delay = RECONNECT_DELAY_SECONDS
+        while True:
+            connection = None
+            try:
+                connection = await self.shared.subscribe(self.channel)
+                self.local.clear()
+                self._subscribed.set()
+                delay = RECONNECT_DELAY_SECONDS
+                while True:
+                    message = await connection.read_reply()
+                    if isinstance(message, list) and message[0] == b"message":
+                        self._on_invalidation(message[2])
+            except CACHE_ERRORS:
+                logger.exception("Cache invalidation subscription failed, retrying")
+            finally:
+                self._subscribed.clear()
+                if connection is not None:
+                    connection.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+
+    def tier_stats(self) -> dict:
+        return {
+            **self.local.tier_stats(),
+            **self.shared.tier_stats(),
+            "subscribed": self._subscribed.is_set(),
+        }
+
+
+def create_cache() -> CacheBackend:
+    local = LRUCache(settings.CACHE_LOCAL_MAX_ENTRIES)
+    if settings.CACHE_URL is None:
+        return local
+    return NearCache(
+        local,
+        RedisCache(
+            settings.CACHE_URL,
+            pool_size=settings.CACHE_POOL_SIZE,
+            timeout=settings.CACHE_TIMEOUT_SECONDS,
+        ),
+        channel=settings.CACHE_INVALIDATION_CHANNEL,
+        local_ttl=settings.CACHE_LOCAL_TTL_SECONDS,
+    )
+
+
+cache = create_cache()
+
+
+def get_cache() -> CacheBackend:
+    return cache
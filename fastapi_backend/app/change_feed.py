@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from dataclasses import dataclass
+from uuid import UUID
+
+import asyncpg
+from fastapi import Depends
+
+from .config import settings
+from .database import shard_engines
+from .models import ITEM_CHANGES_CHANNEL, User
+from .users import current_active_user
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY_SECONDS = 1.0
+MAX_RECONNECT_DELAY_SECONDS = 30.0
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    """An item change, or a "reset" telling the client to reload its items."""
+
+    id: int | None
+    user_id: UUID | None
+    op: str
+    data: dict
+
+    def to_sse(self) -> str:
+        event_id = f"id: {self.id}\n" if self.id is not None else ""
+        return f"{event_id}event: {self.op}\ndata: {json.dumps(self.data)}\n\n"
+
+
+def reset_event(user_id: UUID | None = None) -> ChangeEvent:
+    return ChangeEvent(id=None, user_id=user_id, op="reset", data={})
+
+
+# Queued to a subscription when the feed shuts down
+CLOSED = ChangeEvent(id=None, user_id=None, op="closed", data={})
+
+
+class Subscription:
+    """One client's bounded queue of change events.
+
+    A client that falls `buffer_size` events behind has its backlog replaced by
+    a single reset, so a slow reader costs a fixed amount of memory and simply
+    reloads its items once it catches up.
+    """
+
+    def __init__(self, user_id: UUID, buffer_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue[ChangeEvent] = asyncio.Queue(buffer_size)
+
+    def push(self, event: ChangeEvent):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(CLOSED if event is CLOSED else reset_event())
+
+    async def get(self) -> ChangeEvent:
+        return await self.queue.get()
+
+
+class ChangeFeed:
+    """Fans item change notifications out to the connected clients of each user.
+
+    A single LISTEN connection per worker, opened on the first subscription,
+    receives the NOTIFY events sent by the triggers on `items`. The most
+    recent events are kept so a reconnecting client can resume from its last
+    event id; every worker sees the notifications in the same commit order, so
+    this works across workers as long as the id is still in the buffer.
+    Otherwise, or if the LISTEN connection dropped and events may have been
+    missed, clients get a reset.
+    """
+
+    def __init__(self, dsn: str, buffer_size: int, replay_size: int):
+        self.dsn = dsn
+        self.buffer_size = buffer_size
+        self._subscriptions: dict[UUID, set[Subscription]] = {}
+        self._recent: deque[ChangeEvent] = deque(maxlen=replay_size)
+        self._listening = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self, timeout: float):
+        """Start listening if needed and wait until the LISTEN is in place."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+        await asyncio.wait_for(self._listening.wait(), timeout)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.push(CLOSED)
+
+    def subscribe(self, user_id: UUID, last_event_id: int | None = None):
+        subscription = Subscription(user_id, self.buffer_size)
+        if last_event_id is not None:
+            for event in self.replay_after(last_event_id, user_id):
+                subscription.push(event)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    def replay_after(self, last_event_id: int, user_id: UUID) -> list[ChangeEvent]:
+        recent = list(self._recent)
+        for index, event in enumerate(recent):
+            if event.id == last_event_id:
+                return [e for e in recent[index + 1 :] if e.user_id == user_id]
+        return [reset_event(user_id)]
+
+    def publish(self, event: ChangeEvent):
+        self._recent.append(event)
+        for subscription in self._subscriptions.get(event.user_id, ()):
+            subscription.push(event)
+
+    def end_streams(self, user_id: UUID):
+        """Reset and close a user's streams, e.g. once they moved to another shard.
+
+        Their clients reload and reconnect, which gets them the new shard's feed.
+        """
+        for subscription in self._subscriptions.pop(user_id, ()):
+            subscription.push(reset_event(user_id))
+            subscription.push(CLOSED)
+
+    def reset_all(self):
+        """Tell every client to reload, e.g. after notifications may have been lost."""
+        self._recent.clear()
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.push(reset_event(subscription.user_id))
+
+    def _on_notification(self, connection, pid, channel, payload: str):
+        message = json.loads(payload)
+        user_id = UUID(message.pop("user_id"))
+        if message["op"] == "moved":
+            self.end_streams(user_id)
+            return
+        event_id = message.pop("event_id")
+        op = message.pop("op")
+        self.publish(ChangeEvent(id=event_id, user_id=user_id, op=op, data=message))
+
+    async def _listen(self):
+        delay = RECONNECT_DELAY_SECONDS
+        reconnecting = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                terminated = asyncio.Event()
+                connection.add_termination_listener(lambda _: terminated.set())
+                await connection.add_listener(
+                    ITEM_CHANGES_CHANNEL, self._on_notification
+                )
+                if reconnecting:
+                    self.reset_all()
+                reconnecting = True
+                delay = RECONNECT_DELAY_SECONDS
+                self._listening.set()
+                await terminated.wait()
+                logger.warning("Change feed connection lost, reconnecting")
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                logger.exception("Change feed connection failed, retrying")
+            finally:
+                self._listening.clear()
+                if connection is not None and not connection.is_closed():
+                    await connection.close(timeout=1)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+
+
+# One feed per shard, each listening to the notifications of its own database
+change_feeds = [
+    ChangeFeed(
+        shard_engine.url.set(drivername="postgresql").render_as_string(
+            hide_password=False
+        ),
+        buffer_size=settings.CHANGE_FEED_CLIENT_BUFFER_SIZE,
+        replay_size=settings.CHANGE_FEED_REPLAY_SIZE,
+    )
+    for shard_engine in shard_engines
+]
+
+
+def get_change_feed(user: User = Depends(current_active_user)) -> ChangeFeed:
+    return change_feeds[user.shard]
@@ -0,0 +1,310 @@
+import gzip
+import hashlib
+import zlib
+from collections import OrderedDict
+from typing import Callable
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - installed with the "compression" extra
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - installed with the "compression" extra
+    zstandard = None
+
+GZIP_LEVEL = 6
+# Quality 4 keeps brotli close to gzip's speed while still compressing smaller;
+# the higher qualities are meant for static assets compressed ahead of time.
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# Bodies above this size are compressed in a worker thread so a large item
+# list does not stall the event loop.
+THREAD_OFFLOAD_SIZE = 256 * 1024
+
+COMPRESSIBLE_CONTENT_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/x-ndjson",
+    "application/msgpack",
+    "image/svg+xml",
+}
+
+
+class GzipStream:
+    def __init__(self):
+        self._compressor = zlib.compressobj(
+            GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdStream:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def _available_encoders() -> dict[str, tuple[Callable[[bytes], bytes], type]]:
+    """Map each supported content coding to its one-shot and streaming compressor.
+
+    Ordered by server preference, used to break ties between equally weighted
+    codings in Accept-Encoding.
+    """
+    encoders: dict[str, tuple[Callable[[bytes], bytes], type]] = {}
+    if zstandard is not None:
+        encoders["zstd"] = (
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress,
+            ZstdStream,
+        )
+    if brotli is not None:
+        encoders["br"] = (
+            lambda data: brotli.compress(data, quality=BROTLI_QUALITY),
+            BrotliStream,
+        )
+    encoders["gzip"] = (
+        lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0),
+        GzipStream,
+    )
+    return encoders
+
+
+ENCODERS = _available_encoders()
+
+
+def select_encoding(accept_encoding: str) -> str | None:
+    """Pick the best supported coding from an Accept-Encoding header value."""
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+
+    best, best_weight = None, 0.0
+    for coding in ENCODERS:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def is_compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    if "no-transform" in headers.get("cache-control", ""):
+        return False
+    content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    # Server-sent events must reach the client unbuffered, so leave them alone
+    if content_type == "text/event-stream":
+        return False
+    return (
+        content_type.startswith("text/")
+        or content_type.endswith("+json")
+        or content_type in COMPRESSIBLE_CONTENT_TYPES
+    )
+
+
+class CompressedBodyCache:
+    """LRU cache of compressed bodies keyed by (body digest, content coding).
+
+    Bounded both by entry count and by the total size of the cached bodies,
+    so a few large exports can't pin an unbounded amount of memory.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str, encoding: str) -> bytes | None:
+        body = self._entries.get((digest, encoding))
+        if body is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((digest, encoding))
+        self.hits += 1
+        return body
+
+    def set(self, digest: str, encoding: str, body: bytes) -> None:
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return
+        previous = self._entries.pop((digest, encoding), None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[(digest, encoding)] = body
+        self.size += len(body)
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class CompressionMiddleware:
+    """Compresses responses with zstd, brotli or gzip based on Accept-Encoding.
+
+    Complete bodies smaller than `minimum_size` are sent as-is. Larger ones are
+    compressed once and cached by a digest of the body, so identical responses
+    such as the OpenAPI document are not recompressed. ETags are not used as
+    the key: they are only unique per resource (every item's second version
+    is "2"), and the digest is cheap next to the compression it saves.
+    Streaming responses are compressed chunk by chunk with a flush after each
+    one, so exports keep flowing to the client.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1000,
+        cache_size: int = 128,
+        cache_max_bytes: int = 16 * 1024 * 1024,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = CompressedBodyCache(cache_size, cache_max_bytes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = select_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream = send
+        self.start_message: Message | None = None
+        self.stream: GzipStream | BrotliStream | ZstdStream | None = None
+        self.passthrough = False
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = message["status"] in (204, 304) or not is_compressible(
+                headers
+            )
+            if self.passthrough:
+                await self.downstream(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.downstream(message)
+            return
+
+        assert self.start_message is not None
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.stream is not None:
+            chunk = self.stream.compress(body) if body else b""
+            if not more_body:
+                chunk += self.stream.finish()
+            await self.downstream(
+                {"type": "http.response.body", "body": chunk, "more_body": more_body}
+            )
+            return
+
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        if not more_body:
+            await self.send_complete(headers, body)
+            return
+
+        # First chunk of a streamed body: the total size is unknown, so
+        # compress incrementally and let the server use chunked encoding.
+        self.stream = ENCODERS[self.encoding][1]()
+        self.set_encoding_headers(headers)
+        del headers["content-length"]
+        await self.downstream(self.start_message)
+        await self.downstream(
+            {
+                "type": "http.response.body",
+                "body": self.stream.compress(body),
+                "more_body": True,
+            }
+        )
+
+    async def send_complete(self, headers: MutableHeaders, body: bytes):
+        if len(body) < self.middleware.minimum_size:
+            await self.downstream(self.start_message)
+            await self.downstream({"type": "http.response.body", "body": body})
+            return
+
+        cache = self.middleware.cache
+        cacheable = self.start_message["status"] == 200
+        key = hashlib.blake2b(body, digest_size=16).hexdigest()
+        compressed = cache.get(key, self.encoding) if cacheable else None
+        if compressed is None:
+            compress = ENCODERS[self.encoding][0]
+            if len(body) >= THREAD_OFFLOAD_SIZE:
+                compressed = await anyio.to_thread.run_sync(compress, body)
+            else:
+                compressed = compress(body)
+            if cacheable:
+                cache.set(key, self.encoding, compressed)
+
+        self.set_encoding_headers(headers)
+        headers["content-length"] = str(len(compressed))
+        await self.downstream(self.start_message)
+        await self.downstream({"type": "http.response.body", "body": compressed})
+
+    def set_encoding_headers(self, headers: MutableHeaders):
+        headers["content-encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        # The compressed bytes differ from the identity representation, so a
+        # strong validator no longer applies to them.
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["etag"] = f"W/{etag}"
@@ -1,4 +1,4 @@
-from typing import Set
+from typing import Literal, Set
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -11,9 +11,100 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     TEST_DATABASE_URL: str | None = None
     EXPIRE_ON_COMMIT: bool = False
+    # A pool size of 0 disables pooling (NullPool), which suits serverless deploys
+    DATABASE_POOL_SIZE: int = 0
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30.0
+    DATABASE_WARM_UP_CONNECTIONS: int = 1
+    # Return a request's connections once the route is done with them, rather
+    # than after its response is serialized
+    DATABASE_EARLY_RELEASE: bool = True
+    # SQLAlchemy's compiled SQL cache, shared by every connection
+    DATABASE_COMPILED_CACHE_SIZE: int = 500
+    # Prepared statements cached on each connection
+    DATABASE_STATEMENT_CACHE_SIZE: int = 100
+    # Set when connecting through a transaction-level pooler (e.g. PgBouncer
+    # in transaction mode); disables the prepared statement cache
+    DATABASE_TRANSACTION_POOLER: bool = False
+    # Extra databases holding users' items. DATABASE_URL is the directory of
+    # users and also shard 0; shards are numbered in order after it, so only
+    # ever append to the list.
+    DATABASE_SHARD_URLS: list[str] = []
+    # Hash partitions of the items table. Only read when the table is created;
+    # changing it afterwards means moving the rows into a new table.
+    ITEMS_PARTITION_COUNT: int = 16
+
+    # Lifespan and health checks
+    SHUTDOWN_DRAIN_TIMEOUT_SECONDS: float = 10.0
+    READINESS_DB_TIMEOUT_SECONDS: float = 2.0
+    READINESS_MAX_POOL_USAGE: float = 0.9
+
+    # Logging: records are JSON lines ("json") or plain text ("text"), written
+    # to stdout by a background thread. The queue bounds the records waiting to
+    # be written; beyond it they're dropped rather than blocking requests.
+    # Only LOG_INFO_SAMPLE_RATE of INFO and DEBUG records are kept, sampled by
+    # request.
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: Literal["json", "text"] = "json"
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_INFO_SAMPLE_RATE: float = 1.0
+
+    # Superuser profiling: the longest /debug/profile run, which should stay
+    # under the request deadline, and the sampling intervals of worker and
+    # single-request (X-Profile) profiles
+    PROFILER_MAX_SECONDS: float = 20.0
+    PROFILER_INTERVAL_SECONDS: float = 0.005
+    PROFILER_REQUEST_INTERVAL_SECONDS: float = 0.001
+
+    # Seconds a request may take before it's stopped with a 504, by default
+    # and by route name, e.g. {"read_item": 5}. Its database transactions'
+    # statement_timeout is set to the time it has left. Streaming imports
+    # copy about a million rows a minute, so they get longer.
+    REQUEST_DEADLINE_SECONDS: float = 30.0
+    REQUEST_DEADLINES: dict[str, float] = {"import_items": 300.0}
+    # How long a statement may wait for a lock before the request gets a 503
+    DATABASE_LOCK_TIMEOUT_SECONDS: float = 5.0
+
+    # Item change feed
+    CHANGE_FEED_HEARTBEAT_SECONDS: float = 15.0
+    CHANGE_FEED_START_TIMEOUT_SECONDS: float = 5.0
+    CHANGE_FEED_CLIENT_BUFFER_SIZE: int = 100
+    CHANGE_FEED_REPLAY_SIZE: int = 1000
+
+    # Group commit of concurrent item creates: each batch is one INSERT and
+    # one commit, written after at most the delay or once it is full
+    ITEM_INSERT_BATCHING: bool = False
+    ITEM_INSERT_BATCH_MAX_SIZE: int = 100
+    ITEM_INSERT_BATCH_MAX_DELAY_SECONDS: float = 0.002
+
+    # Delta sync: tombstones of deleted items are kept this long, and older
+    # sync cursors are rejected once they have been deleted
+    ITEM_TOMBSTONE_RETENTION_SECONDS: int = 30 * 24 * 3600
+    ITEM_TOMBSTONE_CLEANUP_INTERVAL_SECONDS: float = 3600.0
+
+    # Idempotency keys on the mutating item routes
+    IDEMPOTENCY_KEY_TTL_SECONDS: int = 24 * 3600
+    IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS: float = 600.0
+
+    # Shared cache on a Redis-protocol server, e.g. redis://cache:6379/0, with
+    # a local LRU cache in front of it kept coherent through pub/sub on the
+    # invalidation channel. Without a URL, each worker only has the local one.
+    CACHE_URL: str | None = None
+    CACHE_LOCAL_MAX_ENTRIES: int = 10000
+    # The longest a local copy can be served stale if an invalidation is lost
+    CACHE_LOCAL_TTL_SECONDS: float = 5.0
+    CACHE_POOL_SIZE: int = 10
+    CACHE_TIMEOUT_SECONDS: float = 0.5
+    CACHE_INVALIDATION_CHANNEL: str = "cache-invalidation"
 
     # User
     ACCESS_SECRET_KEY: str
+    # Named in the kid header of the access tokens signed with ACCESS_SECRET_KEY
+    ACCESS_SECRET_KEY_ID: str = "1"
+    # Retired access token keys by id, still accepted until their tokens expire
+    ACCESS_VERIFICATION_KEYS: dict[str, str] = {}
+    # Verified access tokens remembered per worker
+    ACCESS_TOKEN_CACHE_SIZE: int = 10000
     RESET_PASSWORD_SECRET_KEY: str
     VERIFICATION_SECRET_KEY: str
     ALGORITHM: str = "HS256"
@@ -32,6 +123,11 @@ class Settings(BaseSettings):
     VALIDATE_CERTS: bool = True
     TEMPLATE_DIR: str = "email_templates"
 
+    # Response compression
+    COMPRESSION_MINIMUM_SIZE: int = 1000
+    COMPRESSION_CACHE_SIZE: int = 128
+    COMPRESSION_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+
     # Frontend
     FRONTEND_URL: str = "http://localhost:3000"
 
@@ -1,40 +1,349 @@
+import asyncio
+import functools
+from hashlib import blake2b
 from typing import AsyncGenerator
 from urllib.parse import urlparse
+from uuid import UUID, uuid4
 
 from fastapi import Depends
+from fastapi.routing import APIRoute
 from fastapi_users.db import SQLAlchemyUserDatabase
-from sqlalchemy import NullPool
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import NullPool, QueuePool, delete, event, select, text
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+from sqlalchemy.exc import UnboundExecutionError
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session
 
 from .config import settings
-from .models import Base, User
+from .deadlines import current_deadline
+from .models import (
+    Base,
+    IdempotencyKey,
+    Item,
+    ItemSummary,
+    ItemTombstone,
+    PrunedItemTombstones,
+    User,
+)
 
 
-parsed_db_url = urlparse(settings.DATABASE_URL)
+def async_connection_url(url: str) -> str:
+    parsed_db_url = urlparse(url)
+    return (
+        f"postgresql+asyncpg://{parsed_db_url.username}:{parsed_db_url.password}@"
+        f"{parsed_db_url.hostname}{':' + str(parsed_db_url.port) if parsed_db_url.port else ''}"
+        f"{parsed_db_url.path}"
+    )
 
-async_db_connection_url = (
-    f"postgresql+asyncpg://{parsed_db_url.username}:{parsed_db_url.password}@"
-    f"{parsed_db_url.hostname}{':' + str(parsed_db_url.port) if parsed_db_url.port else ''}"
-    f"{parsed_db_url.path}"
-)
 
-# Disable connection pooling for serverless environments like Vercel
-engine = create_async_engine(async_db_connection_url, poolclass=NullPool)
+def statement_cache_connect_args() -> dict:
+    """asyncpg connection arguments for the prepared statement cache.
+
+    Behind a transaction-level pooler such as PgBouncer each transaction may
+    run on a different server connection, so a statement prepared in one
+    can't be reused in the next, and asyncpg's sequential statement names
+    collide with those of other clients sharing the server connection.
+    Caching is then turned off and every statement gets a unique name.
+    """
+    if settings.DATABASE_TRANSACTION_POOLER:
+        return {
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            # asyncpg's own cache, used for its introspection queries
+            "statement_cache_size": 0,
+        }
+    return {"prepared_statement_cache_size": settings.DATABASE_STATEMENT_CACHE_SIZE}
+
+
+engine_options = {
+    "query_cache_size": settings.DATABASE_COMPILED_CACHE_SIZE,
+    "connect_args": statement_cache_connect_args(),
+}
+
+
+def create_database_engine(url: str) -> AsyncEngine:
+    if settings.DATABASE_POOL_SIZE > 0:
+        return create_async_engine(
+            async_connection_url(url),
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+            pool_pre_ping=True,
+            **engine_options,
+        )
+    # Disable connection pooling for serverless environments like Vercel. Each
+    # connection's prepared statements are lost when it closes, so only
+    # SQLAlchemy's compiled cache carries over between requests.
+    return create_async_engine(
+        async_connection_url(url), poolclass=NullPool, **engine_options
+    )
+
+
+# The directory database holds the users. It is also shard 0, so without any
+# extra shard URLs everything lives in the one database.
+engine = create_database_engine(settings.DATABASE_URL)
+shard_engines = [
+    engine,
+    *(create_database_engine(url) for url in settings.DATABASE_SHARD_URLS),
+]
+
+
+def home_shard(user_id: UUID) -> int:
+    """The shard a user is placed on, by rendezvous hashing of their id.
+
+    Each shard gets a score from the id and the highest wins. Adding a shard
+    only changes the home of the users whose score it wins, about 1/n of them,
+    so rebalancing after growing the shard map moves as few users as possible.
+    """
+
+    def score(shard: int) -> bytes:
+        return blake2b(user_id.bytes + shard.to_bytes(4, "big"), digest_size=8).digest()
+
+    return max(range(len(shard_engines)), key=score)
+
+
+class StatementCacheStats:
+    """Hit and miss counts for the compiled and prepared statement caches."""
+
+    def __init__(self):
+        self.compiled_hits = 0
+        self.compiled_misses = 0
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+
+    def record(self, cursor, statement, context, executemany):
+        if context.cache_hit is CACHE_HIT:
+            self.compiled_hits += 1
+        elif context.cache_hit is CACHE_MISS:
+            self.compiled_misses += 1
 
+        # executemany() doesn't go through the prepared statement cache
+        adapted = getattr(cursor, "_adapt_connection", None)
+        cache = getattr(adapted, "_prepared_statement_cache", None)
+        if cache is None or executemany:
+            return
+        if statement in cache:
+            self.prepared_hits += 1
+        else:
+            self.prepared_misses += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "compiled": hit_rate(self.compiled_hits, self.compiled_misses),
+            "prepared": hit_rate(self.prepared_hits, self.prepared_misses),
+        }
+
+
+def hit_rate(hits: int, misses: int) -> dict:
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else None,
+    }
+
+
+def track_statement_cache(engine: AsyncEngine, stats: StatementCacheStats) -> None:
+    def before_cursor_execute(conn, cursor, statement, params, context, executemany):
+        stats.record(cursor, statement, context, executemany)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+statement_cache_stats = StatementCacheStats()
+for shard_engine in shard_engines:
+    track_statement_cache(shard_engine, statement_cache_stats)
+
+
+class ShardSession(Session):
+    """A session that runs on the shard set in its `info`."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        shard = self.info.get("shard")
+        if shard is None:
+            raise UnboundExecutionError("Session is not bound to a shard")
+        return shard_engines[shard].sync_engine
+
+
+# Sessions on user data; they are bound to a shard once the user is known
 async_session_maker = async_sessionmaker(
+    sync_session_class=ShardSession, expire_on_commit=settings.EXPIRE_ON_COMMIT
+)
+directory_session_maker = async_sessionmaker(
     engine, expire_on_commit=settings.EXPIRE_ON_COMMIT
 )
 
 
+def bind_to_shard(session: AsyncSession, shard: int) -> None:
+    session.info["shard"] = shard
+
+
+def shard_session(shard: int) -> AsyncSession:
+    return async_session_maker(info={"shard": shard})
+
+
+def warm_up_statements() -> list:
+    """Statements issued on most authenticated requests.
+
+    Running them once per warmed connection fills SQLAlchemy's compiled cache
+    and asyncpg's prepared statement cache before real traffic arrives, so
+    they must be built exactly as the routes build them.
+    """
+    # Imported here: the routes depend on this module for their sessions
+    from .routes.items import build_item_list_query
+    from .schemas import ItemListQuery
+
+    return [
+        select(User).where(User.id == UUID(int=0)),
+        build_item_list_query(UUID(int=0), ItemListQuery()),
+    ]
+
+
 async def create_db_and_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    for shard_engine in shard_engines:
+        async with shard_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+
+async def warm_up_engine(connections: int) -> None:
+    """Open `connections` connections at once to each shard and prime their
+    statement caches.
+
+    The connections are held concurrently so the pools really grow to that
+    size, then returned to them. Pointless under NullPool, where they would be
+    closed along with their caches.
+    """
+
+    statements = warm_up_statements()
+
+    async def prime_connection(shard_engine: AsyncEngine):
+        async with shard_engine.connect() as conn:
+            for statement in statements:
+                await conn.execute(statement)
+
+    if isinstance(shard_engines[0].pool, QueuePool):
+        connections = min(connections, settings.DATABASE_POOL_SIZE)
+    await asyncio.gather(
+        *(
+            prime_connection(shard_engine)
+            for shard_engine in shard_engines
+            for _ in range(connections)
+        )
+    )
+
+
+async def ping_database() -> None:
+    async def ping(shard_engine: AsyncEngine):
+        async with shard_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping(shard_engine) for shard_engine in shard_engines))
+
+
+def get_pool_usage() -> float | None:
+    """Fraction of the pool's capacity currently checked out, on the busiest
+    shard.
+
+    Returns None when pooling is disabled, since every request then opens its
+    own connection and there is nothing to saturate.
+    """
+    pools = [shard_engine.pool for shard_engine in shard_engines]
+    if not isinstance(pools[0], QueuePool):
+        return None
+    capacity = settings.DATABASE_POOL_SIZE + max(settings.DATABASE_MAX_OVERFLOW, 0)
+    return max(pool.checkedout() for pool in pools) / capacity
+
+
+async def dispose_engines() -> None:
+    for shard_engine in shard_engines:
+        await shard_engine.dispose()
+
+
+async def delete_user_items(session: AsyncSession, user_id: UUID) -> None:
+    """Delete everything a user owns on the session's shard.
+
+    There are no foreign keys to cascade from the directory, so this is called
+    when a user is deleted or moved off the shard.
+    """
+    # Items first: their triggers write tombstones and the summary
+    for model in (
+        Item,
+        ItemTombstone,
+        PrunedItemTombstones,
+        ItemSummary,
+        IdempotencyKey,
+    ):
+        await session.execute(delete(model).where(model.user_id == user_id))
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_maker() as session:
+    """A session on the current user's shard.
+
+    It is bound by `current_active_user`, which every route using it depends on.
+    Its transactions' statement and lock timeouts are limited to the time the
+    request has left. It only checks out a connection for its first query, and
+    routes using `SessionReleasingRoute` return it as soon as they're done.
+    """
+    async with async_session_maker(
+        info={"deadline": current_deadline.get()}
+    ) as session:
+        yield session
+
+
+def release_sessions(endpoint):
+    """Wraps a route endpoint to close the sessions it's given once it returns.
+
+    Otherwise they, and any connection they hold, only close once the
+    dependencies exit, after the response has been validated and serialized.
+    Closing rolls back a transaction left open, as exiting the dependency
+    would, and detaches the loaded objects, which can still be serialized.
+    """
+
+    @functools.wraps(endpoint)
+    async def release_after(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            if settings.DATABASE_EARLY_RELEASE:
+                for value in kwargs.values():
+                    if isinstance(value, AsyncSession):
+                        await value.close()
+
+    return release_after
+
+
+class SessionReleasingRoute(APIRoute):
+    """A route that returns its database connections as soon as its endpoint
+    returns, rather than after the response is serialized."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            endpoint = self.wrap_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def wrap_endpoint(self, endpoint):
+        """Wraps an async endpoint; subclasses add their own wrappers."""
+        return release_sessions(endpoint)
+
+
+async def get_directory_session() -> AsyncGenerator[AsyncSession, None]:
+    async with directory_session_maker() as session:
         yield session
 
 
-async def get_user_db(session: AsyncSession = Depends(get_async_session)):
-    yield SQLAlchemyUserDatabase(session, User)
+class UserDirectory(SQLAlchemyUserDatabase):
+    """The users table, placing each new user on their home shard."""
+
+    async def create(self, create_dict: dict) -> User:
+        user_id = create_dict.setdefault("id", uuid4())
+        create_dict.setdefault("shard", home_shard(user_id))
+        return await super().create(create_dict)
+
+
+async def get_user_db(session: AsyncSession = Depends(get_directory_session)):
+    yield UserDirectory(session, User)
@@ -0,0 +1,214 @@
+import asyncio
+from contextvars import ContextVar
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import settings
+
+# Postgres errors raised by statement_timeout and lock_timeout
+QUERY_CANCELED = "57014"
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+class DeadlineStats:
+    """Requests stopped because the client left or their deadline passed."""
+
+    def __init__(self):
+        self.cancelled = 0
+        self.timed_out = 0
+
+    def as_dict(self) -> dict:
+        return {"cancelled": self.cancelled, "timed_out": self.timed_out}
+
+
+deadline_stats = DeadlineStats()
+
+
+class RequestDeadline:
+    """The time a request must be answered by.
+
+    The route is only known once the request has been routed, so the deadline
+    is worked out from the route's entry in `route_timeouts`, if any, when
+    it's asked for.
+    """
+
+    def __init__(
+        self, scope: Scope, default_timeout: float, route_timeouts: dict[str, float]
+    ):
+        self.scope = scope
+        self.default_timeout = default_timeout
+        self.route_timeouts = route_timeouts
+        self.started_at = asyncio.get_running_loop().time()
+
+    @property
+    def timeout(self) -> float:
+        route = self.scope.get("route")
+        name = getattr(route, "name", None)
+        return self.route_timeouts.get(name, self.default_timeout)
+
+    def remaining(self) -> float:
+        elapsed = asyncio.get_running_loop().time() - self.started_at
+        return self.timeout - elapsed
+
+
+# The deadline of the request being handled, read by get_async_session
+current_deadline: ContextVar[RequestDeadline | None] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+def timeout_statement(deadline: RequestDeadline, lock_timeout: float):
+    """Limits the transaction's statements to the time the request has left.
+
+    A timeout of 0 turns it off in Postgres, so the least it can be is 1ms.
+    """
+    remaining = max(int(deadline.remaining() * 1000), 1)
+    return text(
+        "SELECT set_config('statement_timeout', :statement_timeout, true), "
+        "set_config('lock_timeout', :lock_timeout, true)"
+    ).bindparams(
+        statement_timeout=f"{remaining}ms",
+        lock_timeout=f"{min(max(int(lock_timeout * 1000), 1), remaining)}ms",
+    )
+
+
+@event.listens_for(Session, "after_begin")
+def set_transaction_timeouts(session, transaction, connection):
+    deadline = session.info.get("deadline")
+    if deadline is not None:
+        connection.execute(
+            timeout_statement(deadline, settings.DATABASE_LOCK_TIMEOUT_SECONDS)
+        )
+
+
+def is_timeout(error: DBAPIError) -> bool:
+    """Whether a query was stopped by one of the transaction's timeouts."""
+    return getattr(error.orig, "sqlstate", None) in (QUERY_CANCELED, LOCK_NOT_AVAILABLE)
+
+
+def timeout_response(error: DBAPIError) -> JSONResponse:
+    if getattr(error.orig, "sqlstate", None) == LOCK_NOT_AVAILABLE:
+        return JSONResponse(
+            {"detail": "The resource is busy, try again shortly"},
+            status_code=503,
+            headers={"Retry-After": "1"},
+        )
+    return JSONResponse({"detail": "Request timed out"}, status_code=504)
+
+
+class DeadlineMiddleware:
+    """Stops a request when its client disconnects or its deadline passes.
+
+    The request is handled in its own task while the client connection is
+    watched. If the client goes away before the response has started, the
+    task is cancelled, which cancels any query it's waiting on in Postgres
+    too. If the deadline passes first, the task is cancelled and a 504 is
+    sent; the queries themselves are limited to the time left by the
+    request session's statement_timeout. Once the response has started,
+    streaming responses are left to finish or notice the disconnect
+    themselves.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        default_timeout: float,
+        route_timeouts: dict[str, float],
+        stats: DeadlineStats = deadline_stats,
+    ):
+        self.app = app
+        self.default_timeout = default_timeout
+        self.route_timeouts = route_timeouts
+        self.stats = stats
+        # Wake up in time for the shortest deadline, as the route isn't
+        # known yet when the request starts
+        self.first_check = min([default_timeout, *route_timeouts.values()])
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        deadline = RequestDeadline(scope, self.default_timeout, self.route_timeouts)
+        # At most one message is read ahead, so request bodies keep streaming
+        messages: asyncio.Queue[Message] = asyncio.Queue(maxsize=1)
+        disconnected = asyncio.Event()
+        response_started = False
+
+        async def watch_client():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    # Wakes up the app if it's waiting for a message; if one
+                    # is already queued, it gets the disconnect after it
+                    if not messages.full():
+                        messages.put_nowait(message)
+                    return
+                await messages.put(message)
+
+        async def receive_message() -> Message:
+            if disconnected.is_set() and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def send_message(message: Message):
+            nonlocal response_started
+            response_started = True
+            await send(message)
+
+        token = current_deadline.set(deadline)
+        try:
+            handler = asyncio.create_task(
+                self.app(scope, receive_message, send_message)
+            )
+        finally:
+            current_deadline.reset(token)
+        watcher = asyncio.create_task(watch_client())
+        disconnect = asyncio.create_task(disconnected.wait())
+        timeout = self.first_check
+        try:
+            while not handler.done():
+                if response_started:
+                    await handler
+                    break
+                done, _ = await asyncio.wait(
+                    {handler, disconnect},
+                    timeout=max(min(timeout, deadline.remaining()), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                timeout = deadline.remaining()
+                if handler in done or response_started:
+                    continue
+                if disconnect in done:
+                    self.stats.cancelled += 1
+                    await cancel(handler)
+                    return
+                if deadline.remaining() <= 0:
+                    self.stats.timed_out += 1
+                    await cancel(handler)
+                    if response_started:
+                        return
+                    response = JSONResponse(
+                        {"detail": "Request timed out"}, status_code=504
+                    )
+                    await response(scope, receive_message, send)
+                    return
+            handler.result()
+        except DBAPIError as e:
+            if response_started or not is_timeout(e):
+                raise
+            self.stats.timed_out += 1
+            await timeout_response(e)(scope, receive_message, send)
+        finally:
+            for task in (handler, watcher, disconnect):
+                task.cancel()
+
+
+async def cancel(task: asyncio.Task):
+    task.cancel()
+    await asyncio.wait({task})
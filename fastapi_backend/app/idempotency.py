@@ -0,0 +1,201 @@
+"""Idempotency keys for the mutating item routes.
+
+A client that lost the response to a write can't tell whether it was applied.
+Sending the same `Idempotency-Key` header with every attempt makes retrying
+safe: the key is claimed in the request's own transaction and the response is
+stored alongside the changes, so a retry after the commit gets the stored
+response without running the request again. A retry that arrives while the
+first attempt is still running waits on the key's row until it finishes.
+
+Failed requests roll back their key along with everything else, so they can
+be retried with the same key. Keys expire after IDEMPOTENCY_KEY_TTL_SECONDS.
+"""
+
+import asyncio
+import hashlib
+import logging
+from datetime import timedelta
+from uuid import UUID
+
+from fastapi import Depends, Header, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import get_async_session, shard_engines, shard_session
+from .models import IdempotencyKey, User
+from .negotiation import MessagePackRoute
+from .users import current_active_user
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Expired keys deleted per statement by the cleanup
+CLEANUP_BATCH_SIZE = 1000
+
+# Claims tried when the key that was in the way keeps disappearing before it
+# can be read
+CLAIM_ATTEMPTS = 3
+
+
+class IdempotentReplay(Exception):
+    """Raised to answer a retried request with the response stored for its key."""
+
+    def __init__(self, content, status_code: int, headers: dict[str, str]):
+        self.content = content
+        self.status_code = status_code
+        self.headers = headers
+
+
+async def replay_response(request: Request, exc: IdempotentReplay):
+    route = request.scope.get("route")
+    if isinstance(route, MessagePackRoute):
+        # Encoded like the first response, e.g. with MessagePack types
+        return route.negotiated_response(exc.content, exc.status_code, exc.headers)
+    return JSONResponse(exc.content, exc.status_code, exc.headers)
+
+
+def request_fingerprint(request: Request, body: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in (request.method, request.url.path, request.url.query):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def build_claim_statement(user_id: UUID, key: str, fingerprint: str):
+    """Insert the key, or take over an expired one; returns no row otherwise.
+
+    A key inserted by a transaction that is still running makes this wait
+    until that transaction ends.
+    """
+    expires_at = func.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+    statement = insert(IdempotencyKey).values(
+        user_id=user_id, key=key, fingerprint=fingerprint, expires_at=expires_at
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[IdempotencyKey.user_id, IdempotencyKey.key],
+        set_={
+            "fingerprint": statement.excluded.fingerprint,
+            "status_code": None,
+            "response_body": None,
+            "response_headers": None,
+            "created_at": func.now(),
+            "expires_at": statement.excluded.expires_at,
+        },
+        where=IdempotencyKey.expires_at <= func.now(),
+    ).returning(IdempotencyKey.key)
+
+
+class IdempotentRequest:
+    """The current request's claim on its idempotency key, if it sent one."""
+
+    def __init__(self, db: AsyncSession, user_id: UUID, key: str | None):
+        self.db = db
+        self.user_id = user_id
+        self.key = key
+
+    async def save_response(
+        self, body, status_code: int = 200, headers: dict[str, str] | None = None
+    ) -> None:
+        """Store the response for retries; call before committing."""
+        if self.key is None:
+            return
+        await self.db.execute(
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.user_id == self.user_id,
+                IdempotencyKey.key == self.key,
+            )
+            .values(
+                status_code=status_code,
+                response_body=jsonable_encoder(body),
+                response_headers=headers or {},
+            )
+        )
+
+
+async def idempotent_request(
+    request: Request,
+    idempotency_key: str | None = Header(
+        None,
+        min_length=1,
+        max_length=IDEMPOTENCY_KEY_MAX_LENGTH,
+        description="Unique per operation; retries with the same key are only "
+        "applied once and get the first response.",
+    ),
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+) -> IdempotentRequest:
+    if idempotency_key is None:
+        return IdempotentRequest(db, user.id, None)
+
+    fingerprint = request_fingerprint(request, await request.body())
+    for _ in range(CLAIM_ATTEMPTS):
+        claimed = await db.execute(
+            build_claim_statement(user.id, idempotency_key, fingerprint)
+        )
+        if claimed.scalar() is not None:
+            return IdempotentRequest(db, user.id, idempotency_key)
+        stored = await db.get(IdempotencyKey, (user.id, idempotency_key))
+        # Otherwise the key was deleted since the claim, e.g. by the cleanup
+        # once it expired, and can be claimed again
+        if stored is not None:
+            break
+    else:
+        raise HTTPException(
+            status_code=409,
+            detail="Idempotency-Key is being reused concurrently, try again",
+        )
+
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    raise IdempotentReplay(
+        stored.response_body,
+        stored.status_code,
+        {**stored.response_headers, "Idempotent-Replayed": "true"},
+    )
+
+
+async def delete_expired_keys(db: AsyncSession) -> int:
+    """Delete expired keys in batches, each committed on its own."""
+    deleted = 0
+    while True:
+        expired = (
+            select(IdempotencyKey.user_id, IdempotencyKey.key)
+            .where(IdempotencyKey.expires_at < func.now())
+            .limit(CLEANUP_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        result = await db.execute(
+            delete(IdempotencyKey).where(
+                tuple_(IdempotencyKey.user_id, IdempotencyKey.key).in_(expired)
+            )
+        )
+        await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < CLEANUP_BATCH_SIZE:
+            return deleted
+
+
+async def clean_up_expired_keys(interval: float):
+    """Delete expired keys on every shard every `interval` seconds, until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        for shard in range(len(shard_engines)):
+            try:
+                async with shard_session(shard) as db:
+                    deleted = await delete_expired_keys(db)
+            except Exception:
+                logger.exception("Idempotency key cleanup failed on shard %d", shard)
+                continue
+            if deleted:
+                logger.info("Deleted %d expired idempotency keys", deleted)
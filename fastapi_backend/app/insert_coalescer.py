@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from uuid import UUID
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError
+
+from .config import settings
+from .database import shard_engines, shard_session
+from .models import Item
+from .schemas import ItemCreate, ItemRead
+
+logger = logging.getLogger(__name__)
+
+
+class InsertBatchStats:
+    """Sizes of the coalesced insert batches and the delay they added."""
+
+    def __init__(self):
+        self.batches = 0
+        self.inserts = 0
+        self.largest_batch = 0
+        self.failed_batches = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+
+    def record(self, size: int, delays: list[float], failed: bool):
+        self.batches += 1
+        self.inserts += size
+        self.largest_batch = max(self.largest_batch, size)
+        self.failed_batches += failed
+        self.total_delay += sum(delays)
+        self.max_delay = max(self.max_delay, *delays)
+
+    def as_dict(self) -> dict:
+        return {
+            "batches": self.batches,
+            "inserts": self.inserts,
+            "mean_batch_size": self.inserts / self.batches if self.batches else None,
+            "largest_batch": self.largest_batch,
+            "failed_batches": self.failed_batches,
+            "mean_added_latency_ms": (
+                self.total_delay / self.inserts * 1000 if self.inserts else None
+            ),
+            "max_added_latency_ms": self.max_delay * 1000,
+        }
+
+
+@dataclass
+class PendingInsert:
+    values: dict
+    future: asyncio.Future
+    queued_at: float
+
+
+class InsertCoalescer:
+    """Writes concurrent item inserts on one shard as a single INSERT and commit.
+
+    Under load most of an insert's cost is its own transaction: a commit, and
+    so a WAL flush, per item. The first insert of a batch waits up to
+    `max_delay` seconds for others to join it, and a batch is written as soon
+    as it holds `max_size` items. Each caller gets its own row back; if the
+    multi-row INSERT fails, the batch is retried row by row in savepoints so
+    only the offending rows fail.
+    """
+
+    def __init__(self, shard: int, max_size: int, max_delay: float):
+        self.shard = shard
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.stats = InsertBatchStats()
+        self._pending: list[PendingInsert] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._writes: set[asyncio.Task] = set()
+
+    async def insert(self, user_id: UUID, item: ItemCreate) -> ItemRead:
+        loop = asyncio.get_running_loop()
+        pending = PendingInsert(
+            values={**item.model_dump(), "user_id": user_id},
+            future=loop.create_future(),
+            queued_at=loop.time(),
+        )
+        self._pending.append(pending)
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await pending.future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._write(batch))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: list[PendingInsert]):
+        now = asyncio.get_running_loop().time()
+        failed = False
+        try:
+            async with shard_session(self.shard) as db:
+                try:
+                    result = await db.execute(
+                        insert(Item).returning(Item, sort_by_parameter_order=True),
+                        [pending.values for pending in batch],
+                    )
+                    rows = [
+                        (pending, ItemRead.model_validate(item))
+                        for pending, item in zip(batch, result.scalars())
+                    ]
+                except DBAPIError:
+                    failed = True
+                    await db.rollback()
+                    rows = []
+                    for pending in batch:
+                        try:
+                            async with db.begin_nested():
+                                result = await db.execute(
+                                    insert(Item)
+                                    .values(**pending.values)
+                                    .returning(Item)
+                                )
+                        except DBAPIError as e:
+                            resolve(pending, exception=e)
+                        else:
+                            item = ItemRead.model_validate(result.scalar_one())
+                            rows.append((pending, item))
+                await db.commit()
+        except Exception as e:
+            logger.exception("Coalesced insert of %d items failed", len(batch))
+            for pending in batch:
+                resolve(pending, exception=e)
+            return
+        finally:
+            self.stats.record(
+                len(batch), [now - pending.queued_at for pending in batch], failed
+            )
+        for pending, item in rows:
+            resolve(pending, result=item)
+
+
+def resolve(pending: PendingInsert, result=None, exception=None):
+    # The caller may have gone away, e.g. on a client disconnect
+    if pending.future.done():
+        return
+    if exception is not None:
+        pending.future.set_exception(exception)
+    else:
+        pending.future.set_result(result)
+
+
+# One per shard, as a batch is written in one transaction
+insert_coalescers = [
+    InsertCoalescer(
+        shard,
+        settings.ITEM_INSERT_BATCH_MAX_SIZE,
+        settings.ITEM_INSERT_BATCH_MAX_DELAY_SECONDS,
+    )
+    for shard in range(len(shard_engines))
+]
+
+
+def insert_batch_stats() -> dict:
+    """Batch statistics summed over every shard's coalescer."""
+    stats = InsertBatchStats()
+    for coalescer in insert_coalescers:
+        for name, value in vars(coalescer.stats).items():
+            if name in ("largest_batch", "max_delay"):
+                setattr(stats, name, max(getattr(stats, name), value))
+            else:
+                setattr(stats, name, getattr(stats, name) + value)
+    return stats.as_dict()
@@ -0,0 +1,173 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator
+from uuid import UUID
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Item
+from .schemas import ItemCreate, ItemImportError, ItemImportResult
+from .utils import uuid7
+
+# Rows sent to Postgres per COPY
+IMPORT_CHUNK_SIZE = 5000
+# Rejected rows listed in the result; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+# Bounds the memory a malformed file can take up
+MAX_LINE_LENGTH = 64 * 1024
+MAX_RECORD_LINES = 100
+
+IMPORT_COLUMNS = ["id", "name", "description", "quantity", "user_id"]
+
+MAX_QUANTITY = 2**31 - 1
+
+# A parsed row is either its values, or why it couldn't be parsed
+ParsedRows = AsyncIterator[tuple[int, dict | str]]
+
+
+async def decode_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a UTF-8 byte stream into lines, holding at most one partial line."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        if len(pending) > MAX_LINE_LENGTH:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Lines can't be longer than {MAX_LINE_LENGTH} characters",
+            )
+        for line in lines:
+            yield line.removesuffix("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.removesuffix("\r")
+
+
+async def parse_csv(chunks: AsyncIterator[bytes]) -> ParsedRows:
+    """Rows of a CSV file whose first line names the columns.
+
+    A quoted value may span lines; a record is complete once its quotes are
+    balanced. Empty values are read as missing.
+    """
+    header = None
+    record, first_line = [], 0
+    line_number = 0
+    async for line in decode_lines(chunks):
+        line_number += 1
+        if not record:
+            first_line = line_number
+        record.append(line)
+        if sum(part.count('"') for part in record) % 2:
+            if len(record) < MAX_RECORD_LINES:
+                continue
+            yield first_line, "Unterminated quoted value"
+            record = []
+            continue
+        text, record = "\n".join(record), []
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            if "name" not in header:
+                raise HTTPException(
+                    status_code=400, detail="The CSV header has no name column"
+                )
+            continue
+        if len(values) != len(header):
+            yield first_line, f"Expected {len(header)} values, got {len(values)}"
+            continue
+        yield (
+            first_line,
+            {name: value for name, value in zip(header, values) if value != ""},
+        )
+    if record:
+        yield first_line, "Unterminated quoted value"
+
+
+async def parse_ndjson(chunks: AsyncIterator[bytes]) -> ParsedRows:
+    """Rows of newline-delimited JSON, one object per line."""
+    line_number = 0
+    async for line in decode_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            values = json.loads(line)
+        except ValueError:
+            yield line_number, "Invalid JSON"
+            continue
+        if not isinstance(values, dict):
+            yield line_number, "Expected a JSON object"
+            continue
+        yield line_number, values
+
+
+IMPORT_PARSERS = {
+    "text/csv": parse_csv,
+    "application/x-ndjson": parse_ndjson,
+    "application/jsonl": parse_ndjson,
+}
+
+
+def validation_detail(error: ValidationError) -> str:
+    first = error.errors()[0]
+    location = ".".join(str(part) for part in first["loc"])
+    return f"{location}: {first['msg']}" if location else first["msg"]
+
+
+def validate_row(values: dict) -> ItemCreate | str:
+    try:
+        item = ItemCreate.model_validate(values)
+    except ValidationError as e:
+        return validation_detail(e)
+    # Postgres text can't hold them, and one would fail the whole COPY
+    if any("\x00" in (value or "") for value in (item.name, item.description)):
+        return "Text can't contain NUL characters"
+    if item.quantity is not None and abs(item.quantity) > MAX_QUANTITY:
+        return "quantity: Value is out of range"
+    return item
+
+
+async def copy_items(db: AsyncSession, user_id: UUID, rows: ParsedRows):
+    """COPY the valid rows into the user's items, a chunk at a time.
+
+    Runs in one transaction (a savepoint if the session already has one), so
+    an import that fails part way leaves no items behind.
+    """
+    result = ItemImportResult(imported=0, rejected=0, errors=[])
+
+    def reject(line: int, detail: str):
+        result.rejected += 1
+        if len(result.errors) < MAX_REPORTED_ERRORS:
+            result.errors.append(ItemImportError(line=line, detail=detail))
+
+    connection = await (await db.connection()).get_raw_connection()
+    driver = connection.driver_connection
+
+    async def write(records: list[tuple]):
+        await driver.copy_records_to_table(
+            Item.__tablename__, records=records, columns=IMPORT_COLUMNS
+        )
+        result.imported += len(records)
+
+    async with driver.transaction():
+        records = []
+        async for line, values in rows:
+            item = validate_row(values) if isinstance(values, dict) else values
+            if isinstance(item, str):
+                reject(line, item)
+                continue
+            records.append(
+                (uuid7(), item.name, item.description, item.quantity, user_id)
+            )
+            if len(records) >= IMPORT_CHUNK_SIZE:
+                await write(records)
+                records = []
+        if records:
+            await write(records)
+    return result
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import signal
+from contextlib import asynccontextmanager
+from typing import Callable
+
+from fastapi import FastAPI
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .cache import cache
+from .change_feed import change_feeds
+from .config import settings
+from .database import dispose_engines, warm_up_engine
+from .idempotency import clean_up_expired_keys
+from .log import configure_logging, stop_logging
+from .tombstones import clean_up_expired_tombstones
+
+logger = logging.getLogger(__name__)
+
+HEALTH_URL_PATH = "health"
+
+# How long requests cut off at the drain deadline get to send their 503
+CUT_OFF_GRACE_SECONDS = 1.0
+
+
+class RequestTracker:
+    """Counts in-flight HTTP requests and tracks whether the worker is draining."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.draining = False
+        # Set once the drain deadline has passed and the requests still
+        # running have been cancelled
+        self.cut_off = False
+        self._tasks: set[asyncio.Task] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def start_request(self, task: asyncio.Task | None = None):
+        self.in_flight += 1
+        if task is not None:
+            self._tasks.add(task)
+        self._idle.clear()
+
+    def finish_request(self, task: asyncio.Task | None = None):
+        self.in_flight -= 1
+        self._tasks.discard(task)
+        if self.in_flight == 0:
+            self._idle.set()
+
+    def start_draining(self):
+        self.draining = True
+
+    def cut_off_requests(self):
+        """Cancel the requests still running."""
+        self.cut_off = True
+        for task in self._tasks:
+            task.cancel()
+
+    async def wait_until_idle(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+request_tracker = RequestTracker()
+
+
+def shutting_down_response() -> JSONResponse:
+    return JSONResponse(
+        {"detail": "Server is shutting down"},
+        status_code=503,
+        headers={"Connection": "close", "Retry-After": "1"},
+    )
+
+
+async def drain(tracker: RequestTracker, timeout: float) -> bool:
+    """Stop taking requests and give those in flight `timeout` seconds to
+    finish; the ones still running then are cut off with a 503.
+
+    Returns whether they all finished in time.
+    """
+    tracker.start_draining()
+    # End the open event streams, which would otherwise never finish
+    for change_feed in change_feeds:
+        await change_feed.close()
+    if await tracker.wait_until_idle(timeout):
+        return True
+    logger.warning(
+        "Shutdown drain timed out with %d requests in flight", tracker.in_flight
+    )
+    tracker.cut_off_requests()
+    await tracker.wait_until_idle(CUT_OFF_GRACE_SECONDS)
+    return False
+
+
+class RequestDrainMiddleware:
+    """Tracks in-flight requests and refuses new ones once draining has begun.
+
+    Health endpoints are always served so the load balancer can observe the
+    readiness probe flip to failing while the worker drains. Requests cut off
+    at the drain deadline get a 503 if their response hasn't started yet.
+    """
+
+    def __init__(self, app: ASGIApp, tracker: RequestTracker = request_tracker):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"].startswith(f"/{HEALTH_URL_PATH}/"):
+            await self.app(scope, receive, send)
+            return
+
+        if self.tracker.draining:
+            await shutting_down_response()(scope, receive, send)
+            return
+
+        task = asyncio.current_task()
+        response_started = False
+
+        async def send_tracked(message: Message):
+            nonlocal response_started
+            response_started = True
+            await send(message)
+
+        self.tracker.start_request(task)
+        try:
+            await self.app(scope, receive, send_tracked)
+        except asyncio.CancelledError:
+            if not self.tracker.cut_off:
+                raise
+            # Cancelled by the drain rather than by the server
+            task.uncancel()
+            if not response_started:
+                await shutting_down_response()(scope, receive, send)
+        finally:
+            self.tracker.finish_request(task)
+
+
+def install_sigterm_hook(callback: Callable[[], None]) -> Callable[[], None]:
+    """Run `callback` on SIGTERM before handing the signal to the previous handler.
+
+    The server (e.g. uvicorn) installs its own SIGTERM handler to stop accepting
+    connections; chaining onto it lets readiness fail as soon as the signal
+    arrives instead of once the server starts shutting the app down. Returns a
+    function that restores the previous handler.
+    """
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handler(signum, frame):
+        callback()
+        if callable(previous):
+            previous(signum, frame)
+
+    try:
+        signal.signal(signal.SIGTERM, handler)
+    except ValueError:
+        # Signal handlers can only be installed from the main thread
+        return lambda: None
+    return lambda: signal.signal(signal.SIGTERM, previous)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    if settings.DATABASE_WARM_UP_CONNECTIONS > 0 and settings.DATABASE_POOL_SIZE <= 0:
+        # Without a pool every warmed connection is closed straight away, and
+        # its statement caches with it
+        logger.info("Skipping database warm-up: connection pooling is disabled")
+    elif settings.DATABASE_WARM_UP_CONNECTIONS > 0:
+        try:
+            await warm_up_engine(settings.DATABASE_WARM_UP_CONNECTIONS)
+        except Exception:
+            # An unreachable database should not keep the worker from booting;
+            # the readiness probe reports it until it recovers.
+            logger.exception("Database warm-up failed")
+
+    await cache.start()
+    key_cleanup = asyncio.create_task(
+        clean_up_expired_keys(settings.IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS)
+    )
+    tombstone_cleanup = asyncio.create_task(
+        clean_up_expired_tombstones(
+            settings.ITEM_TOMBSTONE_CLEANUP_INTERVAL_SECONDS,
+            settings.ITEM_TOMBSTONE_RETENTION_SECONDS,
+        )
+    )
+
+    # The server waits for every open request before it runs the shutdown
+    # below, with no time limit by default, so the drain starts as soon as
+    # SIGTERM arrives and enforces its own deadline
+    loop = asyncio.get_running_loop()
+    draining: asyncio.Task | None = None
+
+    def start_drain():
+        nonlocal draining
+        if draining is None:
+            draining = asyncio.create_task(
+                drain(request_tracker, settings.SHUTDOWN_DRAIN_TIMEOUT_SECONDS)
+            )
+
+    def on_sigterm():
+        request_tracker.start_draining()
+        loop.call_soon_threadsafe(start_drain)
+
+    restore_sigterm_handler = install_sigterm_hook(on_sigterm)
+    try:
+        yield
+    finally:
+        start_drain()
+        key_cleanup.cancel()
+        tombstone_cleanup.cancel()
+        await draining
+        restore_sigterm_handler()
+        await cache.close()
+        await dispose_engines()
+        stop_logging()
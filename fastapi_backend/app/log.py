@@ -0,0 +1,189 @@
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from uuid import uuid4
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import settings
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Set for each request, and added to every record logged while handling it
+current_request_id: ContextVar[str | None] = ContextVar(
+    "current_request_id", default=None
+)
+current_user_id: ContextVar[str | None] = ContextVar("current_user_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed in `extra`
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class ContextFilter(logging.Filter):
+    """Adds the request and user ids to records, and samples INFO and lower.
+
+    Sampling keeps `sample_rate` of the records below WARNING. Within a
+    request it's decided by the request id, so a request's records are kept
+    or dropped together.
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id.get()
+        record.user_id = getattr(record, "user_id", None) or current_user_id.get()
+        if record.levelno >= logging.WARNING or self.sample_rate >= 1:
+            return True
+        if record.request_id is None:
+            return random.random() < self.sample_rate
+        return zlib.crc32(record.request_id.encode()) / 2**32 < self.sample_rate
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one line of JSON, with any `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(
+                record.created, timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            (name, value)
+            for name, value in vars(record).items()
+            if name not in RECORD_ATTRIBUTES and value is not None
+        )
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, "request_id", None):
+            text += f" [request {record.request_id}]"
+        return text
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the logging thread, dropping them if its queue is full.
+
+    The message and any traceback are rendered here, while the arguments and
+    frames they refer to are still current; JSON encoding and writing happen
+    on the thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+log_listener: QueueListener | None = None
+# The root logger's handlers from before configure_logging, put back on stop
+previous_handlers: list[logging.Handler] = []
+
+
+def configure_logging() -> NonBlockingQueueHandler:
+    """Route the root logger's records, and uvicorn's, through a queue.
+
+    A background thread formats them and writes them to stdout, so logging
+    never blocks the event loop on I/O.
+    """
+    global log_listener, previous_handlers
+    stop_logging()
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(
+        JSONFormatter() if settings.LOG_FORMAT == "json" else TextFormatter()
+    )
+    handler = NonBlockingQueueHandler(queue.Queue(settings.LOG_QUEUE_SIZE))
+    handler.addFilter(ContextFilter(settings.LOG_INFO_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    previous_handlers = root.handlers
+    root.handlers = [handler]
+    root.setLevel(settings.LOG_LEVEL)
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers = []
+        logger.propagate = True
+
+    log_listener = QueueListener(handler.queue, output)
+    log_listener.start()
+    return handler
+
+
+def stop_logging():
+    """Write out the records still queued and stop the logging thread."""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+        logging.getLogger().handlers = previous_handlers
+
+
+class RequestContextMiddleware:
+    """Gives each request an id, from its X-Request-ID header if it has one,
+    for its log records and its response."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = Headers(scope=scope).get(REQUEST_ID_HEADER, "")
+        # Only short, printable ids are taken from clients
+        if 0 < len(incoming) <= 128 and incoming.isprintable():
+            current = incoming
+        else:
+            current = uuid4().hex
+
+        async def send_with_id(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)[REQUEST_ID_HEADER] = current
+            await send(message)
+
+        request_token = current_request_id.set(current)
+        user_token = current_user_id.set(None)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            current_request_id.reset(request_token)
+            current_user_id.reset(user_token)
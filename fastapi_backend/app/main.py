@@ -3,14 +3,44 @@ from .schemas import UserCreate, UserRead, UserUpdate
 from .users import auth_backend, fastapi_users, AUTH_URL_PATH
 from fastapi.middleware.cors import CORSMiddleware
 from .utils import simple_generate_unique_route_id
+from .compression import CompressionMiddleware
+from .deadlines import DeadlineMiddleware
+from .log import RequestContextMiddleware
+from .negotiation import MessagePackMiddleware, MessagePackRouter
+from .profiler import RequestProfilerMiddleware
+from .lifespan import HEALTH_URL_PATH, RequestDrainMiddleware, lifespan
+from .idempotency import IdempotentReplay, replay_response
 from app.routes.items import router as items_router
+from app.routes.users import router as users_router
+from app.routes.health import router as health_router
+from app.routes.debug import router as debug_router
 from app.config import settings
 
 app = FastAPI(
     generate_unique_id_function=simple_generate_unique_route_id,
     openapi_url=settings.OPENAPI_URL,
+    lifespan=lifespan,
 )
 
+# Answers retried requests with the response stored for their Idempotency-Key
+app.add_exception_handler(IdempotentReplay, replay_response)
+
+# Middleware profiling single requests for superusers (X-Profile header). It
+# runs inside the deadline middleware's task, so it only samples that request.
+app.add_middleware(
+    RequestProfilerMiddleware, interval=settings.PROFILER_REQUEST_INTERVAL_SECONDS
+)
+
+# Middleware stopping requests whose client left or whose deadline passed
+app.add_middleware(
+    DeadlineMiddleware,
+    default_timeout=settings.REQUEST_DEADLINE_SECONDS,
+    route_timeouts=settings.REQUEST_DEADLINES,
+)
+
+# Middleware for graceful shutdown (rejects new requests while draining)
+app.add_middleware(RequestDrainMiddleware)
+
 # Middleware for CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -20,32 +50,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Include authentication and user management routes
-app.include_router(
+# Middleware for MessagePack request and response bodies (Accept and
+# Content-Type application/msgpack), inside compression so it's compressed too
+app.add_middleware(MessagePackMiddleware)
+
+# Middleware for gzip/brotli/zstd response compression
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+    cache_size=settings.COMPRESSION_CACHE_SIZE,
+    cache_max_bytes=settings.COMPRESSION_CACHE_MAX_BYTES,
+)
+
+# Middleware giving each request an id for its logs and response
+app.add_middleware(RequestContextMiddleware)
+
+# Include authentication and user management routes, answering in MessagePack
+# from their response models like the app's own routes
+user_management_router = MessagePackRouter()
+user_management_router.include_router(
     fastapi_users.get_auth_router(auth_backend),
     prefix=f"/{AUTH_URL_PATH}/jwt",
     tags=["auth"],
 )
-app.include_router(
+user_management_router.include_router(
     fastapi_users.get_register_router(UserRead, UserCreate),
     prefix=f"/{AUTH_URL_PATH}",
     tags=["auth"],
 )
-app.include_router(
+user_management_router.include_router(
     fastapi_users.get_reset_password_router(),
     prefix=f"/{AUTH_URL_PATH}",
     tags=["auth"],
 )
-app.include_router(
+user_management_router.include_router(
     fastapi_users.get_verify_router(UserRead),
     prefix=f"/{AUTH_URL_PATH}",
     tags=["auth"],
 )
-app.include_router(
+user_management_router.include_router(
     fastapi_users.get_users_router(UserRead, UserUpdate),
     prefix="/users",
     tags=["users"],
 )
+app.include_router(user_management_router)
+
+# Superuser listing of users, next to fastapi-users' per-user routes
+app.include_router(users_router, prefix="/users")
 
 # Include items routes
 app.include_router(items_router, prefix="/items")
+
+# Include liveness and readiness probes
+app.include_router(health_router, prefix=f"/{HEALTH_URL_PATH}")
+
+# Include the superuser-only profiling routes
+app.include_router(debug_router, prefix="/debug")
@@ -1,9 +1,34 @@
 from fastapi_users.db import SQLAlchemyBaseUserTableUUID
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import Column, String, Integer, ForeignKey
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import UUID
-from uuid import uuid4
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Boolean,
+    Column,
+    Computed,
+    DateTime,
+    String,
+    Integer,
+    Index,
+    Sequence,
+    event,
+    text,
+)
+from sqlalchemy.orm import deferred
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, UUID
+from sqlalchemy.types import UserDefinedType
+
+from .config import settings
+from .utils import uuid7
+
+
+class XID8(UserDefinedType):
+    """Postgres 64-bit transaction id, as returned by pg_current_xact_id()."""
+
+    cache_ok = True
+
+    def get_col_spec(self, **kw):
+        return "XID8"
 
 
 class Base(DeclarativeBase):
@@ -11,16 +36,344 @@ class Base(DeclarativeBase):
 
 
 class User(SQLAlchemyBaseUserTableUUID, Base):
-    items = relationship("Item", back_populates="user", cascade="all, delete-orphan")
+    """A user account, kept in the directory database.
+
+    The user's items live on one of the shard databases, which is recorded
+    here. The item tables there can't reference this table, so they carry the
+    user's id without a foreign key.
+    """
+
+    shard = Column(Integer, nullable=False, server_default=text("0"))
+    # Bumped each time the user is moved to another shard; sync cursors from
+    # before the move are rejected, as the new shard has its own transaction ids
+    shard_epoch = Column(Integer, nullable=False, server_default=text("0"))
+    # Set while the user's items are being copied to another shard
+    shard_moving = Column(Boolean, nullable=False, server_default=text("false"))
 
 
 class Item(Base):
+    """A user's item. The table is hash partitioned on user_id.
+
+    Every route filters on user_id, so each query touches one partition. The
+    partition key has to be part of the primary key; the mapper still
+    identifies items by id alone.
+    """
+
     __tablename__ = "items"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    # Time-ordered, so new items are appended to the primary key index
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
     name = Column(String, nullable=False)
     description = Column(String, nullable=True)
     quantity = Column(Integer, nullable=True)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("user.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), primary_key=True, nullable=False)
+    # Bumped by every update; exposed as the item's ETag for If-Match
+    version = Column(Integer, nullable=False, server_default=text("1"))
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=text("now()")
+    )
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=text("now()")
+    )
+    # Transaction that last wrote the row; orders the delta sync feed
+    change_xid = deferred(
+        Column(XID8, nullable=False, server_default=text("pg_current_xact_id()"))
+    )
+    # The 'simple' configuration skips stemming so prefix queries match what
+    # the user typed; names rank above descriptions. Deferred so regular item
+    # loads don't fetch it.
+    search_vector = deferred(
+        Column(
+            TSVECTOR,
+            Computed(
+                "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+                "setweight(to_tsvector('simple', coalesce(description, '')), 'B')",
+                persisted=True,
+            ),
+        )
+    )
+
+    __table_args__ = (
+        # Back the items list's sort orders; user_id leads so they also serve
+        # every per-user lookup
+        Index("ix_items_user_id_name", "user_id", "name", "id"),
+        Index("ix_items_user_id_quantity", "user_id", "quantity", "id"),
+        Index("ix_items_user_id_created_at", "user_id", "created_at", "id"),
+        # Case-insensitive name prefix filter: lower(name) LIKE 'abc%'.
+        # text_pattern_ops lets LIKE use the index under any collation.
+        Index(
+            "ix_items_user_id_lower_name",
+            "user_id",
+            text("lower(name) text_pattern_ops"),
+        ),
+        Index("ix_items_user_id_change_xid", "user_id", "change_xid", "id"),
+        Index("ix_items_search_vector", "search_vector", postgresql_using="gin"),
+        # Requires the pg_trgm extension
+        Index(
+            "ix_items_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+        {"postgresql_partition_by": "HASH (user_id)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
+
+def item_partition_name(remainder: int) -> str:
+    return f"items_p{remainder}"
+
+
+@event.listens_for(Item.__table__, "after_create")
+def create_item_partitions(target, connection, **kw):
+    count = settings.ITEMS_PARTITION_COUNT
+    for remainder in range(count):
+        connection.execute(
+            text(
+                f"CREATE TABLE {item_partition_name(remainder)} PARTITION OF items "
+                f"FOR VALUES WITH (MODULUS {count}, REMAINDER {remainder})"
+            )
+        )
+
+
+class ItemSummary(Base):
+    """Per-user item aggregates, kept current by triggers on `items`."""
+
+    __tablename__ = "item_summaries"
+
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    item_count = Column(BigInteger, nullable=False, default=0)
+    total_quantity = Column(BigInteger, nullable=False, default=0)
+
+
+class ItemTombstone(Base):
+    """Records a deleted item so delta sync can tell clients to drop it."""
+
+    __tablename__ = "item_tombstones"
+
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    user_id = Column(UUID(as_uuid=True), nullable=False)
+    deleted_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=text("now()")
+    )
+    change_xid = Column(
+        XID8, nullable=False, server_default=text("pg_current_xact_id()")
+    )
+
+    __table_args__ = (
+        Index("ix_item_tombstones_user_id_change_xid", "user_id", "change_xid", "id"),
+        Index("ix_item_tombstones_deleted_at", "deleted_at"),
+    )
+
+
+class PrunedItemTombstones(Base):
+    """The latest of a user's tombstones deleted after the retention period.
+
+    Sync cursors from before it may have missed deletions and are rejected.
+    """
+
+    __tablename__ = "pruned_item_tombstones"
+
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    change_xid = Column(XID8, nullable=False)
+
+
+class IdempotencyKey(Base):
+    """A response kept under a client's Idempotency-Key, replayed to its retries.
+
+    `status_code` is only set once the response is known; the row is written
+    in the same transaction as the request's changes.
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    key = Column(String, primary_key=True)
+    # Hash of the request the key was first used for
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(JSONB, nullable=True)
+    response_headers = Column(JSONB, nullable=True)
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=text("now()")
+    )
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (Index("ix_idempotency_keys_expires_at", "expires_at"),)
+
+
+# Statement-level triggers see every changed row through transition tables, so
+# bulk writes fold into one upsert per affected user rather than one per row.
+# Updates that don't change a user's totals (a rename, say) skip the write so
+# they don't contend on the summary row.
+ITEM_SUMMARY_DDL = [
+    DDL(
+        """
+CREATE OR REPLACE FUNCTION apply_item_summary_delta() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO item_summaries AS s (user_id, item_count, total_quantity)
+        SELECT user_id, count(*), coalesce(sum(quantity), 0)
+        FROM new_items GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            item_count = s.item_count + excluded.item_count,
+            total_quantity = s.total_quantity + excluded.total_quantity;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE item_summaries AS s SET
+            item_count = s.item_count - d.item_count,
+            total_quantity = s.total_quantity - d.total_quantity
+        FROM (
+            SELECT user_id, count(*) AS item_count,
+                coalesce(sum(quantity), 0) AS total_quantity
+            FROM old_items GROUP BY user_id
+        ) d
+        WHERE s.user_id = d.user_id;
+    ELSE
+        INSERT INTO item_summaries AS s (user_id, item_count, total_quantity)
+        SELECT user_id, sum(item_count), sum(total_quantity)
+        FROM (
+            SELECT user_id, 1 AS item_count, coalesce(quantity, 0) AS total_quantity
+            FROM new_items
+            UNION ALL
+            SELECT user_id, -1, -coalesce(quantity, 0) FROM old_items
+        ) d
+        GROUP BY user_id
+        HAVING sum(item_count) <> 0 OR sum(total_quantity) <> 0
+        ON CONFLICT (user_id) DO UPDATE SET
+            item_count = s.item_count + excluded.item_count,
+            total_quantity = s.total_quantity + excluded.total_quantity;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+    ),
+    DDL(
+        "CREATE OR REPLACE TRIGGER items_summary_insert AFTER INSERT ON items "
+        "REFERENCING NEW TABLE AS new_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION apply_item_summary_delta()"
+    ),
+    DDL(
+        "CREATE OR REPLACE TRIGGER items_summary_update AFTER UPDATE ON items "
+        "REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION apply_item_summary_delta()"
+    ),
+    DDL(
+        "CREATE OR REPLACE TRIGGER items_summary_delete AFTER DELETE ON items "
+        "REFERENCING OLD TABLE AS old_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION apply_item_summary_delta()"
+    ),
+]
+
+
+ITEM_CHANGES_CHANNEL = "item_changes"
+# Statements touching more rows than this send one "reset" per affected user
+# instead of an event per row, so bulk loads don't flood every listener.
+ITEM_CHANGES_MAX_ROW_EVENTS = 100
+
+# Gives each change event a unique id, used to resume the change feed
+item_change_event_id_seq = Sequence("item_change_event_id_seq", metadata=Base.metadata)
+
+ITEM_CHANGES_DDL = [
+    DDL(
+        f"""
+CREATE OR REPLACE FUNCTION notify_item_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    changed_rows bigint;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT count(*) INTO changed_rows FROM old_items;
+    ELSE
+        SELECT count(*) INTO changed_rows FROM new_items;
+    END IF;
+
+    IF changed_rows > {ITEM_CHANGES_MAX_ROW_EVENTS} AND TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('{ITEM_CHANGES_CHANNEL}', json_build_object(
+            'event_id', nextval('item_change_event_id_seq'),
+            'op', 'reset', 'user_id', user_id
+        )::text)
+        FROM (SELECT DISTINCT user_id FROM old_items) u;
+    ELSIF changed_rows > {ITEM_CHANGES_MAX_ROW_EVENTS} THEN
+        PERFORM pg_notify('{ITEM_CHANGES_CHANNEL}', json_build_object(
+            'event_id', nextval('item_change_event_id_seq'),
+            'op', 'reset', 'user_id', user_id
+        )::text)
+        FROM (SELECT DISTINCT user_id FROM new_items) u;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('{ITEM_CHANGES_CHANNEL}', json_build_object(
+            'event_id', nextval('item_change_event_id_seq'),
+            'op', 'delete', 'user_id', user_id, 'id', id, 'version', version
+        )::text)
+        FROM old_items;
+    ELSE
+        PERFORM pg_notify('{ITEM_CHANGES_CHANNEL}', json_build_object(
+            'event_id', nextval('item_change_event_id_seq'),
+            'op', lower(TG_OP), 'user_id', user_id, 'id', id, 'version', version
+        )::text)
+        FROM new_items;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+    ),
+    DDL(
+        "CREATE OR REPLACE TRIGGER items_notify_insert AFTER INSERT ON items "
+        "REFERENCING NEW TABLE AS new_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_item_changes()"
+    ),
+    DDL(
+        "CREATE OR REPLACE TRIGGER items_notify_update AFTER UPDATE ON items "
+        "REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_item_changes()"
+    ),
+    DDL(
+        "CREATE OR REPLACE TRIGGER items_notify_delete AFTER DELETE ON items "
+        "REFERENCING OLD TABLE AS old_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION notify_item_changes()"
+    ),
+]
+
+ITEM_SYNC_DDL = [
+    DDL(
+        """
+CREATE OR REPLACE FUNCTION touch_item() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at := now();
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END
+$$
+"""
+    ),
+    DDL(
+        "CREATE OR REPLACE TRIGGER items_touch BEFORE UPDATE ON items "
+        "FOR EACH ROW EXECUTE FUNCTION touch_item()"
+    ),
+    DDL(
+        """
+CREATE OR REPLACE FUNCTION record_item_tombstones() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO item_tombstones (id, user_id)
+    SELECT id, user_id FROM old_items
+    ON CONFLICT (id) DO UPDATE SET
+        deleted_at = excluded.deleted_at,
+        change_xid = excluded.change_xid;
+    RETURN NULL;
+END
+$$
+"""
+    ),
+    DDL(
+        "CREATE OR REPLACE TRIGGER items_tombstone_delete AFTER DELETE ON items "
+        "REFERENCING OLD TABLE AS old_items "
+        "FOR EACH STATEMENT EXECUTE FUNCTION record_item_tombstones()"
+    ),
+]
 
-    user = relationship("User", back_populates="items")
+for ddl in ITEM_SUMMARY_DDL + ITEM_CHANGES_DDL + ITEM_SYNC_DDL:
+    event.listen(Base.metadata, "after_create", ddl)
@@ -0,0 +1,302 @@
+"""MessagePack bodies for clients that ask for them.
+
+A client sending `Accept: application/msgpack` gets MessagePack instead of
+JSON, and request bodies can be sent as `Content-Type: application/msgpack`.
+UUIDs are packed as 16 raw bytes in extension type 1 and timezone-aware
+datetimes as MessagePack timestamps, rather than as strings.
+
+Routes using MessagePackRoute and NegotiatedResponse (the item and user
+routes) dump their response models straight to MessagePack, and so do their
+idempotent replays. Other JSON responses, like errors, are converted by
+MessagePackMiddleware; they have no response model, so any UUIDs in them stay
+strings.
+"""
+
+import functools
+import json
+from contextvars import ContextVar
+from typing import Mapping
+from uuid import UUID
+
+from fastapi import APIRouter, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter, ValidationError
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .database import SessionReleasingRoute
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - installed with the "msgpack" extra
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = {MSGPACK_MEDIA_TYPE, "application/x-msgpack"}
+
+UUID_EXT_TYPE = 1
+
+# Set by MessagePackMiddleware for each request
+msgpack_requested: ContextVar[bool] = ContextVar("msgpack_requested", default=False)
+
+
+def media_type(content_type: str | None) -> str:
+    return (content_type or "").partition(";")[0].strip().lower()
+
+
+def prefers_msgpack(accept: str) -> bool:
+    """Whether an Accept header value prefers MessagePack to JSON.
+
+    Only an explicit MessagePack media type counts; wildcards get JSON.
+    """
+    if msgpack is None:
+        return False
+    msgpack_weight = 0.0
+    json_weight = 0.0
+    for part in accept.split(","):
+        value, _, params = part.partition(";")
+        value = value.strip().lower()
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, param_value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(param_value)
+                except ValueError:
+                    weight = 0.0
+        if value in MSGPACK_MEDIA_TYPES:
+            msgpack_weight = max(msgpack_weight, weight)
+        elif value in (JSON_MEDIA_TYPE, "application/*", "*/*"):
+            json_weight = max(json_weight, weight)
+    return msgpack_weight > 0 and msgpack_weight >= json_weight
+
+
+def encode_extension(value):
+    if isinstance(value, UUID):
+        return msgpack.ExtType(UUID_EXT_TYPE, value.bytes)
+    # Naive datetimes, enums, decimals and the like are packed as in JSON
+    return jsonable_encoder(value)
+
+
+def decode_extension(code: int, data: bytes):
+    if code == UUID_EXT_TYPE and len(data) == 16:
+        return UUID(bytes=data)
+    raise ValueError(f"Unsupported MessagePack extension type {code}")
+
+
+def packb(content) -> bytes:
+    return msgpack.packb(content, default=encode_extension, datetime=True)
+
+
+def unpackb(data: bytes):
+    """Decode a MessagePack body; timestamps become UTC datetimes."""
+    return msgpack.unpackb(data, ext_hook=decode_extension, timestamp=3)
+
+
+class NegotiatedResponse(JSONResponse):
+    """JSON, or MessagePack when the request prefers it."""
+
+    def __init__(
+        self,
+        content,
+        status_code: int = 200,
+        headers: Mapping[str, str] | None = None,
+        media_type: str | None = None,
+        background: BackgroundTask | None = None,
+    ):
+        if media_type is None and msgpack_requested.get():
+            media_type = MSGPACK_MEDIA_TYPE
+        super().__init__(content, status_code, headers, media_type, background)
+
+    def render(self, content) -> bytes:
+        if self.media_type == MSGPACK_MEDIA_TYPE:
+            return packb(content)
+        return super().render(content)
+
+
+class MessagePackRoute(SessionReleasingRoute):
+    """A route whose responses are packed straight from its endpoint's return
+    value when the request prefers MessagePack.
+
+    The value is validated against the response model and dumped to Python
+    objects rather than JSON types, so UUIDs and datetimes are packed as they
+    are, and JSON isn't encoded at all. Use it with NegotiatedResponse as the
+    response class.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, endpoint, **kwargs)
+        self.response_adapter = (
+            TypeAdapter(self.response_model) if self.response_model else None
+        )
+
+    def wrap_endpoint(self, endpoint):
+        endpoint = super().wrap_endpoint(endpoint)
+
+        @functools.wraps(endpoint)
+        async def pack_response(*args, **kwargs):
+            content = await endpoint(*args, **kwargs)
+            if (
+                not msgpack_requested.get()
+                or self.response_adapter is None
+                or isinstance(content, Response)
+            ):
+                return content
+            response = self.negotiated_response(content, self.status_code or 200)
+            # The status and headers the endpoint set on its Response parameter
+            for value in kwargs.values():
+                if isinstance(value, Response):
+                    if value.status_code:
+                        response.status_code = value.status_code
+                    response.headers.raw.extend(value.headers.raw)
+            return response
+
+        return pack_response
+
+    def negotiated_response(
+        self, content, status_code: int, headers: Mapping[str, str] | None = None
+    ) -> NegotiatedResponse:
+        """A response with `content`, the endpoint's return value or its JSON,
+        dumped through the response model for MessagePack."""
+        if msgpack_requested.get() and self.response_adapter is not None:
+            try:
+                value = self.response_adapter.validate_python(
+                    content, from_attributes=True
+                )
+            except ValidationError:
+                # Not the response model, e.g. a replayed error
+                pass
+            else:
+                content = self.response_adapter.dump_python(
+                    value,
+                    by_alias=self.response_model_by_alias,
+                    exclude_unset=self.response_model_exclude_unset,
+                    exclude_defaults=self.response_model_exclude_defaults,
+                    exclude_none=self.response_model_exclude_none,
+                )
+        return NegotiatedResponse(content, status_code, headers)
+
+
+class MessagePackRouter(APIRouter):
+    """A router whose routes are all MessagePackRoutes answering with
+    NegotiatedResponse, including those of the routers included in it, like
+    fastapi-users' routers."""
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            route_class=MessagePackRoute,
+            default_response_class=NegotiatedResponse,
+            **kwargs,
+        )
+
+    def add_api_route(self, path: str, endpoint, **kwargs):
+        kwargs["route_class_override"] = MessagePackRoute
+        super().add_api_route(path, endpoint, **kwargs)
+
+
+async def read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def msgpack_to_json(body: bytes) -> bytes:
+    return json.dumps(jsonable_encoder(unpackb(body))).encode()
+
+
+class MessagePackMiddleware:
+    """Negotiates MessagePack request and response bodies.
+
+    MessagePack request bodies are handed to the app as JSON, so every route
+    accepts them. When Accept prefers MessagePack, JSON responses are
+    converted; responses that are MessagePack already pass through.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or msgpack is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        wants_msgpack = prefers_msgpack(headers.get("accept", ""))
+        held_start: Message | None = None
+        chunks: list[bytes] = []
+
+        async def send_negotiated(message: Message):
+            nonlocal held_start
+            if message["type"] == "http.response.start":
+                response_headers = MutableHeaders(scope=message)
+                response_headers.add_vary_header("Accept")
+                content_type = media_type(response_headers.get("content-type"))
+                if wants_msgpack and content_type == JSON_MEDIA_TYPE:
+                    held_start = message
+                    return
+            elif held_start is not None and message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                body = b"".join(chunks)
+                if body:
+                    body = packb(json.loads(body))
+                    response_headers = MutableHeaders(scope=held_start)
+                    response_headers["content-type"] = MSGPACK_MEDIA_TYPE
+                    response_headers["content-length"] = str(len(body))
+                await send(held_start)
+                message = {"type": "http.response.body", "body": body}
+            await send(message)
+
+        if media_type(headers.get("content-type")) in MSGPACK_MEDIA_TYPES:
+            try:
+                body = msgpack_to_json(await read_body(receive))
+            except (ValueError, msgpack.UnpackException):
+                response = JSONResponse(
+                    {"detail": "The request body isn't valid MessagePack"},
+                    status_code=400,
+                )
+                await response(scope, receive, send_negotiated)
+                return
+            scope = {
+                **scope,
+                "headers": [
+                    (name, value)
+                    for name, value in scope["headers"]
+                    if name not in (b"content-type", b"content-length")
+                ]
+                + [
+                    (b"content-type", JSON_MEDIA_TYPE.encode()),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+            receive = self.replay_body(body, receive)
+
+        token = msgpack_requested.set(wants_msgpack)
+        try:
+            await self.app(scope, receive, send_negotiated)
+        finally:
+            msgpack_requested.reset(token)
+
+    @staticmethod
+    def replay_body(body: bytes, receive: Receive) -> Receive:
+        """A receive giving the converted body, then the client's messages."""
+        pending = True
+
+        async def receive_converted() -> Message:
+            nonlocal pending
+            if pending:
+                pending = False
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return receive_converted
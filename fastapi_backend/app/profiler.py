@@ -0,0 +1,224 @@
+import asyncio
+import enum
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+from uuid import UUID
+
+from sqlalchemy import select
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .database import directory_session_maker
+from .models import User
+from .users import get_jwt_strategy
+
+PROFILE_HEADER = "X-Profile"
+PROFILED_STATUS_HEADER = "X-Profiled-Status"
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+class ProfileFormat(str, enum.Enum):
+    speedscope = "speedscope"
+    collapsed = "collapsed"
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def frame_stack(frame: FrameType | None) -> list[str]:
+    """The frame's call stack, outermost call first."""
+    stack = []
+    while frame is not None:
+        stack.append(frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class StackSampler:
+    """Samples the stacks of the worker's threads from a background thread.
+
+    Every `interval` seconds the current frame of each thread is walked and
+    its stack counted, so the cost is a few microseconds per thread per
+    sample rather than a hook on every call. Stacks on the event loop's thread
+    are rooted at the asyncio task running at the time, named after its
+    coroutine. Given a `task`, only the samples taken while it was running
+    are kept.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        loop: asyncio.AbstractEventLoop,
+        task: asyncio.Task | None = None,
+    ):
+        self.interval = interval
+        self.loop = loop
+        self.task = task
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.samples = 0
+        self._loop_thread = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread, frame in sys._current_frames().items():
+                if thread == own_thread:
+                    continue
+                if thread == self._loop_thread:
+                    root = self._task_root()
+                elif self.task is None:
+                    root = f"thread {thread_names.get(thread, thread)}"
+                else:
+                    root = None
+                if root is not None:
+                    self.stacks[(root, *frame_stack(frame))] += 1
+            self.samples += 1
+
+    def _task_root(self) -> str | None:
+        current = asyncio.current_task(self.loop)
+        if self.task is not None and current is not self.task:
+            return None
+        if current is None:
+            return "event loop"
+        return f"task {current.get_coro().__qualname__}"
+
+    def collapsed(self) -> str:
+        """The stacks in Brendan Gregg's collapsed format, as read by
+        flamegraph.pl, speedscope and most flame graph tools."""
+        return "".join(
+            f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.items()
+        )
+
+    def speedscope(self, name: str) -> dict:
+        """The stacks as a speedscope sampled profile, weighted in seconds."""
+        frames: dict[str, int] = {}
+        samples = []
+        weights = []
+        for stack, count in self.stacks.items():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+            weights.append(count * self.interval)
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "fastapi_backend",
+            "shared": {"frames": [{"name": frame} for frame in frames]},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+
+    def response(self, profile_format: ProfileFormat, name: str, **kwargs) -> Response:
+        if profile_format == ProfileFormat.collapsed:
+            return PlainTextResponse(self.collapsed(), **kwargs)
+        return JSONResponse(self.speedscope(name), **kwargs)
+
+
+async def is_superuser_request(headers: Headers) -> bool:
+    """Whether the request's bearer token belongs to an active superuser."""
+    scheme, _, token = headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    user_id = get_jwt_strategy().verify(token)
+    try:
+        user_id = UUID(user_id)
+    except (TypeError, ValueError):
+        return False
+    async with directory_session_maker() as session:
+        result = await session.execute(
+            select(User.is_active, User.is_superuser).where(User.id == user_id)
+        )
+        row = result.one_or_none()
+    return row is not None and row.is_active and row.is_superuser
+
+
+class RequestProfilerMiddleware:
+    """Profiles a single request for a superuser who sends `X-Profile`.
+
+    The header's value is the format, `speedscope` or `collapsed`. The
+    response is replaced by the profile of the request's own task, with the
+    original status in `X-Profiled-Status`. Requests from anyone else are
+    handled as if the header wasn't there.
+    """
+
+    def __init__(self, app: ASGIApp, interval: float):
+        self.app = app
+        self.interval = interval
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        requested = headers.get(PROFILE_HEADER)
+        if requested not in ProfileFormat.__members__ or not await is_superuser_request(
+            headers
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        status = None
+
+        async def discard_response(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        sampler = StackSampler(
+            self.interval, asyncio.get_running_loop(), asyncio.current_task()
+        )
+        sampler.start()
+        try:
+            await self.app(scope, receive, discard_response)
+        finally:
+            sampler.stop()
+        response = sampler.response(
+            ProfileFormat(requested),
+            f"{scope['method']} {scope['path']}",
+            headers={PROFILED_STATUS_HEADER: str(status)},
+        )
+        await response(scope, receive, send)
+
+
+# One worker profile at a time; the samplers would profile each other
+worker_profile_lock = asyncio.Lock()
+
+
+async def profile_worker(seconds: float, interval: float) -> StackSampler:
+    """Sample every thread of this worker for `seconds`."""
+    async with worker_profile_lock:
+        sampler = StackSampler(interval, asyncio.get_running_loop())
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+    return sampler
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+
+from app.config import settings
+from app.profiler import ProfileFormat, profile_worker, worker_profile_lock
+from app.users import current_superuser
+
+router = APIRouter(tags=["debug"], dependencies=[Depends(current_superuser)])
+
+
+@router.get(
+    "/profile",
+    response_class=Response,
+    responses={
+        200: {"content": {"application/json": {}, "text/plain": {}}},
+        409: {"description": "A profile of this worker is already running"},
+    },
+)
+async def profile(
+    seconds: float = Query(5, gt=0, le=settings.PROFILER_MAX_SECONDS),
+    format: ProfileFormat = ProfileFormat.speedscope,
+):
+    """Sample this worker's stacks for `seconds` and return them as a profile.
+
+    Stacks on the event loop are grouped under the asyncio task that was
+    running. `speedscope` profiles open in https://www.speedscope.app;
+    `collapsed` stacks work with flamegraph.pl and most flame graph tools.
+    Send `X-Profile: speedscope` or `X-Profile: collapsed` with any request
+    to get the profile of that request instead of its response.
+    """
+    if worker_profile_lock.locked():
+        raise HTTPException(
+            status_code=409, detail="A profile of this worker is already running"
+        )
+    sampler = await profile_worker(seconds, settings.PROFILER_INTERVAL_SECONDS)
+    return sampler.response(format, f"Worker profile ({seconds:g}s)")
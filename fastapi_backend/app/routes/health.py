@@ -0,0 +1,72 @@
+import asyncio
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.cache import cache
+from app.config import settings
+from app.database import get_pool_usage, ping_database, statement_cache_stats
+from app.deadlines import deadline_stats
+from app.insert_coalescer import insert_batch_stats
+from app.lifespan import request_tracker
+
+router = APIRouter(tags=["health"])
+
+
+@router.get("/live")
+async def liveness():
+    return {"status": "alive"}
+
+
+@router.get("/ready")
+async def readiness():
+    pool_usage = get_pool_usage()
+    checks = {
+        "draining": request_tracker.draining,
+        "pool_usage": pool_usage,
+        "pool_saturated": pool_usage is not None
+        and pool_usage >= settings.READINESS_MAX_POOL_USAGE,
+        "database": False,
+    }
+
+    # Skip the round trip when it could only queue behind a saturated pool
+    if not checks["draining"] and not checks["pool_saturated"]:
+        try:
+            await asyncio.wait_for(
+                ping_database(), settings.READINESS_DB_TIMEOUT_SECONDS
+            )
+            checks["database"] = True
+        except Exception:
+            pass
+
+    ready = (
+        checks["database"] and not checks["draining"] and not checks["pool_saturated"]
+    )
+    return JSONResponse(
+        {"status": "ready" if ready else "unavailable", "checks": checks},
+        status_code=200 if ready else 503,
+    )
+
+
+@router.get("/statement-cache")
+async def statement_cache():
+    """This worker's compiled and prepared statement cache hit rates."""
+    return statement_cache_stats.as_dict()
+
+
+@router.get("/insert-batching")
+async def insert_batching():
+    """This worker's coalesced item insert batches and the latency they added."""
+    return insert_batch_stats()
+
+
+@router.get("/deadlines")
+async def deadlines():
+    """This worker's requests cancelled on client disconnect or timed out."""
+    return deadline_stats.as_dict()
+
+
+@router.get("/cache")
+async def cache_stats():
+    """This worker's cache hit rates and invalidations, by tier."""
+    return cache.tier_stats()
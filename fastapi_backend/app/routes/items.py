@@ -1,55 +1,707 @@
+import asyncio
+import re
+from typing import Annotated
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import (
+    cast,
+    delete,
+    func,
+    insert,
+    literal,
+    null,
+    or_,
+    text,
+    tuple_,
+    union_all,
+    update,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects.postgresql import REGCONFIG
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from app.change_feed import CLOSED, ChangeFeed, get_change_feed
+from app.config import settings
 from app.database import User, get_async_session
-from app.models import Item
-from app.schemas import ItemRead, ItemCreate
+from app.deadlines import is_timeout
+from app.idempotency import IdempotentRequest, idempotent_request
+from app.insert_coalescer import insert_coalescers
+from app.item_import import IMPORT_PARSERS, copy_items
+from app.models import XID8, Item, ItemSummary, ItemTombstone, PrunedItemTombstones
+from app.negotiation import MessagePackRoute, NegotiatedResponse, msgpack_requested
+from app.schemas import (
+    BatchCreate,
+    BatchDelete,
+    BatchOperation,
+    BatchRequest,
+    BatchResponse,
+    BatchResult,
+    BatchUpdate,
+    ItemRead,
+    ItemChange,
+    ItemChanges,
+    ItemCreate,
+    ItemImportResult,
+    ItemListQuery,
+    ItemSort,
+    ItemSummaryRead,
+    ItemUpdate,
+    PartialItemRead,
+)
 from app.users import current_active_user
 
-router = APIRouter(tags=["item"])
+router = APIRouter(
+    tags=["item"],
+    route_class=MessagePackRoute,
+    default_response_class=NegotiatedResponse,
+)
 
+SEARCH_TERM_PATTERN = re.compile(r"\w+")
 
-@router.get("/", response_model=list[ItemRead])
+
+def build_search_query(user_id: UUID, q: str):
+    """Rank the user's items matching `q` by full-text relevance and name similarity.
+
+    Every word is matched as a prefix against the name and description, while
+    trigram word similarity on the name tolerates typos ("scrwdriver"). Both
+    predicates are served by GIN indexes. Returns None when `q` has no words.
+    """
+    terms = SEARCH_TERM_PATTERN.findall(q.lower())
+    if not terms:
+        return None
+
+    ts_query = func.to_tsquery(
+        cast("simple", REGCONFIG), " & ".join(f"{term}:*" for term in terms)
+    )
+    rank = func.ts_rank_cd(Item.search_vector, ts_query) + func.word_similarity(
+        q, Item.name
+    )
+    return (
+        select(Item)
+        .filter(
+            Item.user_id == user_id,
+            or_(Item.search_vector.op("@@")(ts_query), Item.name.op("%>")(q)),
+        )
+        .order_by(rank.desc(), Item.id)
+    )
+
+
+SORT_COLUMNS = {
+    ItemSort.name: (Item.name, Item.id),
+    ItemSort.name_desc: (Item.name.desc(), Item.id.desc()),
+    ItemSort.quantity: (Item.quantity, Item.id),
+    ItemSort.quantity_desc: (Item.quantity.desc(), Item.id.desc()),
+    ItemSort.created: (Item.created_at, Item.id),
+    ItemSort.created_desc: (Item.created_at.desc(), Item.id.desc()),
+}
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_item_list_query(user_id: UUID, params: ItemListQuery):
+    """Select the user's items matching the list filters, in the requested order.
+
+    Each sort order ends in the id so it is total and walks one of the
+    (user_id, column, id) indexes. New ids are time-ordered, so ties among
+    items created since then come in creation order. With `fields`, only
+    those columns are selected instead of whole Item rows.
+
+    The created sorts are paged with a keyset: `after` starts the range scan
+    of the (user_id, created_at, id) index just past the previous page's
+    last item, so a page costs the same however deep it is.
+    """
+    if params.fields is None:
+        query = select(Item)
+    else:
+        names = ["id", *(name for name in params.fields if name != "id")]
+        query = select(*(getattr(Item, name) for name in names))
+
+    query = query.filter(Item.user_id == user_id)
+    if params.min_quantity is not None:
+        query = query.filter(Item.quantity >= params.min_quantity)
+    if params.max_quantity is not None:
+        query = query.filter(Item.quantity <= params.max_quantity)
+    if params.name_prefix is not None:
+        pattern = escape_like(params.name_prefix.lower()) + "%"
+        query = query.filter(func.lower(Item.name).like(pattern, escape="\\"))
+    if params.has_description is not None:
+        has_description = func.coalesce(Item.description, "") != ""
+        query = query.filter(
+            has_description if params.has_description else ~has_description
+        )
+    if params.after is not None:
+        position = tuple_(Item.created_at, Item.id)
+        after = tuple_(*params.after)
+        if params.sort == ItemSort.created_desc:
+            query = query.filter(position < after)
+        else:
+            query = query.filter(position > after)
+    query = query.order_by(*SORT_COLUMNS[params.sort])
+    if params.limit is not None:
+        query = query.limit(params.limit)
+    return query
+
+
+async def list_items(
+    db: AsyncSession, user_id: UUID, params: ItemListQuery
+) -> list[ItemRead] | list[dict]:
+    if params.name_prefix is not None:
+        # A generic plan can't turn LIKE $1 into an index range, so plan each
+        # prefix query for its actual pattern (see execute_search)
+        await db.execute(text("SET LOCAL plan_cache_mode = force_custom_plan"))
+    result = await db.execute(build_item_list_query(user_id, params))
+    if params.fields is not None:
+        return [row._asdict() for row in result]
+    return [ItemRead.model_validate(item) for item in result.scalars().all()]
+
+
+@router.get("/", response_model=list[ItemRead | PartialItemRead])
 async def read_item(
+    params: Annotated[ItemListQuery, Query()],
     db: AsyncSession = Depends(get_async_session),
     user: User = Depends(current_active_user),
 ):
-    result = await db.execute(select(Item).filter(Item.user_id == user.id))
-    items = result.scalars().all()
+    """List the current user's items.
+
+    When `fields` is given, each item only contains `id` and the requested fields.
+
+    To page through the items in creation order, pass `limit` with
+    `sort=created` or `sort=-created`, then the last item's `created_at` and
+    `id` as `after` to get the next page (include `created_at` in `fields`).
+    """
+    items = await list_items(db, user.id, params)
+    if params.fields is not None:
+        # MessagePack takes the rows' UUIDs and datetimes as they are
+        return NegotiatedResponse(
+            items if msgpack_requested.get() else jsonable_encoder(items)
+        )
+    return items
+
+
+async def execute_search(
+    db: AsyncSession, user_id: UUID, q: str, limit: int, offset: int
+) -> list[Item]:
+    query = build_search_query(user_id, q)
+    if query is None:
+        return []
+    # asyncpg prepares statements, and after five runs Postgres may switch to a
+    # generic plan that can't tell one user's items are far fewer than the GIN
+    # matches across every user, making searches an order of magnitude slower.
+    await db.execute(text("SET LOCAL plan_cache_mode = force_custom_plan"))
+    result = await db.execute(query.limit(limit).offset(offset))
+    return list(result.scalars().all())
+
+
+@router.get("/search", response_model=list[ItemRead])
+async def search_items(
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+):
+    items = await execute_search(db, user.id, q, limit, offset)
     return [ItemRead.model_validate(item) for item in items]
 
 
+@router.get("/summary", response_model=ItemSummaryRead)
+async def read_item_summary(
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+):
+    """Count and total quantity of the current user's items.
+
+    Read from a per-user row that triggers on `items` keep up to date, so the
+    cost doesn't grow with the number of items.
+    """
+    summary = await db.get(ItemSummary, user.id)
+    if summary is None:
+        return ItemSummaryRead(item_count=0, total_quantity=0)
+    return summary
+
+
+async def insert_item(db: AsyncSession, user_id: UUID, item: ItemCreate) -> ItemRead:
+    result = await db.execute(
+        insert(Item).values(**item.model_dump(), user_id=user_id).returning(Item)
+    )
+    return ItemRead.model_validate(result.scalar_one())
+
+
+INITIAL_SYNC_CURSOR = f"0:{UUID(int=0)}"
+
+
+MAX_XID8 = 2**64 - 1
+
+# Seconds a client should wait before syncing again when changes are held back
+SYNC_PENDING_RETRY_AFTER = 1
+
+
+def parse_sync_cursor(cursor: str) -> tuple[int, int, UUID]:
+    """Split a cursor into the user's shard epoch, a transaction id and an item id."""
+    try:
+        epoch, _, position = cursor.rpartition("/")
+        xid, _, item_id = position.partition(":")
+        epoch, xid, item_id = int(epoch or 0), int(xid), UUID(item_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+    if not 0 <= xid <= MAX_XID8:
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+    return epoch, xid, item_id
+
+
+def format_sync_cursor(epoch: int, xid: int, item_id: UUID) -> str:
+    # Transaction ids are only comparable within one database, so the cursor
+    # also names how many times the user has moved to another shard. Cursors
+    # of users who never moved keep the plain xid:id form.
+    position = f"{xid}:{item_id}"
+    return f"{epoch}/{position}" if epoch else position
+
+
+def sync_horizon():
+    """The oldest transaction still in progress anywhere in the database."""
+    return func.pg_snapshot_xmin(func.pg_current_snapshot())
+
+
+def build_changes_query(user_id: UUID, xid: int, item_id: UUID, limit: int):
+    """Select the user's item upserts and deletions after the cursor position.
+
+    Changes are ordered by the id of the transaction that made them. Only
+    transactions older than every one still in progress are included, so a
+    change can't commit behind a cursor that a client has already moved past;
+    it is picked up by a later sync instead. Each side is a range scan on a
+    (user_id, change_xid, id) index, so an up-to-date client costs one probe
+    per table.
+    """
+    position = (cast(xid, XID8), cast(item_id, Item.id.type))
+    horizon = sync_horizon()
+    upserts = (
+        select(
+            literal("upsert").label("op"),
+            Item.change_xid,
+            Item.id,
+            Item.name,
+            Item.description,
+            Item.quantity,
+            Item.version,
+            Item.created_at,
+            Item.updated_at,
+        )
+        .filter(
+            Item.user_id == user_id,
+            tuple_(Item.change_xid, Item.id) > tuple_(*position),
+            Item.change_xid < horizon,
+        )
+        .order_by(Item.change_xid, Item.id)
+        .limit(limit)
+    )
+    deletes = (
+        select(
+            literal("delete"),
+            ItemTombstone.change_xid,
+            ItemTombstone.id,
+            null(),
+            null(),
+            null(),
+            null(),
+            null(),
+            null(),
+        )
+        .filter(
+            ItemTombstone.user_id == user_id,
+            tuple_(ItemTombstone.change_xid, ItemTombstone.id) > tuple_(*position),
+            ItemTombstone.change_xid < horizon,
+        )
+        .order_by(ItemTombstone.change_xid, ItemTombstone.id)
+        .limit(limit)
+    )
+    changes = union_all(upserts, deletes).subquery()
+    return select(changes).order_by(changes.c.change_xid, changes.c.id).limit(limit)
+
+
+def build_pending_changes_query(user_id: UUID):
+    """Whether any of the user's changes are being held back by the horizon."""
+    horizon = sync_horizon()
+    return select(
+        or_(
+            select(Item.id)
+            .filter(Item.user_id == user_id, Item.change_xid >= horizon)
+            .exists(),
+            select(ItemTombstone.id)
+            .filter(
+                ItemTombstone.user_id == user_id, ItemTombstone.change_xid >= horizon
+            )
+            .exists(),
+        )
+    )
+
+
+@router.get("/changes", response_model=ItemChanges)
+async def read_item_changes(
+    response: Response,
+    since: str | None = Query(
+        None, description="Cursor returned by the previous sync; omit to start over."
+    ),
+    limit: int = Query(500, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+):
+    """Items created, updated or deleted since the previous sync, in order.
+
+    Apply the changes and pass the returned cursor as `since` next time; while
+    `has_more` is true, call again straight away.
+
+    Changes only become visible once every transaction that started before
+    them has finished, so a single long-running write transaction anywhere in
+    the database (a bulk import, a migration, a session left idle in
+    transaction) stalls the feed for every user until it ends. When some of
+    the user's changes are held back this way, `pending` is true and a
+    Retry-After header says when to poll again.
+
+    Cursors older than the tombstone retention period, or from before the
+    user's items were moved to another database, get a 410 response: drop
+    the local copy and sync again without `since`.
+    """
+    since = since or INITIAL_SYNC_CURSOR
+    epoch, xid, item_id = parse_sync_cursor(since)
+    if since != INITIAL_SYNC_CURSOR:
+        if epoch != user.shard_epoch:
+            raise HTTPException(status_code=410, detail="Sync cursor has expired")
+        # Deletions after the cursor may have been forgotten
+        pruned = await db.get(PrunedItemTombstones, user.id)
+        if pruned is not None and xid < pruned.change_xid:
+            raise HTTPException(status_code=410, detail="Sync cursor has expired")
+    result = await db.execute(build_changes_query(user.id, xid, item_id, limit + 1))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    pending = False
+    if not has_more:
+        pending = (await db.execute(build_pending_changes_query(user.id))).scalar()
+        if pending:
+            response.headers["Retry-After"] = str(SYNC_PENDING_RETRY_AFTER)
+
+    changes = []
+    for row in rows:
+        if row.op == "delete":
+            changes.append(ItemChange(op="delete", id=row.id))
+            continue
+        item = ItemRead(user_id=user.id, **row._asdict())
+        changes.append(ItemChange(op="upsert", id=row.id, item=item))
+
+    if rows:
+        cursor = format_sync_cursor(user.shard_epoch, rows[-1].change_xid, rows[-1].id)
+    else:
+        cursor = since
+    return ItemChanges(
+        changes=changes,
+        cursor=cursor,
+        has_more=has_more,
+        pending=pending,
+    )
+
+
+async def stream_changes(feed: ChangeFeed, user_id: UUID, last_event_id: int | None):
+    subscription = feed.subscribe(user_id, last_event_id)
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.get(), settings.CHANGE_FEED_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield ": heartbeat\n\n"
+                continue
+            if event is CLOSED:
+                return
+            yield event.to_sse()
+    finally:
+        feed.unsubscribe(subscription)
+
+
+@router.get(
+    "/events",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def item_events(
+    last_event_id: int | None = Header(None),
+    feed: ChangeFeed = Depends(get_change_feed),
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+):
+    """Stream changes to the current user's items as server-sent events.
+
+    `insert`, `update` and `delete` events carry the item's id and version; on
+    a `reset` event the client should reload its items. Reconnecting with
+    `Last-Event-ID` resumes from that event when the server still has it.
+    """
+    user_id = user.id
+    # The stream may stay open for hours, so don't keep holding the database
+    # connection used to authenticate the request
+    await db.close()
+    try:
+        await feed.start(settings.CHANGE_FEED_START_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Change feed is unavailable")
+    return StreamingResponse(
+        stream_changes(feed, user_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/", response_model=ItemRead)
 async def create_item(
     item: ItemCreate,
+    idempotency: IdempotentRequest = Depends(idempotent_request),
     db: AsyncSession = Depends(get_async_session),
     user: User = Depends(current_active_user),
 ):
-    db_item = Item(**item.model_dump(), user_id=user.id)
-    db.add(db_item)
+    """Create an item.
+
+    Send an `Idempotency-Key` to make retries safe: a retry with the same key
+    gets the first response, with an `Idempotent-Replayed` header, instead of
+    creating another item. The other item writes accept the header as well.
+    """
+    if settings.ITEM_INSERT_BATCHING and idempotency.key is None:
+        # Committed along with other concurrent creates, on a connection of
+        # the coalescer's; a keyed create has to commit its key with the item
+        return await insert_coalescers[user.shard].insert(user.id, item)
+    created = await insert_item(db, user.id, item)
+    await idempotency.save_response(created)
     await db.commit()
-    await db.refresh(db_item)
-    return db_item
+    return created
 
 
-@router.delete("/{item_id}")
-async def delete_item(
+@router.post(
+    "/import",
+    response_model=ItemImportResult,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                media_type: {"schema": {"type": "string"}}
+                for media_type in IMPORT_PARSERS
+            },
+        }
+    },
+)
+async def import_items(
+    request: Request,
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+):
+    """Create items from an uploaded CSV or newline-delimited JSON file.
+
+    CSV files start with a header naming the columns (`name`, and optionally
+    `description` and `quantity`); NDJSON has one item object per line. The
+    file is read as it arrives and written with COPY, so its size doesn't
+    matter. Rows that aren't valid items are skipped and reported by line
+    number; the other rows are imported together or not at all.
+    """
+    media_type = request.headers.get("content-type", "").partition(";")[0].strip()
+    parse = IMPORT_PARSERS.get(media_type.lower())
+    if parse is None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Upload one of: {', '.join(IMPORT_PARSERS)}",
+        )
+    result = await copy_items(db, user.id, parse(request.stream()))
+    await db.commit()
+    return result
+
+
+def parse_if_match(if_match: str) -> list[int] | None:
+    """Item versions listed in an If-Match header, or None for `*`."""
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return None
+        # The compression middleware weakens ETags on compressed responses,
+        # but the tag still names the same version of the item
+        tag = tag.removeprefix("W/")
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            versions.append(int(tag[1:-1]))
+    return versions
+
+
+async def apply_item_update(
+    db: AsyncSession,
+    user_id: UUID,
     item_id: UUID,
+    item: ItemUpdate,
+    if_match: str | None,
+) -> ItemRead:
+    conditions = [Item.id == item_id, Item.user_id == user_id]
+    if if_match is not None:
+        versions = parse_if_match(if_match)
+        if versions is not None:
+            conditions.append(Item.version.in_(versions))
+
+    values = item.model_dump(exclude_unset=True)
+    if values:
+        statement = (
+            update(Item)
+            .where(*conditions)
+            .values(**values, version=Item.version + 1)
+            .returning(Item)
+            .execution_options(synchronize_session=False)
+        )
+    else:
+        statement = select(Item).where(*conditions)
+    db_item = (await db.execute(statement)).scalars().first()
+
+    if db_item is None:
+        # Only failed updates pay for a second query to tell the cases apart
+        result = await db.execute(
+            select(Item.version).filter(Item.id == item_id, Item.user_id == user_id)
+        )
+        version = result.scalar()
+        if version is None:
+            raise HTTPException(
+                status_code=404, detail="Item not found or not authorized"
+            )
+        raise HTTPException(
+            status_code=412,
+            detail="Item was modified by another request",
+            headers={"ETag": f'"{version}"'},
+        )
+    return ItemRead.model_validate(db_item)
+
+
+@router.patch("/{item_id}", response_model=ItemRead)
+async def update_item(
+    item_id: UUID,
+    item: ItemUpdate,
+    response: Response,
+    if_match: str | None = Header(None),
+    idempotency: IdempotentRequest = Depends(idempotent_request),
     db: AsyncSession = Depends(get_async_session),
     user: User = Depends(current_active_user),
 ):
+    """Apply the provided fields to an item in a single UPDATE ... RETURNING.
+
+    Send the item's ETag in `If-Match` to only update it if it hasn't changed
+    since; otherwise the response is 412 with the current ETag.
+    """
+    updated = await apply_item_update(db, user.id, item_id, item, if_match)
+    response.headers["ETag"] = f'"{updated.version}"'
+    await idempotency.save_response(updated, headers={"ETag": response.headers["ETag"]})
+    await db.commit()
+    return updated
+
+
+async def remove_item(db: AsyncSession, user_id: UUID, item_id: UUID) -> None:
     result = await db.execute(
-        select(Item).filter(Item.id == item_id, Item.user_id == user.id)
+        delete(Item)
+        .where(Item.id == item_id, Item.user_id == user_id)
+        .returning(Item.id)
     )
-    item = result.scalars().first()
-
-    if not item:
+    if result.scalar() is None:
         raise HTTPException(status_code=404, detail="Item not found or not authorized")
 
-    await db.delete(item)
+
+@router.delete("/{item_id}")
+async def delete_item(
+    item_id: UUID,
+    idempotency: IdempotentRequest = Depends(idempotent_request),
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+):
+    await remove_item(db, user.id, item_id)
+    deleted = {"message": "Item successfully deleted"}
+    await idempotency.save_response(deleted)
     await db.commit()
 
-    return {"message": "Item successfully deleted"}
+    return deleted
+
+
+async def run_batch_operation(
+    db: AsyncSession, user_id: UUID, operation: BatchOperation
+):
+    if isinstance(operation, BatchCreate):
+        return await insert_item(db, user_id, operation.item)
+    if isinstance(operation, BatchUpdate):
+        return await apply_item_update(
+            db, user_id, operation.id, operation.item, operation.if_match
+        )
+    if isinstance(operation, BatchDelete):
+        await remove_item(db, user_id, operation.id)
+        return {"message": "Item successfully deleted"}
+    return await list_items(db, user_id, operation.query)
+
+
+@router.post("/batch", response_model=BatchResponse)
+async def batch_items(
+    batch: BatchRequest,
+    idempotency: IdempotentRequest = Depends(idempotent_request),
+    db: AsyncSession = Depends(get_async_session),
+    user: User = Depends(current_active_user),
+):
+    """Run several item operations in order, in one request and one transaction.
+
+    Each result carries the status and body the single-item route would have
+    returned. When `atomic` is true (the default) the first failure rolls back
+    the whole batch and every other operation reports 424. Otherwise each
+    operation runs in its own savepoint, so failures are reported without
+    undoing the rest.
+    """
+    # Resolved once: rolling back expires the user instance
+    user_id = user.id
+    results: list[BatchResult] = []
+    for operation in batch.operations:
+        try:
+            if batch.atomic:
+                body = await run_batch_operation(db, user_id, operation)
+            else:
+                async with db.begin_nested():
+                    body = await run_batch_operation(db, user_id, operation)
+        except HTTPException as e:
+            failure = BatchResult(status=e.status_code, body={"detail": e.detail})
+        except DBAPIError as e:
+            # The request is out of time; the rest of the batch would be too
+            if is_timeout(e):
+                raise
+            failure = BatchResult(
+                status=400, body={"detail": "The database rejected this operation"}
+            )
+        else:
+            results.append(BatchResult(status=200, body=jsonable_encoder(body)))
+            continue
+
+        if not batch.atomic:
+            results.append(failure)
+            continue
+
+        await db.rollback()
+        failed_index = len(results)
+        not_applied = BatchResult(
+            status=424,
+            body={"detail": f"Not applied because operation {failed_index} failed"},
+        )
+        results = [not_applied] * failed_index + [failure]
+        results += [not_applied] * (len(batch.operations) - failed_index - 1)
+        # The rollback also released the idempotency key, so nothing is stored
+        return BatchResponse(committed=False, results=results)
+
+    response = BatchResponse(committed=True, results=results)
+    await idempotency.save_response(response)
+    await db.commit()
+    return response
@@ -0,0 +1,104 @@
+from collections import defaultdict
+from typing import Annotated
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import get_directory_session, shard_session
+from app.models import ItemSummary, User
+from app.negotiation import MessagePackRoute, NegotiatedResponse
+from app.routes.items import escape_like
+from app.schemas import UserListQuery, UserPage, UserWithItemsRead
+from app.users import current_superuser
+
+router = APIRouter(
+    tags=["users"],
+    route_class=MessagePackRoute,
+    default_response_class=NegotiatedResponse,
+    dependencies=[Depends(current_superuser)],
+)
+
+
+def build_user_list_query(params: UserListQuery):
+    """Select a page of users matching the filters, in email order.
+
+    Emails are unique, so the last one on a page is the cursor for the next,
+    and every page is a range scan of the email index. The prefix filter
+    starts the scan at the prefix: LIKE alone only turns into an index range
+    under the C collation, while a string never sorts before its own prefix
+    under any collation.
+    """
+    query = select(User).order_by(User.email).limit(params.limit + 1)
+    if params.cursor is not None:
+        query = query.filter(User.email > params.cursor)
+    if params.email_prefix is not None:
+        pattern = escape_like(params.email_prefix) + "%"
+        query = query.filter(
+            User.email >= params.email_prefix, User.email.like(pattern, escape="\\")
+        )
+    if params.is_active is not None:
+        query = query.filter(User.is_active == params.is_active)
+    if params.is_verified is not None:
+        query = query.filter(User.is_verified == params.is_verified)
+    return query
+
+
+async def read_item_summaries(users: list[User]) -> dict[UUID, ItemSummary]:
+    """The item summaries of the users, read from each of their shards."""
+    user_ids_by_shard: dict[int, list[UUID]] = defaultdict(list)
+    for user in users:
+        user_ids_by_shard[user.shard].append(user.id)
+    summaries = {}
+    for shard, user_ids in user_ids_by_shard.items():
+        async with shard_session(shard) as session:
+            result = await session.execute(
+                select(ItemSummary).where(ItemSummary.user_id.in_(user_ids))
+            )
+            summaries.update((summary.user_id, summary) for summary in result.scalars())
+    return summaries
+
+
+@router.get("/", response_model=UserPage)
+async def list_users(
+    params: Annotated[UserListQuery, Query()],
+    directory: AsyncSession = Depends(get_directory_session),
+):
+    """List user accounts in email order, with their item counts. Superusers only.
+
+    `email_prefix` matches the start of the email as stored, case included.
+    Pass the returned cursor as `cursor` for the next page while `has_more`
+    is true.
+
+    Item counts come from the per-user summaries kept up to date by triggers
+    as items change, one primary key lookup per user, rather than from
+    counting items.
+    """
+    result = await directory.execute(build_user_list_query(params))
+    users = list(result.scalars().all())
+    has_more = len(users) > params.limit
+    users = users[: params.limit]
+    # Done with the directory; the summaries are read from the shards
+    await directory.close()
+
+    summaries = await read_item_summaries(users)
+    page = []
+    for user in users:
+        summary = summaries.get(user.id)
+        page.append(
+            UserWithItemsRead(
+                id=user.id,
+                email=user.email,
+                is_active=user.is_active,
+                is_superuser=user.is_superuser,
+                is_verified=user.is_verified,
+                item_count=summary.item_count if summary else 0,
+                total_quantity=summary.total_quantity if summary else 0,
+            )
+        )
+    return UserPage(
+        users=page,
+        cursor=users[-1].email if users else params.cursor,
+        has_more=has_more,
+    )
@@ -1,7 +1,10 @@
 import uuid
+from datetime import datetime
+from enum import Enum
+from typing import Annotated, Any, Literal
 
 from fastapi_users import schemas
-from pydantic import BaseModel
+from pydantic import BaseModel, BeforeValidator, Field, field_validator, model_validator
 from uuid import UUID
 
 
@@ -17,6 +20,28 @@ class UserUpdate(schemas.BaseUserUpdate):
     pass
 
 
+class UserListQuery(BaseModel):
+    email_prefix: str | None = Field(None, min_length=1, max_length=320)
+    is_active: bool | None = None
+    is_verified: bool | None = None
+    cursor: str | None = Field(
+        None, description="Cursor returned by the previous page; omit to start over."
+    )
+    limit: int = Field(50, ge=1, le=200)
+
+
+class UserWithItemsRead(UserRead):
+    item_count: int
+    total_quantity: int
+
+
+class UserPage(BaseModel):
+    users: list[UserWithItemsRead]
+    # Pass as `cursor` to get the next page
+    cursor: str | None
+    has_more: bool
+
+
 class ItemBase(BaseModel):
     name: str
     description: str | None = None
@@ -27,8 +52,185 @@ class ItemCreate(ItemBase):
     pass
 
 
+class ItemUpdate(BaseModel):
+    name: str | None = None
+    description: str | None = None
+    quantity: int | None = None
+
+    @field_validator("name")
+    @classmethod
+    def name_not_null(cls, value):
+        if value is None:
+            raise ValueError("name cannot be null")
+        return value
+
+
 class ItemRead(ItemBase):
     id: UUID
     user_id: UUID
+    version: int
+    created_at: datetime
+    updated_at: datetime
 
     model_config = {"from_attributes": True}
+
+
+class PartialItemRead(BaseModel):
+    """An item limited to the fields requested with `fields`."""
+
+    id: UUID
+    name: str | None = None
+    description: str | None = None
+    quantity: int | None = None
+    user_id: UUID | None = None
+    version: int | None = None
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+
+
+class ItemSummaryRead(BaseModel):
+    item_count: int
+    total_quantity: int
+
+    model_config = {"from_attributes": True}
+
+
+ItemField = Literal[
+    "id",
+    "name",
+    "description",
+    "quantity",
+    "user_id",
+    "version",
+    "created_at",
+    "updated_at",
+]
+
+
+class ItemSort(str, Enum):
+    name = "name"
+    name_desc = "-name"
+    quantity = "quantity"
+    quantity_desc = "-quantity"
+    created = "created"
+    created_desc = "-created"
+
+
+def split_fields(value):
+    """Accept both `fields=name,quantity` and repeated `fields=` parameters."""
+    if value is None:
+        return None
+    values = [value] if isinstance(value, str) else value
+    return [field.strip() for v in values for field in v.split(",") if field.strip()]
+
+
+def split_cursor(value):
+    """Split `after=<created_at>,<id>` into its two parts."""
+    if isinstance(value, str):
+        return value.rsplit(",", 1)
+    if isinstance(value, list) and all(isinstance(part, str) for part in value):
+        # Query parameters come as a list
+        return ",".join(value).rsplit(",", 1)
+    return value
+
+
+class ItemListQuery(BaseModel):
+    min_quantity: int | None = None
+    max_quantity: int | None = None
+    name_prefix: str | None = Field(None, min_length=1, max_length=200)
+    has_description: bool | None = None
+    sort: ItemSort = ItemSort.name
+    fields: Annotated[list[ItemField] | None, BeforeValidator(split_fields)] = Field(
+        None,
+        description="Only return these fields, comma-separated. `id` is always included.",
+    )
+    after: Annotated[
+        tuple[datetime, UUID] | None, BeforeValidator(split_cursor)
+    ] = Field(
+        None,
+        description="With the created sorts, only return the items after this "
+        "one: the last item's `created_at` and `id`, comma-separated.",
+    )
+    limit: int | None = Field(None, ge=1, le=1000)
+
+    @model_validator(mode="after")
+    def check_after(self):
+        if self.after is not None and self.sort not in (
+            ItemSort.created,
+            ItemSort.created_desc,
+        ):
+            raise ValueError("after needs sort=created or sort=-created")
+        return self
+
+
+class ItemImportError(BaseModel):
+    line: int
+    detail: str
+
+
+class ItemImportResult(BaseModel):
+    imported: int
+    rejected: int
+    # The first rejected rows, in file order
+    errors: list[ItemImportError]
+
+
+class ItemChange(BaseModel):
+    op: Literal["upsert", "delete"]
+    id: UUID
+    item: ItemRead | None = None
+
+
+class ItemChanges(BaseModel):
+    changes: list[ItemChange]
+    cursor: str
+    has_more: bool
+    # Newer changes exist but are held back until older transactions finish
+    pending: bool = False
+
+
+MAX_BATCH_OPERATIONS = 100
+
+
+class BatchCreate(BaseModel):
+    op: Literal["create"]
+    item: ItemCreate
+
+
+class BatchUpdate(BaseModel):
+    op: Literal["update"]
+    id: UUID
+    item: ItemUpdate
+    if_match: str | None = None
+
+
+class BatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: UUID
+
+
+class BatchList(BaseModel):
+    op: Literal["list"]
+    query: ItemListQuery = ItemListQuery()
+
+
+BatchOperation = Annotated[
+    BatchCreate | BatchUpdate | BatchDelete | BatchList, Field(discriminator="op")
+]
+
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation] = Field(
+        min_length=1, max_length=MAX_BATCH_OPERATIONS
+    )
+    atomic: bool = True
+
+
+class BatchResult(BaseModel):
+    status: int
+    body: Any = None
+
+
+class BatchResponse(BaseModel):
+    committed: bool
+    results: list[BatchResult]
@@ -0,0 +1,125 @@
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import jwt
+from fastapi_users import exceptions, models
+from fastapi_users.authentication import JWTStrategy
+from fastapi_users.manager import BaseUserManager
+
+
+class KeyRing:
+    """The access token signing key, and the retired keys still accepted.
+
+    Tokens name their key in the `kid` header. To rotate, move the current
+    key into `verification_keys` under its id and sign with a new one: tokens
+    signed with the old key stay valid until they expire, and the old key can
+    be dropped after ACCESS_TOKEN_EXPIRE_SECONDS.
+    """
+
+    def __init__(
+        self,
+        signing_key_id: str,
+        signing_key: str,
+        verification_keys: dict[str, str] | None = None,
+    ):
+        self.signing_key_id = signing_key_id
+        self.signing_key = signing_key
+        self.keys = {**(verification_keys or {}), signing_key_id: signing_key}
+
+    def verification_key(self, key_id: str | None) -> str | None:
+        # Tokens issued before key ids were introduced have no kid
+        if key_id is None:
+            return self.signing_key
+        return self.keys.get(key_id)
+
+
+class CachedJWTStrategy(JWTStrategy):
+    """A JWT strategy that signs with a key ring and remembers verified tokens.
+
+    It is created once rather than per request. Verifying a token's signature
+    and claims is the same work every time the client sends it, so the user
+    id of each verified token is kept, keyed by the token's digest, until the
+    token expires; only the user lookup is done again. The cache holds the
+    `cache_size` most recently used tokens.
+    """
+
+    def __init__(
+        self,
+        key_ring: KeyRing,
+        lifetime_seconds: Optional[int],
+        cache_size: int,
+        algorithm: str = "HS256",
+    ):
+        super().__init__(
+            secret=key_ring.signing_key,
+            lifetime_seconds=lifetime_seconds,
+            algorithm=algorithm,
+        )
+        self.key_ring = key_ring
+        self.cache_size = cache_size
+        # Token digest -> (user id, expiry as a Unix time or None)
+        self._verified: OrderedDict[bytes, tuple[str, float | None]] = OrderedDict()
+
+    def verify(self, token: str) -> str | None:
+        """The token's user id, if its signature and claims are valid."""
+        digest = hashlib.sha256(token.encode()).digest()
+        cached = self._verified.get(digest)
+        if cached is not None:
+            user_id, expires_at = cached
+            if expires_at is None or expires_at > time.time():
+                self._verified.move_to_end(digest)
+                return user_id
+            del self._verified[digest]
+
+        try:
+            key = self.key_ring.verification_key(
+                jwt.get_unverified_header(token).get("kid")
+            )
+            if key is None:
+                return None
+            data = jwt.decode(
+                token,
+                key,
+                audience=self.token_audience,
+                algorithms=[self.algorithm],
+            )
+        except jwt.PyJWTError:
+            return None
+        user_id = data.get("sub")
+        if user_id is None:
+            return None
+
+        self._verified[digest] = (user_id, data.get("exp"))
+        if len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+        return user_id
+
+    async def read_token(
+        self, token: Optional[str], user_manager: BaseUserManager[models.UP, models.ID]
+    ) -> Optional[models.UP]:
+        if token is None:
+            return None
+        user_id = self.verify(token)
+        if user_id is None:
+            return None
+        try:
+            parsed_id = user_manager.parse_id(user_id)
+            return await user_manager.get(parsed_id)
+        except (exceptions.UserNotExists, exceptions.InvalidID):
+            return None
+
+    async def write_token(self, user: models.UP) -> str:
+        payload = {"sub": str(user.id), "aud": self.token_audience}
+        if self.lifetime_seconds:
+            payload["exp"] = datetime.now(timezone.utc) + timedelta(
+                seconds=self.lifetime_seconds
+            )
+        return jwt.encode(
+            payload,
+            self.key_ring.signing_key,
+            algorithm=self.algorithm,
+            headers={"kid": self.key_ring.signing_key_id},
+        )
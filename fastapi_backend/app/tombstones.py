@@ -0,0 +1,85 @@
+"""Retention of the tombstones left by deleted items.
+
+Delta sync reads the tombstones to tell clients which items are gone, so they
+are kept for ITEM_TOMBSTONE_RETENTION_SECONDS and then deleted. The latest
+deleted tombstone of each user is recorded, and sync cursors from before it
+are rejected: a client that hasn't synced for that long reloads its items
+rather than keeping ones deleted in the meantime.
+"""
+
+import asyncio
+import logging
+from datetime import timedelta
+from uuid import UUID
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import shard_engines, shard_session
+from .models import ItemTombstone, PrunedItemTombstones
+
+logger = logging.getLogger(__name__)
+
+# Expired tombstones deleted per statement by the cleanup
+CLEANUP_BATCH_SIZE = 1000
+
+
+async def delete_expired_tombstones(db: AsyncSession, retention: float) -> int:
+    """Delete tombstones older than `retention` seconds in batches, each
+    committed along with the record of what it deleted."""
+    deleted = 0
+    while True:
+        expired = (
+            select(ItemTombstone.id)
+            .where(ItemTombstone.deleted_at < func.now() - timedelta(seconds=retention))
+            .limit(CLEANUP_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        result = await db.execute(
+            delete(ItemTombstone)
+            .where(ItemTombstone.id.in_(expired))
+            .returning(ItemTombstone.user_id, ItemTombstone.change_xid)
+        )
+        latest: dict[UUID, int] = {}
+        rows = result.all()
+        for user_id, change_xid in rows:
+            latest[user_id] = max(latest.get(user_id, 0), change_xid)
+        if latest:
+            statement = insert(PrunedItemTombstones).values(
+                [
+                    {"user_id": user_id, "change_xid": change_xid}
+                    for user_id, change_xid in latest.items()
+                ]
+            )
+            await db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[PrunedItemTombstones.user_id],
+                    set_={
+                        "change_xid": func.greatest(
+                            PrunedItemTombstones.change_xid,
+                            statement.excluded.change_xid,
+                        )
+                    },
+                )
+            )
+        await db.commit()
+        deleted += len(rows)
+        if len(rows) < CLEANUP_BATCH_SIZE:
+            return deleted
+
+
+async def clean_up_expired_tombstones(interval: float, retention: float):
+    """Delete expired tombstones on every shard every `interval` seconds,
+    until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        for shard in range(len(shard_engines)):
+            try:
+                async with shard_session(shard) as db:
+                    deleted = await delete_expired_tombstones(db, retention)
+            except Exception:
+                logger.exception("Item tombstone cleanup failed on shard %d", shard)
+                continue
+            if deleted:
+                logger.info("Deleted %d expired item tombstones", deleted)
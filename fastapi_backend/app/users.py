@@ -1,9 +1,10 @@
+import logging
 import uuid
 import re
 
 from typing import Optional
 
-from fastapi import Depends, Request
+from fastapi import Depends, HTTPException, Request
 from fastapi_users import (
     BaseUserManager,
     FastAPIUsers,
@@ -11,28 +12,38 @@ from fastapi_users import (
     InvalidPasswordException,
 )
 
-from fastapi_users.authentication import (
-    AuthenticationBackend,
-    BearerTransport,
-    JWTStrategy,
-)
+from fastapi_users.authentication import AuthenticationBackend, BearerTransport
 from fastapi_users.db import SQLAlchemyUserDatabase
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .config import settings
-from .database import get_user_db
+from .database import (
+    bind_to_shard,
+    delete_user_items,
+    get_async_session,
+    get_user_db,
+    shard_session,
+)
 from .email import send_reset_password_email
+from .log import current_user_id
 from .models import User
 from .schemas import UserCreate
+from .tokens import CachedJWTStrategy, KeyRing
+
+logger = logging.getLogger(__name__)
 
 AUTH_URL_PATH = "auth"
 
+# Seconds a client should wait while the user's items move to another shard
+SHARD_MOVE_RETRY_AFTER = 5
+
 
 class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     reset_password_token_secret = settings.RESET_PASSWORD_SECRET_KEY
     verification_token_secret = settings.VERIFICATION_SECRET_KEY
 
     async def on_after_register(self, user: User, request: Optional[Request] = None):
-        print(f"User {user.id} has registered.")
+        logger.info("User registered", extra={"user_id": str(user.id)})
 
     async def on_after_forgot_password(
         self, user: User, token: str, request: Optional[Request] = None
@@ -42,7 +53,14 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     async def on_after_request_verify(
         self, user: User, token: str, request: Optional[Request] = None
     ):
-        print(f"Verification requested for user {user.id}. Verification token: {token}")
+        logger.info("Verification requested", extra={"user_id": str(user.id)})
+        # There's no verification email yet, so the token is only logged
+        logger.debug("Verification token: %s", token, extra={"user_id": str(user.id)})
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        async with shard_session(user.shard) as session:
+            await delete_user_items(session, user.id)
+            await session.commit()
 
     async def validate_password(
         self,
@@ -71,11 +89,21 @@ async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db
 bearer_transport = BearerTransport(tokenUrl=f"{AUTH_URL_PATH}/jwt/login")
 
 
-def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(
-        secret=settings.ACCESS_SECRET_KEY,
-        lifetime_seconds=settings.ACCESS_TOKEN_EXPIRE_SECONDS,
-    )
+# Shared by every request, along with its cache of verified tokens
+jwt_strategy = CachedJWTStrategy(
+    KeyRing(
+        settings.ACCESS_SECRET_KEY_ID,
+        settings.ACCESS_SECRET_KEY,
+        settings.ACCESS_VERIFICATION_KEYS,
+    ),
+    lifetime_seconds=settings.ACCESS_TOKEN_EXPIRE_SECONDS,
+    cache_size=settings.ACCESS_TOKEN_CACHE_SIZE,
+    algorithm=settings.ALGORITHM,
+)
+
+
+def get_jwt_strategy() -> CachedJWTStrategy:
+    return jwt_strategy
 
 
 auth_backend = AuthenticationBackend(
@@ -86,4 +114,29 @@ auth_backend = AuthenticationBackend(
 
 fastapi_users = FastAPIUsers[User, uuid.UUID](get_user_manager, [auth_backend])
 
-current_active_user = fastapi_users.current_user(active=True)
+current_active_account = fastapi_users.current_user(active=True)
+current_superuser = fastapi_users.current_user(active=True, superuser=True)
+
+
+async def current_active_user(
+    user: User = Depends(current_active_account),
+    user_db: SQLAlchemyUserDatabase = Depends(get_user_db),
+    session: AsyncSession = Depends(get_async_session),
+) -> User:
+    """The authenticated user, with the request's session bound to their shard.
+
+    The directory session the user was loaded with is closed, so its
+    connection isn't held for the rest of the request, unless it's also the
+    request's session.
+    """
+    current_user_id.set(str(user.id))
+    if settings.DATABASE_EARLY_RELEASE and user_db.session is not session:
+        await user_db.session.close()
+    if user.shard_moving:
+        raise HTTPException(
+            status_code=503,
+            detail="Your items are being moved, try again shortly",
+            headers={"Retry-After": str(SHARD_MOVE_RETRY_AFTER)},
+        )
+    bind_to_shard(session, user.shard)
+    return user
@@ -1,5 +1,42 @@
+import os
+import threading
+import time
+from uuid import UUID
+
 from fastapi.routing import APIRoute
 
 
 def simple_generate_unique_route_id(route: APIRoute):
     return f"{route.tags[0]}-{route.name}"
+
+
+_uuid7_lock = threading.Lock()
+_uuid7_last_timestamp = 0
+_uuid7_last_counter = 0
+
+
+def uuid7() -> UUID:
+    """A time-ordered UUID (RFC 9562 version 7).
+
+    The first 48 bits are the Unix time in milliseconds, so new ids sort after
+    older ones and land at the right edge of a B-tree index instead of at a
+    random page. The remaining 74 bits are random, except that within the same
+    millisecond they count up from the previous id, keeping ids from this
+    process strictly increasing.
+    """
+    global _uuid7_last_timestamp, _uuid7_last_counter
+    with _uuid7_lock:
+        timestamp = time.time_ns() // 1_000_000
+        if timestamp > _uuid7_last_timestamp:
+            # One bit short of the field, leaving room to count up
+            counter = int.from_bytes(os.urandom(10), "big") >> 7
+        else:
+            timestamp = _uuid7_last_timestamp
+            counter = _uuid7_last_counter + 1
+            if counter >> 74:
+                timestamp += 1
+                counter = int.from_bytes(os.urandom(10), "big") >> 7
+        _uuid7_last_timestamp, _uuid7_last_counter = timestamp, counter
+
+    rand_a, rand_b = counter >> 62, counter & (1 << 62) - 1
+    return UUID(int=timestamp << 80 | 0x7 << 76 | rand_a << 64 | 0b10 << 62 | rand_b)
@@ -0,0 +1,142 @@
+"""Benchmark how long each request holds its database connections.
+
+Creates a benchmark user with synthetic items in the database at DATABASE_URL,
+then sends concurrent item list requests through the app in-process, once with
+connections returned as soon as each route is done with them and once with
+them held until the request's dependencies exit (DATABASE_EARLY_RELEASE off).
+Reports how long connections were checked out per request, the most checked
+out at once, and requests per second. Set DATABASE_POOL_SIZE to benchmark a
+pool. Use a disposable database; the benchmark user and their items are
+removed afterwards.
+
+    uv run python -m commands.benchmark_connection_hold --items 500 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from types import SimpleNamespace
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import delete, event, insert
+
+from app.config import settings
+from app.database import delete_user_items, dispose_engines, engine, shard_session
+from app.main import app
+from app.models import Item, User
+from app.users import get_jwt_strategy
+
+BENCH_EMAIL_DOMAIN = "connection-benchmark.invalid"
+
+
+class ConnectionHoldTimes:
+    """Time from each checkout of a pooled connection to its checkin."""
+
+    def __init__(self):
+        self.held: list[float] = []
+        self.checked_out = 0
+        self.most_checked_out = 0
+        self._checked_out_at: dict[int, float] = {}
+
+    def checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self._checked_out_at[id(connection_record)] = time.perf_counter()
+        self.checked_out += 1
+        self.most_checked_out = max(self.most_checked_out, self.checked_out)
+
+    def checkin(self, dbapi_connection, connection_record):
+        started = self._checked_out_at.pop(id(connection_record), None)
+        if started is not None:
+            self.held.append(time.perf_counter() - started)
+            self.checked_out -= 1
+
+
+async def run(requests: int, concurrency: int, headers: dict) -> tuple[float, int]:
+    """Send the requests from `concurrency` clients; returns elapsed seconds
+    and how many failed."""
+    failed = 0
+    remaining = iter(range(requests))
+
+    async def client_loop(client: AsyncClient):
+        nonlocal failed
+        for _ in remaining:
+            response = await client.get("/items/", headers=headers)
+            failed += response.status_code != 200
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://benchmark"
+    ) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        return time.perf_counter() - start, failed
+
+
+async def main(items: int, requests: int, concurrency: int) -> None:
+    user_id = uuid.uuid4()
+    token = await get_jwt_strategy().write_token(SimpleNamespace(id=user_id))
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(
+                insert(User).values(
+                    id=user_id,
+                    email=f"{user_id}@{BENCH_EMAIL_DOMAIN}",
+                    hashed_password="",
+                )
+            )
+        async with shard_session(0) as session:
+            await session.execute(
+                insert(Item),
+                [
+                    {
+                        "name": f"Item {i}",
+                        "description": f"Description of item {i}",
+                        "quantity": i,
+                        "user_id": user_id,
+                    }
+                    for i in range(items)
+                ],
+            )
+            await session.commit()
+
+        # Connection time per request sums its user and items connections
+        print(
+            f"{'release':<10}{'ms/request':>12}{'p95 ms/conn':>14}{'max out':>9}"
+            f"{'req/s':>9}{'failed':>8}"
+        )
+        for early_release in (False, True):
+            settings.DATABASE_EARLY_RELEASE = early_release
+            # One warm-up request, so connecting isn't counted
+            await run(1, 1, headers)
+            times = ConnectionHoldTimes()
+            event.listen(engine.sync_engine, "checkout", times.checkout)
+            event.listen(engine.sync_engine, "checkin", times.checkin)
+            try:
+                elapsed, failed = await run(requests, concurrency, headers)
+            finally:
+                event.remove(engine.sync_engine, "checkout", times.checkout)
+                event.remove(engine.sync_engine, "checkin", times.checkin)
+            held_ms = [held * 1000 for held in times.held]
+            print(
+                f"{'early' if early_release else 'at exit':<10}"
+                f"{sum(held_ms) / requests:>12.2f}"
+                f"{statistics.quantiles(held_ms, n=20)[-1]:>14.2f}"
+                f"{times.most_checked_out:>9}{requests / elapsed:>9.0f}{failed:>8}"
+            )
+    finally:
+        async with shard_session(0) as session:
+            await delete_user_items(session, user_id)
+            await session.commit()
+        async with engine.begin() as conn:
+            await conn.execute(delete(User).where(User.id == user_id))
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.requests, args.concurrency))
@@ -0,0 +1,102 @@
+"""Benchmark the streaming item import on a large CSV file.
+
+Writes a CSV file of synthetic items to a temporary directory, then feeds it
+in 64 KiB chunks, as a request body arrives, through the import route's
+parser and COPY into the database at DATABASE_URL, for a benchmark user.
+Reports rows per second and how much the process's peak memory grew. Use a
+disposable database; the benchmark user and their items are removed
+afterwards.
+
+    uv run python -m commands.benchmark_item_import --rows 1000000
+"""
+
+import argparse
+import asyncio
+import csv
+import resource
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from sqlalchemy import delete, insert
+
+from app.database import delete_user_items, dispose_engines, engine, shard_session
+from app.item_import import copy_items, parse_csv
+from app.models import User
+
+CHUNK_SIZE = 64 * 1024
+BENCH_EMAIL_DOMAIN = "import-benchmark.invalid"
+
+
+def write_csv(path: Path, rows: int) -> None:
+    with path.open("w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["name", "description", "quantity"])
+        for i in range(rows):
+            # Every 1000th row is missing its name and gets rejected
+            name = "" if i % 1000 == 999 else f"Item {i}"
+            writer.writerow([name, f"Imported, row {i}", i % 100])
+
+
+async def read_chunks(path: Path):
+    with path.open("rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+
+
+def peak_memory_mib() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def main(rows: int) -> None:
+    user_id = uuid.uuid4()
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "items.csv"
+        start = time.perf_counter()
+        write_csv(path, rows)
+        size = path.stat().st_size / 2**20
+        print(
+            f"Wrote {rows} rows ({size:.0f} MiB) in {time.perf_counter() - start:.1f}s"
+        )
+
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(
+                    insert(User).values(
+                        id=user_id,
+                        email=f"{user_id}@{BENCH_EMAIL_DOMAIN}",
+                        hashed_password="",
+                    )
+                )
+            memory_before = peak_memory_mib()
+            start = time.perf_counter()
+            async with shard_session(0) as session:
+                result = await copy_items(
+                    session, user_id, parse_csv(read_chunks(path))
+                )
+                await session.commit()
+            elapsed = time.perf_counter() - start
+            print(
+                f"Imported {result.imported} rows, rejected {result.rejected}, "
+                f"in {elapsed:.1f}s: {result.imported / elapsed:.0f} rows/s"
+            )
+            print(
+                f"Peak memory grew by {peak_memory_mib() - memory_before:.1f} MiB "
+                f"(peak {peak_memory_mib():.0f} MiB)"
+            )
+        finally:
+            async with shard_session(0) as session:
+                await delete_user_items(session, user_id)
+                await session.commit()
+            async with engine.begin() as conn:
+                await conn.execute(delete(User).where(User.id == user_id))
+            await dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows))
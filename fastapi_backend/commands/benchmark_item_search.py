@@ -0,0 +1,145 @@
+"""Benchmark the item search query on a large items table.
+
+Seeds synthetic users and items into the database at DATABASE_URL, then times
+the search route's query for prefix, multi-word and misspelled terms. Use a
+disposable database; the seeded rows are removed afterwards unless --keep is
+passed.
+
+    uv run python -m commands.benchmark_item_search --items 2000000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+
+from app.database import directory_session_maker, engine
+from app.routes.items import build_search_query, execute_search
+
+BENCH_EMAIL_DOMAIN = "search-benchmark.invalid"
+
+WORDS = [
+    "screwdriver", "hammer", "wrench", "pliers", "drill", "chisel", "sander",
+    "saw", "level", "clamp", "ladder", "bucket", "brush", "roller", "tape",
+    "glue", "nail", "screw", "bolt", "washer", "hinge", "handle", "cable",
+    "socket", "battery", "charger", "lamp", "bulb", "switch", "fuse", "pipe",
+    "valve", "hose", "nozzle", "filter", "pump", "fan", "heater", "cooler",
+    "blade",
+]  # fmt: skip
+
+QUERIES = ["screw", "ham", "drill battery", "scrwdriver", "chargr", "socket wrench"]
+
+
+async def seed(items: int, users: int) -> None:
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                'INSERT INTO "user" '
+                "(id, email, hashed_password, is_active, is_superuser, is_verified) "
+                "SELECT gen_random_uuid(), 'user' || g || '@' || :domain, '', "
+                "true, false, true FROM generate_series(1, :users) g"
+            ),
+            {"domain": BENCH_EMAIL_DOMAIN, "users": users},
+        )
+        await conn.execute(
+            text(
+                'WITH u AS (SELECT array_agg(id) AS ids FROM "user" '
+                "WHERE email LIKE '%@' || :domain) "
+                "INSERT INTO items (id, name, description, quantity, user_id) "
+                "SELECT gen_random_uuid(), "
+                "initcap(w[1 + floor(random() * n)::int]) || ' ' || "
+                "w[1 + floor(random() * n)::int], "
+                "'Useful ' || w[1 + floor(random() * n)::int] || ' for the ' || "
+                "w[1 + floor(random() * n)::int], "
+                "g % 100, u.ids[1 + g % CAST(:users AS integer)] "
+                "FROM generate_series(1, :items) g, u, "
+                "(SELECT CAST(:words AS text[]) AS w, CAST(:n AS integer) AS n) v"
+            ),
+            {
+                "domain": BENCH_EMAIL_DOMAIN,
+                "users": users,
+                "items": items,
+                "words": WORDS,
+                "n": len(WORDS),
+            },
+        )
+        await conn.execute(text("ANALYZE items"))
+
+
+async def cleanup() -> None:
+    async with engine.begin() as conn:
+        await conn.execute(
+            text(
+                "DELETE FROM items WHERE user_id IN "
+                "(SELECT id FROM \"user\" WHERE email LIKE '%@' || :domain)"
+            ),
+            {"domain": BENCH_EMAIL_DOMAIN},
+        )
+        await conn.execute(
+            text("DELETE FROM \"user\" WHERE email LIKE '%@' || :domain"),
+            {"domain": BENCH_EMAIL_DOMAIN},
+        )
+
+
+async def benchmark(repeat: int) -> None:
+    async with directory_session_maker() as session:
+        user_id = (
+            await session.execute(
+                text(
+                    "SELECT id FROM \"user\" WHERE email LIKE '%@' || :domain LIMIT 1"
+                ),
+                {"domain": BENCH_EMAIL_DOMAIN},
+            )
+        ).scalar_one()
+
+        print(f"{'query':<16}{'rows':>6}{'p50 ms':>10}{'p95 ms':>10}")
+        for q in QUERIES:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = await execute_search(session, user_id, q, limit=20, offset=0)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+            print(
+                f"{q:<16}{len(rows):>6}{statistics.median(timings):>10.2f}{p95:>10.2f}"
+            )
+
+        compiled = (
+            build_search_query(user_id, QUERIES[0])
+            .limit(20)
+            .compile(dialect=engine.dialect)
+        )
+        connection = await session.connection()
+        plan = await connection.exec_driver_sql(
+            f"EXPLAIN (ANALYZE, BUFFERS) {compiled}",
+            tuple(compiled.params[name] for name in compiled.positiontup),
+        )
+        print("\nPlan for", repr(QUERIES[0]))
+        print("\n".join(row[0] for row in plan))
+
+
+async def main(items: int, users: int, repeat: int, keep: bool) -> None:
+    start = time.perf_counter()
+    await seed(items, users)
+    print(
+        f"Seeded {items} items for {users} users in {time.perf_counter() - start:.1f}s"
+    )
+    try:
+        await benchmark(repeat)
+    finally:
+        if not keep:
+            await cleanup()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.users, args.repeat, args.keep))
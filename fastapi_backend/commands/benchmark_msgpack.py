@@ -0,0 +1,82 @@
+"""Benchmark MessagePack item list responses against JSON.
+
+Builds a list of synthetic items and encodes it the way the item routes do for
+each format: dumped by the response model to JSON types and written with
+JSONResponse, or dumped to Python objects and packed as MessagePack. Reports
+the median encode time and the body size, plain and gzipped as the
+compression middleware would send it. Validating the items is the same for
+both formats and isn't counted.
+
+    uv run python -m commands.benchmark_msgpack --items 1000 --repeat 200
+"""
+
+import argparse
+import gzip
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from app.compression import GZIP_LEVEL
+from app.negotiation import msgpack, packb
+from app.schemas import ItemRead
+
+
+def synthetic_items(count: int) -> list[ItemRead]:
+    user_id = uuid.uuid4()
+    now = datetime.now(timezone.utc)
+    return [
+        ItemRead(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            name=f"Item {i}",
+            description=f"Description of item {i}",
+            quantity=i,
+            version=1,
+            created_at=now,
+            updated_at=now,
+        )
+        for i in range(count)
+    ]
+
+
+def encode_json(adapter: TypeAdapter, items: list[ItemRead]) -> bytes:
+    return JSONResponse(adapter.dump_python(items, mode="json")).body
+
+
+def encode_msgpack(adapter: TypeAdapter, items: list[ItemRead]) -> bytes:
+    return packb(adapter.dump_python(items, mode="python"))
+
+
+ENCODERS = {"json": encode_json, "msgpack": encode_msgpack}
+
+
+def main(items: int, repeat: int) -> None:
+    if msgpack is None:
+        raise SystemExit("Install the msgpack extra: uv sync --extra msgpack")
+    adapter = TypeAdapter(list[ItemRead])
+    payload = synthetic_items(items)
+
+    print(f"{'format':<10}{'p50 ms':>10}{'bytes':>12}{'gzip bytes':>12}")
+    for name, encode in ENCODERS.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            body = encode(adapter, payload)
+            timings.append((time.perf_counter() - start) * 1000)
+        compressed = gzip.compress(body, GZIP_LEVEL)
+        print(
+            f"{name:<10}{statistics.median(timings):>10.2f}"
+            f"{len(body):>12}{len(compressed):>12}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    main(args.items, args.repeat)
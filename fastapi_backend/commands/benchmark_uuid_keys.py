@@ -0,0 +1,120 @@
+"""Benchmark inserts keyed by random (v4) and time-ordered (v7) UUIDs.
+
+Creates two scratch tables shaped like items, with a UUID primary key and a
+(user_id, id) index, in the database at DATABASE_URL. The same number of rows
+is inserted into each, one committed batch at a time, with ids from uuid4 or
+from the app's uuid7. Reports insert throughput and the size of the table and
+its indexes. Random keys scatter inserts over every leaf page, so the
+difference shows once the indexes outgrow shared_buffers. The tables are
+dropped afterwards unless --keep is passed.
+
+    uv run python -m commands.benchmark_uuid_keys --rows 2000000
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.utils import uuid7
+
+ID_FUNCTIONS = {"uuid4": uuid.uuid4, "uuid7": uuid7}
+
+
+def table_name(kind: str) -> str:
+    return f"benchmark_{kind}_items"
+
+
+async def create_table(kind: str) -> None:
+    name = table_name(kind)
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        await conn.execute(
+            text(
+                f"CREATE TABLE {name} (id uuid PRIMARY KEY, user_id uuid NOT NULL, "
+                "name text NOT NULL, created_at timestamptz NOT NULL DEFAULT now())"
+            )
+        )
+        await conn.execute(text(f"CREATE INDEX ON {name} (user_id, id)"))
+
+
+async def insert_rows(kind: str, rows: int, batch_size: int, users: int) -> float:
+    """Insert the rows in committed batches; returns the elapsed seconds."""
+    new_id = ID_FUNCTIONS[kind]
+    user_ids = [uuid.uuid4() for _ in range(users)]
+    statement = text(
+        f"INSERT INTO {table_name(kind)} (id, user_id, name) "
+        "SELECT * FROM unnest(CAST(:ids AS uuid[]), CAST(:user_ids AS uuid[]), "
+        "CAST(:names AS text[]))"
+    )
+    start = time.perf_counter()
+    for offset in range(0, rows, batch_size):
+        count = min(batch_size, rows - offset)
+        async with engine.begin() as conn:
+            await conn.execute(
+                statement,
+                {
+                    "ids": [new_id() for _ in range(count)],
+                    "user_ids": [user_ids[i % users] for i in range(count)],
+                    "names": [f"Item {offset + i}" for i in range(count)],
+                },
+            )
+    return time.perf_counter() - start
+
+
+async def relation_sizes(kind: str) -> tuple[int, int, int]:
+    """Sizes in bytes of the table, its primary key and its (user_id, id) index."""
+    name = table_name(kind)
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text(
+                "SELECT pg_relation_size(CAST(:table AS regclass)), "
+                "pg_relation_size(CAST(:pkey AS regclass)), "
+                "pg_relation_size(CAST(:user_index AS regclass))"
+            ),
+            {
+                "table": name,
+                "pkey": f"{name}_pkey",
+                "user_index": f"{name}_user_id_id_idx",
+            },
+        )
+        return tuple(result.one())
+
+
+async def drop_tables() -> None:
+    async with engine.begin() as conn:
+        for kind in ID_FUNCTIONS:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {table_name(kind)}"))
+
+
+async def main(rows: int, batch_size: int, users: int, keep: bool) -> None:
+    print(
+        f"{'ids':<8}{'rows/s':>10}{'table MB':>10}{'pkey MB':>10}"
+        f"{'user idx MB':>13}"
+    )
+    try:
+        for kind in ID_FUNCTIONS:
+            await create_table(kind)
+            elapsed = await insert_rows(kind, rows, batch_size, users)
+            table, pkey, user_index = await relation_sizes(kind)
+            print(
+                f"{kind:<8}{rows / elapsed:>10.0f}{table / 2**20:>10.1f}"
+                f"{pkey / 2**20:>10.1f}{user_index / 2**20:>13.1f}"
+            )
+    finally:
+        if not keep:
+            await drop_tables()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.batch_size, args.users, args.keep))
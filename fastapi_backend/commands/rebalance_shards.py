@@ -0,0 +1,226 @@
+"""Move users' items between shards.
+
+With no arguments, every user who is not on their home shard is moved there;
+run it after appending a database to DATABASE_SHARD_URLS (and migrating it) to
+spread users onto the new shard. A single user can be moved anywhere with
+--user and --shard.
+
+    uv run python -m commands.rebalance_shards
+    uv run python -m commands.rebalance_shards --user <id> --shard 2
+
+A user's requests get 503 responses while their items and idempotency keys
+are copied. Their sync cursors are invalidated by the move, and their open
+event streams are reset and closed so the clients reconnect to the new shard.
+"""
+
+import argparse
+import asyncio
+import json
+from uuid import UUID
+
+from sqlalchemy import func, insert, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import (
+    delete_user_items,
+    directory_session_maker,
+    dispose_engines,
+    home_shard,
+    shard_engines,
+    shard_session,
+)
+from app.models import ITEM_CHANGES_CHANNEL, IdempotencyKey, Item, User
+
+# Added to the longest request deadline for the drain, so that requests cut
+# off at their deadline have rolled back
+DRAIN_MARGIN_SECONDS = 1.0
+
+# Rows read and written per statement, so a user's items needn't fit in memory
+COPY_BATCH_SIZE = 1000
+
+# Copied as they are; change_xid comes from the new shard's own transaction,
+# and summaries and tombstones are rebuilt there by the triggers
+COPIED_COLUMNS = [
+    column
+    for column in Item.__table__.columns
+    if column.name not in ("change_xid", "search_vector")
+]
+
+
+def default_drain_seconds() -> float:
+    """How long requests authenticated before the user was flagged as moving
+    may go on writing to the old shard: none outlives the longest deadline."""
+    deadlines = [
+        settings.REQUEST_DEADLINE_SECONDS,
+        *settings.REQUEST_DEADLINES.values(),
+    ]
+    return max(deadlines) + DRAIN_MARGIN_SECONDS
+
+
+async def copy_rows(
+    source: AsyncSession,
+    target: AsyncSession,
+    model,
+    columns: list,
+    order_by: list,
+    user_id: UUID,
+) -> int:
+    """Copy a user's rows of `model` in batches, in keyset order on the
+    `order_by` columns, which are unique for the user and indexed with it.
+
+    The rows are locked on the source until its transaction ends.
+    """
+    copied = 0
+    position = None
+    while True:
+        query = (
+            select(*columns)
+            .where(model.user_id == user_id)
+            .order_by(*order_by)
+            .limit(COPY_BATCH_SIZE)
+            .with_for_update(read=True)
+        )
+        if position is not None:
+            query = query.where(tuple_(*order_by) > tuple_(*position))
+        rows = [row._asdict() for row in await source.execute(query)]
+        if rows:
+            await target.execute(insert(model), rows)
+        copied += len(rows)
+        if len(rows) < COPY_BATCH_SIZE:
+            return copied
+        position = [rows[-1][column.name] for column in order_by]
+
+
+async def copy_user_items(source: AsyncSession, target: AsyncSession, user_id: UUID):
+    """Copy the user's items and idempotency keys from the source shard,
+    replacing any on the target. Returns the number of items copied.
+
+    The keys come along so that a retry arriving just after the move still
+    gets the stored response rather than running the request again.
+    """
+    # Left behind by an earlier move that failed before the switch
+    await delete_user_items(target, user_id)
+    copied = await copy_rows(
+        source,
+        target,
+        Item,
+        COPIED_COLUMNS,
+        [Item.created_at, Item.id],
+        user_id,
+    )
+    await copy_rows(
+        source,
+        target,
+        IdempotencyKey,
+        list(IdempotencyKey.__table__.columns),
+        [IdempotencyKey.key],
+        user_id,
+    )
+    return copied
+
+
+async def move_user(
+    directory: AsyncSession,
+    user_id: UUID,
+    shard: int,
+    drain_seconds: float | None = None,
+) -> bool:
+    """Move a user's items to `shard`. Returns False if they are already there.
+
+    Once the user is flagged as moving, new requests get a 503, and the move
+    waits `drain_seconds` (by default, the longest request deadline) for the
+    ones already running to finish their writes on the old shard.
+    """
+    if drain_seconds is None:
+        drain_seconds = default_drain_seconds()
+    user = await directory.get(User, user_id, with_for_update=True)
+    if user is None:
+        raise ValueError(f"User {user_id} does not exist")
+    source_shard = user.shard
+    if source_shard == shard:
+        await directory.rollback()
+        return False
+    user.shard_moving = True
+    await directory.commit()
+
+    switched = False
+    try:
+        await asyncio.sleep(drain_seconds)
+        async with shard_session(source_shard) as source:
+            async with shard_session(shard) as target:
+                await copy_user_items(source, target, user_id)
+                await target.commit()
+
+            await directory.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(
+                    shard=shard, shard_epoch=User.shard_epoch + 1, shard_moving=False
+                )
+            )
+            await directory.commit()
+            switched = True
+
+            # Sent before the deletes so the user's streams close without
+            # seeing them
+            payload = json.dumps({"op": "moved", "user_id": str(user_id)})
+            await source.execute(select(func.pg_notify(ITEM_CHANGES_CHANNEL, payload)))
+            await delete_user_items(source, user_id)
+            await source.commit()
+    except Exception:
+        if not switched:
+            await directory.rollback()
+            await directory.execute(
+                update(User).where(User.id == user_id).values(shard_moving=False)
+            )
+            await directory.commit()
+        else:
+            print(
+                f"User {user_id} moved, but their items remain on shard {source_shard}"
+            )
+        raise
+    return True
+
+
+async def rebalance(directory: AsyncSession, drain_seconds: float | None) -> int:
+    """Move every user who is not on their home shard. Returns how many moved."""
+    result = await directory.execute(select(User.id, User.shard))
+    misplaced = [user_id for user_id, shard in result if shard != home_shard(user_id)]
+    await directory.rollback()
+    for user_id in misplaced:
+        await move_user(directory, user_id, home_shard(user_id), drain_seconds)
+    return len(misplaced)
+
+
+async def main(
+    user_id: UUID | None, shard: int | None, drain_seconds: float | None
+) -> None:
+    try:
+        async with directory_session_maker() as directory:
+            if user_id is None:
+                moved = await rebalance(directory, drain_seconds)
+                print(f"Moved {moved} users to their home shard")
+            elif await move_user(directory, user_id, shard, drain_seconds):
+                print(f"Moved user {user_id} to shard {shard}")
+            else:
+                print(f"User {user_id} is already on shard {shard}")
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user", type=UUID, help="move only this user")
+    parser.add_argument("--shard", type=int, help="shard to move --user to")
+    parser.add_argument(
+        "--drain-seconds",
+        type=float,
+        help="wait for in-flight requests (default: the longest request deadline)",
+    )
+    args = parser.parse_args()
+    if (args.user is None) != (args.shard is None):
+        parser.error("--user and --shard go together")
+    if args.shard is not None and not 0 <= args.shard < len(shard_engines):
+        parser.error(f"--shard must be between 0 and {len(shard_engines) - 1}")
+    asyncio.run(main(args.user, args.shard, args.drain_seconds))
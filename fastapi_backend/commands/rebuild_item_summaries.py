@@ -0,0 +1,61 @@
+"""Rebuild the per-user item summaries from the items table.
+
+The summaries are maintained by triggers, so this is only needed to repair
+drift, e.g. after the triggers were disabled for a bulk load. Each shard is
+rebuilt in turn, with writes to its items blocked while it runs.
+
+    uv run python -m commands.rebuild_item_summaries
+"""
+
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.database import dispose_engines, shard_engines
+
+# SHARE mode lets reads through but holds off writers, whose trigger deltas
+# would otherwise be overwritten by totals computed from an older snapshot.
+LOCK_ITEMS = text("LOCK TABLE items IN SHARE MODE")
+
+UPSERT_SUMMARIES = text(
+    "INSERT INTO item_summaries AS s (user_id, item_count, total_quantity) "
+    "SELECT user_id, count(*), coalesce(sum(quantity), 0) "
+    "FROM items GROUP BY user_id "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    "item_count = excluded.item_count, total_quantity = excluded.total_quantity "
+    "WHERE (s.item_count, s.total_quantity) "
+    "IS DISTINCT FROM (excluded.item_count, excluded.total_quantity)"
+)
+
+ZERO_EMPTY_SUMMARIES = text(
+    "UPDATE item_summaries AS s SET item_count = 0, total_quantity = 0 "
+    "WHERE (s.item_count <> 0 OR s.total_quantity <> 0) "
+    "AND NOT EXISTS (SELECT 1 FROM items WHERE items.user_id = s.user_id)"
+)
+
+
+async def rebuild_item_summaries(conn: AsyncConnection) -> int:
+    """Correct every summary that disagrees with the items table.
+
+    Returns the number of summaries changed.
+    """
+    await conn.execute(LOCK_ITEMS)
+    upserted = await conn.execute(UPSERT_SUMMARIES)
+    zeroed = await conn.execute(ZERO_EMPTY_SUMMARIES)
+    return upserted.rowcount + zeroed.rowcount
+
+
+async def main() -> None:
+    corrected = 0
+    try:
+        for shard_engine in shard_engines:
+            async with shard_engine.begin() as conn:
+                corrected += await rebuild_item_summaries(conn)
+    finally:
+        await dispose_engines()
+    print(f"Corrected {corrected} item summaries")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+"""Run the data backfills that migrations deferred.
+
+Migrations run with ALEMBIC_DEFER_BACKFILLS=1 only register their backfills;
+this runs the pending ones on every shard, oldest first, resuming any that
+were interrupted. Safe to run while the app is serving traffic.
+
+    uv run python -m commands.run_backfills
+"""
+
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from alembic_migrations.backfill import PROGRESS_TABLE, Backfill, run_batches
+from app.database import dispose_engines, shard_engines
+
+PENDING_BACKFILLS = text(
+    f"SELECT definition FROM {PROGRESS_TABLE} "
+    "WHERE finished_at IS NULL ORDER BY started_at"
+)
+
+
+def run_pending_backfills(connection: Connection) -> int:
+    """Run every unfinished backfill. Returns the number of rows updated."""
+    if connection.execute(text(f"SELECT to_regclass('{PROGRESS_TABLE}')")).scalar():
+        definitions = connection.execute(PENDING_BACKFILLS).scalars().all()
+    else:
+        definitions = []
+    return sum(
+        run_batches(connection, Backfill(**definition)) for definition in definitions
+    )
+
+
+async def main() -> None:
+    updated = 0
+    try:
+        for shard_engine in shard_engines:
+            async with shard_engine.connect() as conn:
+                await conn.execution_options(isolation_level="AUTOCOMMIT")
+                updated += await conn.run_sync(run_pending_backfills)
+    finally:
+        await dispose_engines()
+    print(f"Backfilled {updated} rows")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+import itertools
+import uuid
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import insert, select, text
+
+from alembic_migrations.backfill import (
+    PROGRESS_TABLE,
+    Backfill,
+    register_backfill,
+    run_batches,
+)
+from app.models import Item
+from commands.run_backfills import run_pending_backfills
+
+BACKFILL = Backfill(
+    name="test_bump_version",
+    table="items",
+    set="version = version + 1",
+    where="quantity IS NOT NULL",
+    batch_size=4,
+    pause_ratio=0,
+)
+
+
+@pytest_asyncio.fixture
+async def conn(engine):
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        yield conn
+        await conn.execute(text(f"DROP TABLE IF EXISTS {PROGRESS_TABLE}"))
+
+
+@pytest_asyncio.fixture
+async def items(conn):
+    # Two users, so the batches span partitions
+    user_ids = [uuid.uuid4(), uuid.uuid4()]
+    await conn.execute(
+        insert(Item),
+        [
+            {"name": f"Item {i}", "quantity": i % 3 or None, "user_id": user_ids[i % 2]}
+            for i in range(30)
+        ],
+    )
+
+
+async def versions(conn):
+    result = await conn.execute(select(Item.quantity, Item.version))
+    return {(quantity is not None, version) for quantity, version in result}
+
+
+async def progress(conn):
+    result = await conn.execute(
+        text(
+            f"SELECT rows_updated, finished_at IS NOT NULL AS finished "
+            f"FROM {PROGRESS_TABLE} WHERE name = :name"
+        ),
+        {"name": BACKFILL.name},
+    )
+    return tuple(result.one())
+
+
+@pytest.mark.asyncio
+async def test_backfill_updates_matching_rows_once(conn, items):
+    await conn.run_sync(register_backfill, BACKFILL)
+
+    updated = await conn.run_sync(run_batches, BACKFILL)
+
+    assert updated == 20
+    assert await versions(conn) == {(True, 2), (False, 1)}
+    assert await progress(conn) == (20, True)
+    # Finished backfills are skipped
+    assert await conn.run_sync(run_batches, BACKFILL) == 0
+    assert await versions(conn) == {(True, 2), (False, 1)}
+
+
+@pytest.mark.asyncio
+async def test_interrupted_backfill_resumes(conn, items, mocker):
+    await conn.run_sync(register_backfill, BACKFILL)
+    mocker.patch(
+        "alembic_migrations.backfill.time.sleep",
+        side_effect=[None, KeyboardInterrupt],
+    )
+    with pytest.raises(KeyboardInterrupt):
+        await conn.run_sync(run_batches, BACKFILL)
+    assert await progress(conn) == (8, False)
+
+    mocker.patch("alembic_migrations.backfill.time.sleep")
+    assert await conn.run_sync(run_batches, BACKFILL) == 12
+
+    assert await versions(conn) == {(True, 2), (False, 1)}
+    assert await progress(conn) == (20, True)
+
+
+@pytest.mark.asyncio
+async def test_slow_batches_shrink(conn, items, mocker):
+    await conn.run_sync(register_backfill, BACKFILL)
+    # Every batch appears to take a second
+    clock = mocker.patch("alembic_migrations.backfill.time")
+    clock.monotonic.side_effect = itertools.count()
+    execute = mocker.spy(conn.sync_connection, "execute")
+
+    await conn.run_sync(run_batches, BACKFILL)
+
+    limits = [
+        call.args[1]["limit"]
+        for call in execute.call_args_list
+        if len(call.args) > 1 and "limit" in call.args[1]
+    ]
+    assert limits[:3] == [4, 2, 1]
+    assert await versions(conn) == {(True, 2), (False, 1)}
+
+
+@pytest.mark.asyncio
+async def test_replication_lag_pauses_the_backfill(conn, items, mocker):
+    await conn.run_sync(register_backfill, BACKFILL)
+    lags = iter([30.0, 0.0])
+    sleep = mocker.patch("alembic_migrations.backfill.time.sleep")
+    real_execute = conn.sync_connection.execute
+
+    def execute(statement, *args, **kwargs):
+        if "pg_stat_replication" in str(statement):
+            return mocker.Mock(scalar=lambda: next(lags, 0.0))
+        return real_execute(statement, *args, **kwargs)
+
+    mocker.patch.object(conn.sync_connection, "execute", side_effect=execute)
+
+    await conn.run_sync(run_batches, BACKFILL)
+
+    assert sleep.call_args_list[0] == mocker.call(1.0)
+    assert await progress(conn) == (20, True)
+
+
+@pytest.mark.asyncio
+async def test_pending_backfills_are_run(conn, items):
+    # Nothing registered yet
+    assert await conn.run_sync(run_pending_backfills) == 0
+
+    await conn.run_sync(register_backfill, BACKFILL)
+
+    assert await conn.run_sync(run_pending_backfills) == 20
+    assert await progress(conn) == (20, True)
@@ -0,0 +1,211 @@
+import uuid
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import insert, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.config import settings
+from app.database import home_shard
+from app.models import Base, IdempotencyKey, Item, ItemSummary, User
+from commands import rebalance_shards
+from commands.rebalance_shards import default_drain_seconds, move_user, rebalance
+
+
+@pytest_asyncio.fixture
+async def shard_engine(engine):
+    """A second database standing in for shard 1."""
+    url = make_url(settings.TEST_DATABASE_URL)
+    shard_url = url.set(database=f"{url.database}_shard1")
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        exists = await conn.scalar(
+            text("SELECT 1 FROM pg_database WHERE datname = :name"),
+            {"name": shard_url.database},
+        )
+        if not exists:
+            await conn.execute(text(f'CREATE DATABASE "{shard_url.database}"'))
+
+    shard_engine = create_async_engine(shard_url)
+    async with shard_engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await conn.run_sync(Base.metadata.create_all)
+
+    yield shard_engine
+
+    async with shard_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await shard_engine.dispose()
+
+
+@pytest.fixture
+def shards(mocker, engine, shard_engine):
+    shards = [engine, shard_engine]
+    mocker.patch("app.database.shard_engines", shards)
+    return shards
+
+
+@pytest_asyncio.fixture
+async def directory(engine):
+    async with async_sessionmaker(engine, expire_on_commit=False)() as session:
+        yield session
+
+
+async def add_user(engine, shard=0):
+    user_id = uuid.uuid4()
+    async with engine.begin() as conn:
+        await conn.execute(
+            insert(User).values(
+                id=user_id,
+                email=f"{user_id}@example.com",
+                hashed_password="",
+                shard=shard,
+            )
+        )
+    return user_id
+
+
+async def add_items(shard_engine, user_id, *items):
+    async with shard_engine.begin() as conn:
+        await conn.execute(
+            insert(Item),
+            [
+                {"name": name, "quantity": quantity, "user_id": user_id}
+                for name, quantity in items
+            ],
+        )
+
+
+async def user_items(shard_engine, user_id):
+    async with shard_engine.connect() as conn:
+        result = await conn.execute(
+            select(Item.name, Item.quantity, Item.version)
+            .where(Item.user_id == user_id)
+            .order_by(Item.name)
+        )
+        summary = await conn.execute(
+            select(ItemSummary.item_count, ItemSummary.total_quantity).where(
+                ItemSummary.user_id == user_id
+            )
+        )
+        return result.all(), summary.first()
+
+
+@pytest.mark.asyncio
+async def test_move_user(shards, directory):
+    user_id = await add_user(shards[0])
+    other_user_id = await add_user(shards[0])
+    await add_items(shards[0], user_id, ("Saw", 1), ("Drill", 2))
+    await add_items(shards[0], other_user_id, ("Bolt", 5))
+
+    assert await move_user(directory, user_id, 1, drain_seconds=0) is True
+
+    items, summary = await user_items(shards[1], user_id)
+    assert items == [("Drill", 2, 1), ("Saw", 1, 1)]
+    assert summary == (2, 3)
+    assert await user_items(shards[0], user_id) == ([], None)
+    assert (await user_items(shards[0], other_user_id))[0] == [("Bolt", 5, 1)]
+
+    user = await directory.get(User, user_id, populate_existing=True)
+    assert (user.shard, user.shard_epoch, user.shard_moving) == (1, 1, False)
+
+
+@pytest.mark.asyncio
+async def test_move_copies_in_batches(shards, directory, mocker):
+    mocker.patch.object(rebalance_shards, "COPY_BATCH_SIZE", 2)
+    user_id = await add_user(shards[0])
+    names = [(f"Item {i}", i) for i in range(5)]
+    await add_items(shards[0], user_id, *names)
+    insert_spy = mocker.spy(rebalance_shards, "insert")
+
+    await move_user(directory, user_id, 1, drain_seconds=0)
+
+    items, summary = await user_items(shards[1], user_id)
+    assert [(name, quantity) for name, quantity, _ in items] == names
+    assert summary == (5, 10)
+    # Three batches of items; the user has no idempotency keys
+    assert insert_spy.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_move_takes_the_idempotency_keys_along(shards, directory):
+    user_id = await add_user(shards[0])
+    async with shards[0].begin() as conn:
+        await conn.execute(
+            insert(IdempotencyKey).values(
+                user_id=user_id,
+                key="retry-me",
+                fingerprint="f",
+                status_code=200,
+                response_body={"id": "a"},
+                response_headers={},
+                expires_at=text("now() + interval '1 hour'"),
+            )
+        )
+
+    await move_user(directory, user_id, 1, drain_seconds=0)
+
+    async with shards[1].connect() as conn:
+        stored = await conn.execute(
+            select(IdempotencyKey.key, IdempotencyKey.response_body).where(
+                IdempotencyKey.user_id == user_id
+            )
+        )
+        assert stored.all() == [("retry-me", {"id": "a"})]
+    async with shards[0].connect() as conn:
+        left = await conn.execute(
+            select(IdempotencyKey.key).where(IdempotencyKey.user_id == user_id)
+        )
+        assert left.all() == []
+
+
+def test_drain_outlasts_the_longest_request_deadline(mocker):
+    mocker.patch.object(rebalance_shards.settings, "REQUEST_DEADLINE_SECONDS", 30)
+    mocker.patch.object(
+        rebalance_shards.settings, "REQUEST_DEADLINES", {"import_items": 300}
+    )
+
+    assert default_drain_seconds() > 300
+
+
+@pytest.mark.asyncio
+async def test_move_to_the_same_shard_does_nothing(shards, directory):
+    user_id = await add_user(shards[0])
+
+    assert await move_user(directory, user_id, 0, drain_seconds=0) is False
+
+    user = await directory.get(User, user_id)
+    assert (user.shard, user.shard_epoch) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_failed_move_leaves_the_user_in_place(shards, directory, mocker):
+    user_id = await add_user(shards[0])
+    await add_items(shards[0], user_id, ("Saw", 1))
+    mocker.patch.object(
+        rebalance_shards, "copy_user_items", side_effect=RuntimeError("copy failed")
+    )
+
+    with pytest.raises(RuntimeError):
+        await move_user(directory, user_id, 1, drain_seconds=0)
+
+    user = await directory.get(User, user_id, populate_existing=True)
+    assert (user.shard, user.shard_epoch, user.shard_moving) == (0, 0, False)
+    assert (await user_items(shards[0], user_id))[0] == [("Saw", 1, 1)]
+
+
+@pytest.mark.asyncio
+async def test_rebalance_moves_users_to_their_home_shard(shards, directory):
+    # Everyone starts on shard 0, as if shard 1 had just been added
+    user_ids = [await add_user(shards[0]) for _ in range(6)]
+    for user_id in user_ids:
+        await add_items(shards[0], user_id, ("Saw", 1))
+
+    moved = await rebalance(directory, drain_seconds=0)
+
+    homes = {user_id: home_shard(user_id) for user_id in user_ids}
+    assert moved == sum(homes.values())
+    for user_id, home in homes.items():
+        assert (await user_items(shards[home], user_id))[0] == [("Saw", 1, 1)]
+    assert await rebalance(directory, drain_seconds=0) == 0
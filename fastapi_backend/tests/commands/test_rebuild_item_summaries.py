@@ -0,0 +1,70 @@
+import uuid
+
+import pytest
+from sqlalchemy import insert, select, update
+
+from app.models import Item, ItemSummary, User
+from commands.rebuild_item_summaries import rebuild_item_summaries
+
+
+@pytest.mark.asyncio
+async def test_rebuild_corrects_drifted_summaries(engine):
+    users = [uuid.uuid4(), uuid.uuid4(), uuid.uuid4()]
+    async with engine.begin() as conn:
+        await conn.execute(
+            insert(User),
+            [
+                {
+                    "id": user_id,
+                    "email": f"{user_id}@example.com",
+                    "hashed_password": "",
+                }
+                for user_id in users
+            ],
+        )
+        await conn.execute(
+            insert(Item),
+            [
+                {"name": "Bolt", "quantity": 4, "user_id": users[0]},
+                {"name": "Nut", "quantity": 6, "user_id": users[0]},
+                {"name": "Saw", "quantity": 1, "user_id": users[1]},
+            ],
+        )
+        # Simulate drift: a wrong total, a missing row and a stale count for a
+        # user whose items are all gone
+        await conn.execute(
+            update(ItemSummary)
+            .where(ItemSummary.user_id == users[0])
+            .values(total_quantity=3)
+        )
+        await conn.execute(
+            ItemSummary.__table__.delete().where(ItemSummary.user_id == users[1])
+        )
+        await conn.execute(
+            insert(ItemSummary).values(user_id=users[2], item_count=5, total_quantity=5)
+        )
+
+    async with engine.begin() as conn:
+        corrected = await rebuild_item_summaries(conn)
+        summaries = {
+            row.user_id: (row.item_count, row.total_quantity)
+            for row in await conn.execute(select(ItemSummary))
+        }
+
+    assert corrected == 3
+    assert summaries == {users[0]: (2, 10), users[1]: (1, 1), users[2]: (0, 0)}
+
+
+@pytest.mark.asyncio
+async def test_rebuild_leaves_consistent_summaries_alone(engine):
+    user_id = uuid.uuid4()
+    async with engine.begin() as conn:
+        await conn.execute(
+            insert(User).values(id=user_id, email="a@example.com", hashed_password="")
+        )
+        await conn.execute(
+            insert(Item).values(name="Bolt", quantity=1, user_id=user_id)
+        )
+
+    async with engine.begin() as conn:
+        assert await rebuild_item_summaries(conn) == 0
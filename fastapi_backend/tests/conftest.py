@@ -1,5 +1,6 @@
 from httpx import AsyncClient, ASGITransport
 import pytest_asyncio
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from fastapi_users.db import SQLAlchemyUserDatabase
 from fastapi_users.password import PasswordHelper
@@ -8,7 +9,7 @@ import uuid
 from app.config import settings
 from app.models import User, Base
 
-from app.database import get_user_db, get_async_session
+from app.database import get_async_session, get_directory_session, get_user_db
 from app.main import app
 from app.users import get_jwt_strategy
 
@@ -19,6 +20,8 @@ async def engine():
     engine = create_async_engine(settings.TEST_DATABASE_URL, echo=True)
 
     async with engine.begin() as conn:
+        # Needed by the trigram index on item names
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         await conn.run_sync(Base.metadata.create_all)
 
     yield engine
@@ -64,6 +67,7 @@ async def test_client(db_session):
     # Set up test database overrides
     app.dependency_overrides[get_user_db] = override_get_user_db
     app.dependency_overrides[get_async_session] = override_get_async_session
+    app.dependency_overrides[get_directory_session] = override_get_async_session
 
     async with AsyncClient(
         transport=ASGITransport(app=app), base_url="http://localhost:8000"
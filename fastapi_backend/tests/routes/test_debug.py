@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import status
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.profiler import PROFILED_STATUS_HEADER, worker_profile_lock
+
+
+def spin(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def busy_neighbour():
+    for _ in range(5):
+        spin(0.01)
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def profiler_directory(engine, mocker):
+    # The request profiler looks the user up outside the request's dependencies
+    mocker.patch("app.profiler.directory_session_maker", async_sessionmaker(engine))
+
+
+@pytest.fixture
+async def superuser(authenticated_user, db_session, profiler_directory):
+    authenticated_user["user"].is_superuser = True
+    await db_session.commit()
+    return authenticated_user
+
+
+class TestDebug:
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_profile_requires_a_superuser(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/debug/profile?seconds=0.1", headers=authenticated_user["headers"]
+        )
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_profile_as_speedscope(self, test_client, superuser):
+        response = await test_client.get(
+            "/debug/profile?seconds=0.1", headers=superuser["headers"]
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        profile = response.json()
+        assert profile["$schema"].startswith("https://www.speedscope.app/")
+        sampled = profile["profiles"][0]
+        assert sampled["type"] == "sampled"
+        assert len(sampled["samples"]) == len(sampled["weights"]) > 0
+        names = [frame["name"] for frame in profile["shared"]["frames"]]
+        # The worker was idle, waiting in the event loop
+        assert "event loop" in names
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_profile_as_collapsed_stacks(self, test_client, superuser):
+        response = await test_client.get(
+            "/debug/profile?seconds=0.1&format=collapsed", headers=superuser["headers"]
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/plain")
+        stack, _, count = response.text.splitlines()[0].rpartition(" ")
+        assert ";" in stack and int(count) > 0
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_one_profile_at_a_time(self, test_client, superuser):
+        async with worker_profile_lock:
+            response = await test_client.get(
+                "/debug/profile?seconds=0.1", headers=superuser["headers"]
+            )
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_profile_too_long(self, test_client, superuser):
+        response = await test_client.get(
+            "/debug/profile?seconds=3600", headers=superuser["headers"]
+        )
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_profile_a_single_request(self, test_client, superuser, mocker):
+        async def slow_list_items(db, user_id, params):
+            spin(0.05)
+            return []
+
+        mocker.patch("app.routes.items.list_items", slow_list_items)
+
+        response, _ = await asyncio.gather(
+            test_client.get(
+                "/items/", headers={**superuser["headers"], "X-Profile": "collapsed"}
+            ),
+            busy_neighbour(),
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers[PROFILED_STATUS_HEADER] == "200"
+        assert "slow_list_items" in response.text
+        # Only the request's own task is sampled
+        assert "busy_neighbour" not in response.text
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_profile_header_ignored_for_other_users(
+        self, test_client, authenticated_user, profiler_directory
+    ):
+        response = await test_client.get(
+            "/items/",
+            headers={**authenticated_user["headers"], "X-Profile": "speedscope"},
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == []
+        assert PROFILED_STATUS_HEADER not in response.headers
@@ -0,0 +1,100 @@
+import pytest
+from fastapi import status
+
+from app.lifespan import request_tracker
+
+
+@pytest.fixture
+def draining():
+    request_tracker.start_draining()
+    yield
+    request_tracker.draining = False
+
+
+class TestHealth:
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_liveness(self, test_client):
+        response = await test_client.get("/health/live")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"status": "alive"}
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_readiness_ok(self, test_client, mocker):
+        mocker.patch("app.routes.health.ping_database", mocker.AsyncMock())
+        mocker.patch("app.routes.health.get_pool_usage", return_value=0.5)
+
+        response = await test_client.get("/health/ready")
+
+        assert response.status_code == status.HTTP_200_OK
+        body = response.json()
+        assert body["status"] == "ready"
+        assert body["checks"]["database"] is True
+        assert body["checks"]["pool_usage"] == 0.5
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_readiness_database_unreachable(self, test_client, mocker):
+        mocker.patch(
+            "app.routes.health.ping_database",
+            mocker.AsyncMock(side_effect=OSError("connection refused")),
+        )
+
+        response = await test_client.get("/health/ready")
+
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.json()["checks"]["database"] is False
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_readiness_pool_saturated(self, test_client, mocker):
+        ping = mocker.patch("app.routes.health.ping_database", mocker.AsyncMock())
+        mocker.patch("app.routes.health.get_pool_usage", return_value=1.0)
+
+        response = await test_client.get("/health/ready")
+
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.json()["checks"]["pool_saturated"] is True
+        ping.assert_not_called()
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_readiness_while_draining(self, test_client, mocker, draining):
+        mocker.patch("app.routes.health.ping_database", mocker.AsyncMock())
+
+        ready = await test_client.get("/health/ready")
+        live = await test_client.get("/health/live")
+
+        assert ready.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert ready.json()["checks"]["draining"] is True
+        assert live.status_code == status.HTTP_200_OK
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_requests_rejected_while_draining(self, test_client, draining):
+        response = await test_client.get("/items/")
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.headers["connection"] == "close"
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_statement_cache_stats(self, test_client):
+        response = await test_client.get("/health/statement-cache")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert set(response.json()) == {"compiled", "prepared"}
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_insert_batching_stats(self, test_client):
+        response = await test_client.get("/health/insert-batching")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["batches"] == 0
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_deadline_stats(self, test_client):
+        response = await test_client.get("/health/deadlines")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert set(response.json()) == {"cancelled", "timed_out"}
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_cache_stats(self, test_client):
+        response = await test_client.get("/health/cache")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["local"]["entries"] == 0
@@ -1,7 +1,26 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
 import pytest
 from fastapi import status
-from sqlalchemy import select, insert
-from app.models import Item
+from sqlalchemy import delete, func, insert, literal_column, select, update
+from app.change_feed import ChangeEvent, ChangeFeed, get_change_feed
+from app.deadlines import DeadlineMiddleware
+from app.insert_coalescer import InsertCoalescer
+from app.lifespan import RequestTracker, drain
+from app.main import app
+from app.models import IdempotencyKey, Item, ItemSummary, ItemTombstone, User
+from app.negotiation import MSGPACK_MEDIA_TYPE, msgpack, packb, unpackb
+from app.routes.items import (
+    build_changes_query,
+    build_item_list_query,
+    build_pending_changes_query,
+    build_search_query,
+)
+from app.schemas import ItemListQuery
+from app.tombstones import delete_expired_tombstones
 
 
 class TestItems:
@@ -28,6 +47,35 @@ class TestItems:
         assert item.name == item_data["name"]
         assert item.description == item_data["description"]
 
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_create_items_with_insert_batching(
+        self, test_client, engine, db_session, authenticated_user, mocker
+    ):
+        mocker.patch("app.routes.items.settings.ITEM_INSERT_BATCHING", True)
+        mocker.patch("app.database.shard_engines", [engine])
+        coalescer = InsertCoalescer(0, max_size=3, max_delay=1)
+        mocker.patch("app.routes.items.insert_coalescers", [coalescer])
+
+        responses = await asyncio.gather(
+            *(
+                test_client.post(
+                    "/items/",
+                    json={"name": name},
+                    headers=authenticated_user["headers"],
+                )
+                for name in ("Drill", "Saw", "Bolt")
+            )
+        )
+
+        assert [response.json()["name"] for response in responses] == [
+            "Drill",
+            "Saw",
+            "Bolt",
+        ]
+        assert coalescer.stats.batches == 1
+        names = (await db_session.execute(select(Item.name))).scalars().all()
+        assert sorted(names) == ["Bolt", "Drill", "Saw"]
+
     @pytest.mark.asyncio(loop_scope="function")
     async def test_read_items(self, test_client, db_session, authenticated_user):
         """Test reading items."""
@@ -97,6 +145,24 @@ class TestItems:
         )
         assert delete_response.status_code == status.HTTP_404_NOT_FOUND
 
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_items_are_unavailable_while_moving_shards(
+        self, test_client, db_session, authenticated_user
+    ):
+        await db_session.execute(
+            update(User)
+            .where(User.id == authenticated_user["user"].id)
+            .values(shard_moving=True)
+        )
+        await db_session.commit()
+
+        response = await test_client.get(
+            "/items/", headers=authenticated_user["headers"]
+        )
+
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert "Retry-After" in response.headers
+
     @pytest.mark.asyncio(loop_scope="function")
     async def test_unauthorized_read_items(self, test_client):
         """Test reading items without authentication."""
@@ -117,3 +183,1437 @@ class TestItems:
             "/items/00000000-0000-0000-0000-000000000000"
         )
         assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestItemUpdate:
+    @pytest.fixture
+    async def item(self, db_session, authenticated_user):
+        result = await db_session.execute(
+            insert(Item)
+            .values(
+                name="Drill",
+                description="Cordless",
+                quantity=2,
+                user_id=authenticated_user["user"].id,
+            )
+            .returning(Item.id)
+        )
+        item_id = result.scalar_one()
+        await db_session.commit()
+        return item_id
+
+    async def patch(self, test_client, authenticated_user, item_id, body, **headers):
+        return await test_client.patch(
+            f"/items/{item_id}",
+            json=body,
+            headers={**authenticated_user["headers"], **headers},
+        )
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_only_provided_fields_change(
+        self, test_client, db_session, authenticated_user, item
+    ):
+        response = await self.patch(
+            test_client, authenticated_user, item, {"quantity": 5}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["etag"] == '"2"'
+        updated = response.json()
+        assert updated["name"] == "Drill"
+        assert updated["description"] == "Cordless"
+        assert updated["quantity"] == 5
+        assert updated["version"] == 2
+
+        db_item = await db_session.get(Item, item, populate_existing=True)
+        assert db_item.quantity == 5
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_fields_can_be_cleared(self, test_client, authenticated_user, item):
+        response = await self.patch(
+            test_client, authenticated_user, item, {"description": None}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["description"] is None
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_name_cannot_be_null(self, test_client, authenticated_user, item):
+        response = await self.patch(
+            test_client, authenticated_user, item, {"name": None}
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_matching_if_match_updates(
+        self, test_client, authenticated_user, item
+    ):
+        response = await self.patch(
+            test_client,
+            authenticated_user,
+            item,
+            {"name": "Drill"},
+            **{"If-Match": '"1"'},
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_weak_etag_matches(self, test_client, authenticated_user, item):
+        response = await self.patch(
+            test_client,
+            authenticated_user,
+            item,
+            {"name": "Drill"},
+            **{"If-Match": 'W/"1"'},
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_stale_if_match_is_rejected(
+        self, test_client, db_session, authenticated_user, item
+    ):
+        first = await self.patch(
+            test_client,
+            authenticated_user,
+            item,
+            {"quantity": 3},
+            **{"If-Match": '"1"'},
+        )
+        second = await self.patch(
+            test_client,
+            authenticated_user,
+            item,
+            {"quantity": 4},
+            **{"If-Match": '"1"'},
+        )
+
+        assert first.status_code == status.HTTP_200_OK
+        assert second.status_code == status.HTTP_412_PRECONDITION_FAILED
+        assert second.headers["etag"] == '"2"'
+        db_item = await db_session.get(Item, item, populate_existing=True)
+        assert db_item.quantity == 3
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_wildcard_if_match(self, test_client, authenticated_user, item):
+        response = await self.patch(
+            test_client, authenticated_user, item, {"quantity": 1}, **{"If-Match": "*"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_empty_body_returns_item_unchanged(
+        self, test_client, authenticated_user, item
+    ):
+        response = await self.patch(test_client, authenticated_user, item, {})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["version"] == 1
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_update_nonexistent_item(self, test_client, authenticated_user):
+        response = await self.patch(
+            test_client,
+            authenticated_user,
+            "00000000-0000-0000-0000-000000000000",
+            {"quantity": 1},
+            **{"If-Match": '"1"'},
+        )
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_cannot_update_other_users_item(
+        self, test_client, db_session, authenticated_user
+    ):
+        other_user = User(
+            id=uuid.uuid4(), email="other@example.com", hashed_password="x"
+        )
+        db_session.add(other_user)
+        await db_session.flush()
+        result = await db_session.execute(
+            insert(Item).values(name="Theirs", user_id=other_user.id).returning(Item.id)
+        )
+        item_id = result.scalar_one()
+
+        response = await self.patch(
+            test_client, authenticated_user, item_id, {"name": "Mine"}
+        )
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_compressed_responses_of_items_at_the_same_version(
+        self, test_client, db_session, authenticated_user
+    ):
+        # Both responses carry ETag "2" and are large enough to be compressed
+        result = await db_session.execute(
+            insert(Item).returning(Item.id),
+            [
+                {
+                    "name": name,
+                    "description": name * 2000,
+                    "user_id": authenticated_user["user"].id,
+                }
+                for name in ("A", "B")
+            ],
+        )
+        first, second = result.scalars().all()
+        await db_session.commit()
+
+        for item_id in (first, second):
+            response = await self.patch(
+                test_client,
+                authenticated_user,
+                item_id,
+                {"quantity": 1},
+                **{"Accept-Encoding": "gzip"},
+            )
+            assert response.headers["content-encoding"] == "gzip"
+            assert response.headers["etag"] == 'W/"2"'
+            assert response.json()["id"] == str(item_id)
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_unauthorized_update_item(self, test_client):
+        response = await test_client.patch(
+            "/items/00000000-0000-0000-0000-000000000000", json={"name": "x"}
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestItemListQuery:
+    @pytest.fixture
+    async def list_items(self, db_session, authenticated_user):
+        user_id = authenticated_user["user"].id
+        for name, description, quantity in [
+            ("Bolt", "Steel", 50),
+            ("bracket", None, 5),
+            ("Anchor", "", 12),
+            ("Br_ace", "Wooden", None),
+        ]:
+            await db_session.execute(
+                insert(Item).values(
+                    name=name,
+                    description=description,
+                    quantity=quantity,
+                    user_id=user_id,
+                )
+            )
+        await db_session.commit()
+
+    async def list(self, test_client, authenticated_user, **params):
+        response = await test_client.get(
+            "/items/", params=params, headers=authenticated_user["headers"]
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return response.json()
+
+    async def names(self, test_client, authenticated_user, **params):
+        items = await self.list(test_client, authenticated_user, **params)
+        return [item["name"] for item in items]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_sorted_by_name_by_default(
+        self, test_client, authenticated_user, list_items
+    ):
+        names = await self.names(test_client, authenticated_user)
+        assert names == sorted(names)
+        assert len(names) == 4
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_sort_by_quantity_descending(
+        self, test_client, authenticated_user, list_items
+    ):
+        names = await self.names(test_client, authenticated_user, sort="-quantity")
+        # Postgres puts NULLs first in descending order
+        assert names == ["Br_ace", "Bolt", "Anchor", "bracket"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_sort_by_creation(self, test_client, authenticated_user, list_items):
+        # Created in one transaction, so only their time-ordered ids tell
+        # them apart
+        created = ["Bolt", "bracket", "Anchor", "Br_ace"]
+        names = await self.names(test_client, authenticated_user, sort="created")
+        assert names == created
+        names = await self.names(test_client, authenticated_user, sort="-created")
+        assert names == created[::-1]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    @pytest.mark.parametrize("sort", ["created", "-created"])
+    async def test_pages_in_creation_order(
+        self, test_client, authenticated_user, list_items, sort
+    ):
+        pages = []
+        params = {"sort": sort, "limit": 3, "fields": "name,created_at"}
+        while True:
+            page = await self.list(test_client, authenticated_user, **params)
+            if not page:
+                break
+            pages.append([item["name"] for item in page])
+            last = page[-1]
+            params["after"] = f"{last['created_at']},{last['id']}"
+
+        created = ["Bolt", "bracket", "Anchor", "Br_ace"]
+        if sort == "-created":
+            created.reverse()
+        assert pages == [created[:3], created[3:]]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_after_needs_a_created_sort(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/items/",
+            params={"after": f"2026-01-01T00:00:00Z,{uuid.uuid4()}"},
+            headers=authenticated_user["headers"],
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_quantity_range(self, test_client, authenticated_user, list_items):
+        names = await self.names(
+            test_client,
+            authenticated_user,
+            min_quantity=5,
+            max_quantity=12,
+            sort="quantity",
+        )
+        assert names == ["bracket", "Anchor"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_name_prefix_is_case_insensitive(
+        self, test_client, authenticated_user, list_items
+    ):
+        names = await self.names(test_client, authenticated_user, name_prefix="BR")
+        assert sorted(names) == ["Br_ace", "bracket"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_name_prefix_escapes_wildcards(
+        self, test_client, authenticated_user, list_items
+    ):
+        names = await self.names(test_client, authenticated_user, name_prefix="br_")
+        assert names == ["Br_ace"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_has_description(self, test_client, authenticated_user, list_items):
+        with_description = await self.names(
+            test_client, authenticated_user, has_description="true"
+        )
+        without_description = await self.names(
+            test_client, authenticated_user, has_description="false"
+        )
+        assert sorted(with_description) == ["Bolt", "Br_ace"]
+        assert sorted(without_description) == ["Anchor", "bracket"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_sparse_fields(self, test_client, authenticated_user, list_items):
+        items = await self.list(
+            test_client, authenticated_user, fields="name,quantity", sort="quantity"
+        )
+        assert items[0] == {"id": items[0]["id"], "name": "bracket", "quantity": 5}
+        assert all(set(item) == {"id", "name", "quantity"} for item in items)
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_sparse_fields_as_repeated_parameters(
+        self, test_client, authenticated_user, list_items
+    ):
+        response = await test_client.get(
+            "/items/?fields=name&fields=user_id", headers=authenticated_user["headers"]
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert set(response.json()[0]) == {"id", "name", "user_id"}
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_unknown_field_is_rejected(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/items/",
+            params={"fields": "name,secret"},
+            headers=authenticated_user["headers"],
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_unknown_sort_is_rejected(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/items/", params={"sort": "user_id"}, headers=authenticated_user["headers"]
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestItemSummary:
+    async def summary(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/items/summary", headers=authenticated_user["headers"]
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return response.json()
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_summary_without_items(self, test_client, authenticated_user):
+        summary = await self.summary(test_client, authenticated_user)
+        assert summary == {"item_count": 0, "total_quantity": 0}
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_summary_follows_item_changes(
+        self, test_client, db_session, authenticated_user
+    ):
+        user_id = authenticated_user["user"].id
+        await db_session.execute(
+            insert(Item),
+            [
+                {"name": "Bolt", "quantity": 10, "user_id": user_id},
+                {"name": "Nut", "quantity": 5, "user_id": user_id},
+                {"name": "Washer", "user_id": user_id},
+            ],
+        )
+        await db_session.execute(
+            update(Item).where(Item.name == "Nut").values(quantity=7)
+        )
+        await db_session.execute(delete(Item).where(Item.name == "Bolt"))
+        await db_session.commit()
+
+        summary = await self.summary(test_client, authenticated_user)
+        assert summary == {"item_count": 2, "total_quantity": 7}
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_summary_follows_api_writes(self, test_client, authenticated_user):
+        headers = authenticated_user["headers"]
+        created = await test_client.post(
+            "/items/", json={"name": "Drill", "quantity": 3}, headers=headers
+        )
+        await test_client.post(
+            "/items/", json={"name": "Saw", "quantity": 4}, headers=headers
+        )
+        await test_client.delete(f"/items/{created.json()['id']}", headers=headers)
+
+        summary = await self.summary(test_client, authenticated_user)
+        assert summary == {"item_count": 1, "total_quantity": 4}
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_rename_does_not_touch_summary(self, db_session, authenticated_user):
+        user_id = authenticated_user["user"].id
+        await db_session.execute(
+            insert(Item).values(name="Bolt", quantity=2, user_id=user_id)
+        )
+        # Corrupt the summary so a rewrite by the update trigger would show up
+        await db_session.execute(
+            update(ItemSummary)
+            .where(ItemSummary.user_id == user_id)
+            .values(item_count=99)
+        )
+        await db_session.execute(update(Item).values(name="Hex bolt"))
+
+        summary = await db_session.get(ItemSummary, user_id, populate_existing=True)
+        assert summary.item_count == 99
+
+
+class TestItemSearch:
+    @pytest.fixture
+    async def search_items(self, db_session, authenticated_user):
+        user_id = authenticated_user["user"].id
+        for name, description in [
+            ("Screwdriver set", None),
+            ("Hammer", "Pairs well with a screwdriver"),
+            ("Paint brush", "Wide bristles"),
+        ]:
+            await db_session.execute(
+                insert(Item).values(name=name, description=description, user_id=user_id)
+            )
+        # The test client closes the session after each request, so commit to
+        # keep the rows around for tests that search more than once
+        await db_session.commit()
+
+    async def search(self, test_client, authenticated_user, **params):
+        response = await test_client.get(
+            "/items/search", params=params, headers=authenticated_user["headers"]
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return [item["name"] for item in response.json()]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_prefix_search_ranks_name_above_description(
+        self, test_client, authenticated_user, search_items
+    ):
+        names = await self.search(test_client, authenticated_user, q="screw")
+        assert names == ["Screwdriver set", "Hammer"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_search_matches_description_words(
+        self, test_client, authenticated_user, search_items
+    ):
+        names = await self.search(test_client, authenticated_user, q="bristle")
+        assert names == ["Paint brush"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_search_tolerates_typos(
+        self, test_client, authenticated_user, search_items
+    ):
+        names = await self.search(test_client, authenticated_user, q="scrwdriver")
+        assert names == ["Screwdriver set"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_search_requires_all_terms(
+        self, test_client, authenticated_user, search_items
+    ):
+        names = await self.search(test_client, authenticated_user, q="paint wide")
+        assert names == ["Paint brush"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_search_is_paginated(
+        self, test_client, authenticated_user, search_items
+    ):
+        first = await self.search(test_client, authenticated_user, q="screw", limit=1)
+        second = await self.search(
+            test_client, authenticated_user, q="screw", limit=1, offset=1
+        )
+        assert first == ["Screwdriver set"]
+        assert second == ["Hammer"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_search_is_scoped_to_user(
+        self, test_client, db_session, authenticated_user, search_items
+    ):
+        other_user = User(
+            id=uuid.uuid4(), email="other@example.com", hashed_password="x"
+        )
+        db_session.add(other_user)
+        await db_session.flush()
+        await db_session.execute(
+            insert(Item).values(name="Screw anchors", user_id=other_user.id)
+        )
+
+        names = await self.search(test_client, authenticated_user, q="screw")
+        assert "Screw anchors" not in names
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_search_without_words_returns_nothing(
+        self, test_client, authenticated_user, search_items
+    ):
+        assert await self.search(test_client, authenticated_user, q="!!") == []
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_search_requires_query(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/items/search", headers=authenticated_user["headers"]
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestItemChanges:
+    async def sync(self, test_client, authenticated_user, **params):
+        response = await test_client.get(
+            "/items/changes", params=params, headers=authenticated_user["headers"]
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return response.json()
+
+    async def add_items(self, db_session, user_id, *names):
+        result = await db_session.execute(
+            insert(Item).returning(Item.id),
+            [{"name": name, "user_id": user_id} for name in names],
+        )
+        ids = list(result.scalars())
+        await db_session.commit()
+        return ids
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_initial_sync_then_no_changes(
+        self, test_client, db_session, authenticated_user
+    ):
+        await self.add_items(db_session, authenticated_user["user"].id, "Drill", "Saw")
+
+        first = await self.sync(test_client, authenticated_user)
+        second = await self.sync(test_client, authenticated_user, since=first["cursor"])
+
+        assert sorted(c["item"]["name"] for c in first["changes"]) == ["Drill", "Saw"]
+        assert {c["op"] for c in first["changes"]} == {"upsert"}
+        assert first["has_more"] is False
+        assert second == {
+            "changes": [],
+            "cursor": first["cursor"],
+            "has_more": False,
+            "pending": False,
+        }
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_updates_and_deletes_after_cursor(
+        self, test_client, db_session, authenticated_user
+    ):
+        drill, saw = await self.add_items(
+            db_session, authenticated_user["user"].id, "Drill", "Saw"
+        )
+        cursor = (await self.sync(test_client, authenticated_user))["cursor"]
+
+        # Separate transactions, so the two changes have a defined order
+        await db_session.execute(
+            update(Item).where(Item.id == drill).values(quantity=3)
+        )
+        await db_session.commit()
+        await db_session.execute(delete(Item).where(Item.id == saw))
+        await db_session.commit()
+
+        changes = (await self.sync(test_client, authenticated_user, since=cursor))[
+            "changes"
+        ]
+
+        assert [(c["op"], c["id"]) for c in changes] == [
+            ("upsert", str(drill)),
+            ("delete", str(saw)),
+        ]
+        updated = changes[0]["item"]
+        assert updated["quantity"] == 3
+        assert updated["updated_at"] > updated["created_at"]
+        assert changes[1]["item"] is None
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_changes_are_paginated(
+        self, test_client, db_session, authenticated_user
+    ):
+        ids = await self.add_items(
+            db_session, authenticated_user["user"].id, "A", "B", "C"
+        )
+
+        first = await self.sync(test_client, authenticated_user, limit=2)
+        second = await self.sync(
+            test_client, authenticated_user, limit=2, since=first["cursor"]
+        )
+
+        assert first["has_more"] is True
+        assert second["has_more"] is False
+        synced = [c["id"] for c in first["changes"] + second["changes"]]
+        assert sorted(synced) == sorted(str(i) for i in ids)
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_changes_behind_an_open_transaction_are_held_back(
+        self, test_client, engine, db_session, authenticated_user
+    ):
+        user_id = authenticated_user["user"].id
+        cursor = (await self.sync(test_client, authenticated_user))["cursor"]
+
+        async with engine.connect() as slow:
+            # Another user's transaction, so it doesn't hold the summary row
+            # lock that the insert below needs; the horizon is global anyway
+            other_user_id = uuid.uuid4()
+            await asyncio.wait_for(
+                slow.execute(
+                    insert(User).values(
+                        id=other_user_id, email="slow@example.com", hashed_password="x"
+                    )
+                ),
+                10,
+            )
+            await asyncio.wait_for(
+                slow.execute(insert(Item).values(name="Slow", user_id=other_user_id)),
+                10,
+            )
+            await asyncio.wait_for(self.add_items(db_session, user_id, "Fast"), 10)
+
+            response = await test_client.get(
+                "/items/changes",
+                params={"since": cursor},
+                headers=authenticated_user["headers"],
+            )
+            held = response.json()
+            assert held["changes"] == []
+            assert held["pending"] is True
+            assert held["cursor"] == cursor
+            assert response.headers["retry-after"] == "1"
+            await asyncio.wait_for(slow.commit(), 10)
+
+        synced = await self.sync(test_client, authenticated_user, since=cursor)
+        assert [c["item"]["name"] for c in synced["changes"]] == ["Fast"]
+        assert synced["pending"] is False
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_sync_is_scoped_to_user(
+        self, test_client, db_session, authenticated_user
+    ):
+        other_user = User(
+            id=uuid.uuid4(), email="other@example.com", hashed_password="x"
+        )
+        db_session.add(other_user)
+        await db_session.flush()
+        await self.add_items(db_session, other_user.id, "Theirs")
+
+        assert (await self.sync(test_client, authenticated_user))["changes"] == []
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_invalid_cursor(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/items/changes",
+            params={"since": "not-a-cursor"},
+            headers=authenticated_user["headers"],
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.asyncio(loop_scope="function")
+    @pytest.mark.parametrize("xid", [-1, 2**64])
+    async def test_cursor_xid_out_of_range(self, test_client, authenticated_user, xid):
+        response = await test_client.get(
+            "/items/changes",
+            params={"since": f"{xid}:{uuid.UUID(int=0)}"},
+            headers=authenticated_user["headers"],
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_cursor_from_before_a_move_has_expired(
+        self, test_client, db_session, authenticated_user
+    ):
+        user = authenticated_user["user"]
+        await self.add_items(db_session, user.id, "Saw")
+        cursor = (await self.sync(test_client, authenticated_user))["cursor"]
+
+        await db_session.execute(
+            update(User).where(User.id == user.id).values(shard_epoch=1)
+        )
+        await db_session.commit()
+
+        response = await test_client.get(
+            "/items/changes",
+            params={"since": cursor},
+            headers=authenticated_user["headers"],
+        )
+        assert response.status_code == status.HTTP_410_GONE
+        # Starting over works, and the new cursors carry the epoch
+        resynced = await self.sync(test_client, authenticated_user)
+        assert [change["item"]["name"] for change in resynced["changes"]] == ["Saw"]
+        assert resynced["cursor"].startswith("1/")
+        again = await self.sync(
+            test_client, authenticated_user, since=resynced["cursor"]
+        )
+        assert again["changes"] == []
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_cursor_older_than_the_tombstone_retention_has_expired(
+        self, test_client, db_session, authenticated_user
+    ):
+        saw, _ = await self.add_items(
+            db_session, authenticated_user["user"].id, "Saw", "Drill"
+        )
+        stale = (await self.sync(test_client, authenticated_user))["cursor"]
+        await db_session.execute(delete(Item).where(Item.id == saw))
+        await db_session.commit()
+        current = (await self.sync(test_client, authenticated_user, since=stale))[
+            "cursor"
+        ]
+
+        await db_session.execute(
+            update(ItemTombstone).values(deleted_at=func.now() - timedelta(days=2))
+        )
+        await db_session.commit()
+        assert await delete_expired_tombstones(db_session, 24 * 3600) == 1
+
+        response = await test_client.get(
+            "/items/changes",
+            params={"since": stale},
+            headers=authenticated_user["headers"],
+        )
+        assert response.status_code == status.HTTP_410_GONE
+        # A client that already saw the deletion carries on
+        assert (await self.sync(test_client, authenticated_user, since=current))[
+            "changes"
+        ] == []
+
+
+class TestItemBatch:
+    async def batch(self, test_client, authenticated_user, operations, **options):
+        response = await test_client.post(
+            "/items/batch",
+            json={"operations": operations, **options},
+            headers=authenticated_user["headers"],
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return response.json()
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_operations_run_in_order(
+        self, test_client, db_session, authenticated_user
+    ):
+        result = await self.batch(
+            test_client,
+            authenticated_user,
+            [
+                {"op": "create", "item": {"name": "Drill", "quantity": 1}},
+                {"op": "create", "item": {"name": "Saw", "quantity": 2}},
+                {"op": "list", "query": {"fields": "name"}},
+            ],
+        )
+
+        assert result["committed"] is True
+        created, _, listed = result["results"]
+        assert created["status"] == 200
+        assert created["body"]["name"] == "Drill"
+        assert [item["name"] for item in listed["body"]] == ["Drill", "Saw"]
+
+        update, delete = (
+            await self.batch(
+                test_client,
+                authenticated_user,
+                [
+                    {
+                        "op": "update",
+                        "id": created["body"]["id"],
+                        "item": {"quantity": 5},
+                        "if_match": '"1"',
+                    },
+                    {"op": "delete", "id": listed["body"][1]["id"]},
+                ],
+            )
+        )["results"]
+        assert update["status"] == 200
+        updated_at = update["body"].pop("updated_at")
+        assert updated_at > created["body"].pop("updated_at")
+        assert update["body"] == {**created["body"], "quantity": 5, "version": 2}
+        assert delete["status"] == 200
+
+        names = (await db_session.execute(select(Item.name))).scalars().all()
+        assert names == ["Drill"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_atomic_batch_rolls_back_on_failure(
+        self, test_client, db_session, authenticated_user
+    ):
+        result = await self.batch(
+            test_client,
+            authenticated_user,
+            [
+                {"op": "create", "item": {"name": "Drill"}},
+                {"op": "delete", "id": "00000000-0000-0000-0000-000000000000"},
+                {"op": "create", "item": {"name": "Saw"}},
+            ],
+        )
+
+        assert result["committed"] is False
+        assert [r["status"] for r in result["results"]] == [424, 404, 424]
+        assert (await db_session.execute(select(Item))).first() is None
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_non_atomic_batch_reports_partial_failure(
+        self, test_client, db_session, authenticated_user
+    ):
+        result = await self.batch(
+            test_client,
+            authenticated_user,
+            [
+                {"op": "create", "item": {"name": "Drill"}},
+                {"op": "delete", "id": "00000000-0000-0000-0000-000000000000"},
+                # Overflows the integer column, aborting just this savepoint
+                {"op": "create", "item": {"name": "Crate", "quantity": 2**40}},
+                {"op": "create", "item": {"name": "Saw"}},
+            ],
+            atomic=False,
+        )
+
+        assert result["committed"] is True
+        assert [r["status"] for r in result["results"]] == [200, 404, 400, 200]
+        names = (await db_session.execute(select(Item.name))).scalars().all()
+        assert sorted(names) == ["Drill", "Saw"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_batch_is_scoped_to_user(
+        self, test_client, db_session, authenticated_user
+    ):
+        other_user = User(
+            id=uuid.uuid4(), email="other@example.com", hashed_password="x"
+        )
+        db_session.add(other_user)
+        await db_session.flush()
+        result = await db_session.execute(
+            insert(Item).values(name="Theirs", user_id=other_user.id).returning(Item.id)
+        )
+        item_id = str(result.scalar_one())
+        await db_session.commit()
+
+        result = await self.batch(
+            test_client,
+            authenticated_user,
+            [{"op": "delete", "id": item_id}, {"op": "list"}],
+            atomic=False,
+        )
+        assert result["results"][0]["status"] == 404
+        assert result["results"][1]["body"] == []
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_batch_size_is_limited(self, test_client, authenticated_user):
+        response = await test_client.post(
+            "/items/batch",
+            json={"operations": [{"op": "list"}] * 101},
+            headers=authenticated_user["headers"],
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_unknown_operation_is_rejected(self, test_client, authenticated_user):
+        response = await test_client.post(
+            "/items/batch",
+            json={"operations": [{"op": "truncate"}]},
+            headers=authenticated_user["headers"],
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestIdempotencyKeys:
+    def headers(self, authenticated_user, key="retry-me"):
+        return {**authenticated_user["headers"], "Idempotency-Key": key}
+
+    async def item_names(self, db_session):
+        return (await db_session.execute(select(Item.name))).scalars().all()
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_retried_create_is_replayed(
+        self, test_client, db_session, authenticated_user
+    ):
+        headers = self.headers(authenticated_user)
+        first = await test_client.post(
+            "/items/", json={"name": "Drill"}, headers=headers
+        )
+        retry = await test_client.post(
+            "/items/", json={"name": "Drill"}, headers=headers
+        )
+
+        assert first.status_code == retry.status_code == status.HTTP_200_OK
+        assert retry.json() == first.json()
+        assert "idempotent-replayed" not in first.headers
+        assert retry.headers["idempotent-replayed"] == "true"
+        assert await self.item_names(db_session) == ["Drill"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_key_deleted_after_a_conflict_is_claimed_again(
+        self, test_client, db_session, authenticated_user, mocker
+    ):
+        headers = self.headers(authenticated_user)
+        await test_client.post("/items/", json={"name": "Drill"}, headers=headers)
+        get = db_session.get
+
+        async def get_after_cleanup(model, key, **kwargs):
+            # Stands in for the key being deleted between the claim and the
+            # read, e.g. once it expired
+            await db_session.execute(delete(IdempotencyKey))
+            mocker.patch.object(db_session, "get", get)
+            return await get(model, key, **kwargs)
+
+        mocker.patch.object(db_session, "get", get_after_cleanup)
+        retry = await test_client.post(
+            "/items/", json={"name": "Drill"}, headers=headers
+        )
+
+        assert retry.status_code == status.HTTP_200_OK
+        assert "idempotent-replayed" not in retry.headers
+        assert await self.item_names(db_session) == ["Drill", "Drill"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_key_that_keeps_disappearing_is_a_conflict(
+        self, test_client, db_session, authenticated_user, mocker
+    ):
+        headers = self.headers(authenticated_user)
+        await test_client.post("/items/", json={"name": "Drill"}, headers=headers)
+        mocker.patch.object(db_session, "get", mocker.AsyncMock(return_value=None))
+
+        retry = await test_client.post(
+            "/items/", json={"name": "Drill"}, headers=headers
+        )
+
+        assert retry.status_code == status.HTTP_409_CONFLICT
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_requests_without_a_key_are_not_deduplicated(
+        self, test_client, db_session, authenticated_user
+    ):
+        for _ in range(2):
+            await test_client.post(
+                "/items/", json={"name": "Drill"}, headers=authenticated_user["headers"]
+            )
+
+        assert await self.item_names(db_session) == ["Drill", "Drill"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_retried_update_replays_the_etag(
+        self, test_client, db_session, authenticated_user
+    ):
+        created = await test_client.post(
+            "/items/", json={"name": "Drill"}, headers=authenticated_user["headers"]
+        )
+        item_id = created.json()["id"]
+        headers = {**self.headers(authenticated_user), "If-Match": '"1"'}
+
+        first = await test_client.patch(
+            f"/items/{item_id}", json={"quantity": 3}, headers=headers
+        )
+        retry = await test_client.patch(
+            f"/items/{item_id}", json={"quantity": 3}, headers=headers
+        )
+
+        # Running the update again would have failed its If-Match
+        assert retry.status_code == status.HTTP_200_OK
+        assert retry.json() == first.json()
+        assert retry.headers["etag"] == first.headers["etag"] == '"2"'
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_key_reused_for_another_request_is_rejected(
+        self, test_client, db_session, authenticated_user
+    ):
+        headers = self.headers(authenticated_user)
+        await test_client.post("/items/", json={"name": "Drill"}, headers=headers)
+        response = await test_client.post(
+            "/items/", json={"name": "Saw"}, headers=headers
+        )
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert await self.item_names(db_session) == ["Drill"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_failed_requests_release_their_key(
+        self, test_client, db_session, authenticated_user
+    ):
+        headers = self.headers(authenticated_user)
+        missing = f"/items/{uuid.uuid4()}"
+
+        assert (await test_client.delete(missing, headers=headers)).status_code == 404
+        keys = await db_session.execute(select(IdempotencyKey))
+        assert keys.all() == []
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_expired_keys_can_be_reused(
+        self, test_client, db_session, authenticated_user
+    ):
+        headers = self.headers(authenticated_user)
+        await test_client.post("/items/", json={"name": "Drill"}, headers=headers)
+        await db_session.execute(
+            update(IdempotencyKey).values(expires_at=func.now() - timedelta(seconds=1))
+        )
+        await db_session.commit()
+
+        retry = await test_client.post(
+            "/items/", json={"name": "Drill"}, headers=headers
+        )
+
+        assert "idempotent-replayed" not in retry.headers
+        assert await self.item_names(db_session) == ["Drill", "Drill"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_retried_batch_is_replayed(
+        self, test_client, db_session, authenticated_user
+    ):
+        batch = {"operations": [{"op": "create", "item": {"name": "Drill"}}]}
+        headers = self.headers(authenticated_user)
+        first = await test_client.post("/items/batch", json=batch, headers=headers)
+        retry = await test_client.post("/items/batch", json=batch, headers=headers)
+
+        assert retry.json() == first.json()
+        assert await self.item_names(db_session) == ["Drill"]
+
+
+class TestItemImport:
+    async def upload(self, test_client, authenticated_user, content, media_type):
+        return await test_client.post(
+            "/items/import",
+            content=content,
+            headers={**authenticated_user["headers"], "Content-Type": media_type},
+        )
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_import_csv(self, test_client, db_session, authenticated_user):
+        content = (
+            "name,description,quantity\n"
+            "Drill,Cordless,2\n"
+            "Saw,,x\n"
+            ",Nameless,1\n"
+            "Bolt,,5\n"
+        )
+        response = await self.upload(
+            test_client, authenticated_user, content, "text/csv; charset=utf-8"
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {
+            "imported": 2,
+            "rejected": 2,
+            "errors": [
+                {
+                    "line": 3,
+                    "detail": "quantity: Input should be a valid integer, "
+                    "unable to parse string as an integer",
+                },
+                {"line": 4, "detail": "name: Field required"},
+            ],
+        }
+        result = await db_session.execute(
+            select(Item.name, Item.description, Item.quantity, Item.user_id).order_by(
+                Item.id
+            )
+        )
+        user_id = authenticated_user["user"].id
+        assert result.all() == [
+            ("Drill", "Cordless", 2, user_id),
+            ("Bolt", None, 5, user_id),
+        ]
+        summary = await db_session.get(ItemSummary, user_id)
+        assert (summary.item_count, summary.total_quantity) == (2, 7)
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_import_ndjson_in_chunks(
+        self, test_client, db_session, authenticated_user, mocker
+    ):
+        mocker.patch("app.item_import.IMPORT_CHUNK_SIZE", 3)
+        mocker.patch("app.item_import.MAX_REPORTED_ERRORS", 1)
+
+        async def lines():
+            for i in range(10):
+                yield f'{{"name": "Item {i}", "quantity": {i}}}\n'.encode()
+            yield b'{"name": "Huge", "quantity": 9999999999}\n'
+            yield b'{"name": "Nul\\u0000"}\n'
+
+        response = await self.upload(
+            test_client, authenticated_user, lines(), "application/x-ndjson"
+        )
+
+        assert response.json() == {
+            "imported": 10,
+            "rejected": 2,
+            "errors": [{"line": 11, "detail": "quantity: Value is out of range"}],
+        }
+        count = await db_session.execute(select(func.count()).select_from(Item))
+        assert count.scalar() == 10
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_unsupported_media_type(self, test_client, authenticated_user):
+        response = await self.upload(
+            test_client, authenticated_user, "{}", "application/json"
+        )
+
+        assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_failed_import_leaves_no_items(
+        self, test_client, db_session, authenticated_user, mocker
+    ):
+        mocker.patch("app.item_import.IMPORT_CHUNK_SIZE", 1)
+        mocker.patch("app.item_import.MAX_LINE_LENGTH", 20)
+
+        async def content():
+            yield b"name\nDrill\nSaw\n"
+            # Refused once the first rows have been copied
+            yield b"x" * 30
+
+        response = await self.upload(
+            test_client, authenticated_user, content(), "text/csv"
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        count = await db_session.execute(select(func.count()).select_from(Item))
+        assert count.scalar() == 0
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_import_outlasts_the_default_deadline(
+        self, test_client, db_session, authenticated_user, mocker
+    ):
+        deadlines = next(
+            middleware
+            for middleware in app.user_middleware
+            if middleware.cls is DeadlineMiddleware
+        )
+        mocker.patch.dict(deadlines.kwargs, default_timeout=0.1)
+        mocker.patch.object(app, "middleware_stack", None)
+        mocker.patch("app.item_import.IMPORT_CHUNK_SIZE", 1)
+
+        async def lines():
+            for i in range(3):
+                yield f'{{"name": "Item {i}"}}\n'.encode()
+                await asyncio.sleep(0.1)
+
+        response = await self.upload(
+            test_client, authenticated_user, lines(), "application/x-ndjson"
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["imported"] == 3
+
+
+class TestItemEvents:
+    @pytest.fixture
+    def feed(self, mocker):
+        feed = ChangeFeed("unused", buffer_size=10, replay_size=10)
+        mocker.patch.object(feed, "start")
+        app.dependency_overrides[get_change_feed] = lambda: feed
+        yield feed
+        del app.dependency_overrides[get_change_feed]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_streams_the_users_events(
+        self, test_client, authenticated_user, feed
+    ):
+        user_id = authenticated_user["user"].id
+        feed.publish(ChangeEvent(1, user_id, "insert", {"id": "a", "version": 1}))
+        feed.publish(ChangeEvent(2, uuid.uuid4(), "insert", {"id": "b", "version": 1}))
+        feed.publish(ChangeEvent(3, user_id, "delete", {"id": "a", "version": 1}))
+
+        async def publish_then_close():
+            await asyncio.sleep(0.1)
+            feed.publish(ChangeEvent(4, user_id, "update", {"id": "c", "version": 2}))
+            await feed.close()
+
+        closer = asyncio.create_task(publish_then_close())
+        response = await test_client.get(
+            "/items/events",
+            headers={**authenticated_user["headers"], "Last-Event-ID": "1"},
+        )
+        await closer
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.text == (
+            'id: 3\nevent: delete\ndata: {"id": "a", "version": 1}\n\n'
+            'id: 4\nevent: update\ndata: {"id": "c", "version": 2}\n\n'
+        )
+        assert not feed._subscriptions
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_sends_heartbeats(
+        self, test_client, authenticated_user, feed, mocker
+    ):
+        mocker.patch("app.routes.items.settings.CHANGE_FEED_HEARTBEAT_SECONDS", 0.01)
+
+        async def close_later():
+            await asyncio.sleep(0.1)
+            await feed.close()
+
+        closer = asyncio.create_task(close_later())
+        response = await test_client.get(
+            "/items/events", headers=authenticated_user["headers"]
+        )
+        await closer
+
+        assert response.text.startswith(": heartbeat\n\n")
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_stream_ends_when_the_worker_drains(
+        self, test_client, authenticated_user, feed, mocker
+    ):
+        mocker.patch("app.lifespan.change_feeds", [feed])
+
+        async def drain_later():
+            await asyncio.sleep(0.1)
+            # A tracker of its own, so the app keeps serving the stream
+            assert await drain(RequestTracker(), timeout=5) is True
+
+        drainer = asyncio.create_task(drain_later())
+        response = await asyncio.wait_for(
+            test_client.get("/items/events", headers=authenticated_user["headers"]),
+            timeout=5,
+        )
+        await drainer
+
+        assert response.status_code == status.HTTP_200_OK
+        assert not feed._subscriptions
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_unavailable_feed(
+        self, test_client, authenticated_user, feed, mocker
+    ):
+        feed.start.side_effect = asyncio.TimeoutError
+        response = await test_client.get(
+            "/items/events", headers=authenticated_user["headers"]
+        )
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+def plan_relations(plan):
+    relations = [plan["Relation Name"]] if "Relation Name" in plan else []
+    for child in plan.get("Plans", []):
+        relations.extend(plan_relations(child))
+    return relations
+
+
+class TestItemPartitions:
+    async def scanned_partitions(self, db_session, statement, plan_cache_mode):
+        # Run EXPLAIN on the statement as asyncpg prepares it, with its
+        # parameters bound, so generic plans can only prune at executor startup
+        conn = await db_session.connection()
+        compiled = statement.compile(dialect=conn.dialect)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        await conn.exec_driver_sql(f"SET LOCAL plan_cache_mode = {plan_cache_mode}")
+        result = await conn.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compiled.string}", params
+        )
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        relations = plan_relations(plan[0]["Plan"])
+        return [name for name in relations if name.startswith("items_p")]
+
+    @pytest.mark.parametrize(
+        "plan_cache_mode", ["force_custom_plan", "force_generic_plan"]
+    )
+    @pytest.mark.parametrize(
+        "build",
+        [
+            lambda user_id: build_item_list_query(user_id, ItemListQuery()),
+            lambda user_id: build_item_list_query(
+                user_id, ItemListQuery(name_prefix="wid", sort="-quantity")
+            ),
+            lambda user_id: build_item_list_query(
+                user_id,
+                ItemListQuery(
+                    sort="created",
+                    after=(datetime.now(timezone.utc), uuid.uuid4()),
+                    limit=50,
+                ),
+            ),
+            lambda user_id: build_search_query(user_id, "widget"),
+            lambda user_id: build_changes_query(user_id, 0, uuid.uuid4(), 100),
+            build_pending_changes_query,
+            lambda user_id: select(Item.version).filter(
+                Item.id == uuid.uuid4(), Item.user_id == user_id
+            ),
+            lambda user_id: update(Item)
+            .where(Item.id == uuid.uuid4(), Item.user_id == user_id)
+            .values(name="Renamed", version=Item.version + 1),
+            lambda user_id: delete(Item).where(
+                Item.id == uuid.uuid4(), Item.user_id == user_id
+            ),
+        ],
+        ids=[
+            "list",
+            "list_prefix",
+            "list_page",
+            "search",
+            "changes",
+            "pending_changes",
+            "lookup",
+            "update",
+            "delete",
+        ],
+    )
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_user_queries_scan_one_partition(
+        self, db_session, authenticated_user, build, plan_cache_mode
+    ):
+        statement = build(authenticated_user["user"].id)
+
+        partitions = await self.scanned_partitions(
+            db_session, statement, plan_cache_mode
+        )
+
+        assert len(set(partitions)) == 1
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_users_are_spread_over_partitions(self, db_session):
+        users = [
+            User(email=f"user{i}@example.com", hashed_password="x") for i in range(64)
+        ]
+        db_session.add_all(users)
+        await db_session.flush()
+        await db_session.execute(
+            insert(Item), [{"name": "Item", "user_id": user.id} for user in users]
+        )
+
+        partitions = await db_session.execute(
+            select(func.count(literal_column("tableoid").distinct())).select_from(Item)
+        )
+        assert partitions.scalar() > 1
+
+
+@pytest.mark.skipif(msgpack is None, reason="msgpack is not installed")
+class TestMessagePack:
+    msgpack_headers = {"Accept": MSGPACK_MEDIA_TYPE}
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_read_items_as_msgpack(
+        self, test_client, db_session, authenticated_user
+    ):
+        user_id = authenticated_user["user"].id
+        await db_session.execute(insert(Item).values(name="Drill", user_id=user_id))
+
+        response = await test_client.get(
+            "/items/", headers={**authenticated_user["headers"], **self.msgpack_headers}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"] == MSGPACK_MEDIA_TYPE
+        [item] = unpackb(response.content)
+        assert item["name"] == "Drill"
+        assert item["user_id"] == user_id
+        assert isinstance(item["id"], uuid.UUID)
+        assert item["created_at"].tzinfo is not None
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_read_sparse_fields_as_msgpack(
+        self, test_client, db_session, authenticated_user
+    ):
+        user_id = authenticated_user["user"].id
+        await db_session.execute(insert(Item).values(name="Drill", user_id=user_id))
+
+        response = await test_client.get(
+            "/items/?fields=name",
+            headers={**authenticated_user["headers"], **self.msgpack_headers},
+        )
+
+        [item] = unpackb(response.content)
+        assert item.keys() == {"id", "name"}
+        assert isinstance(item["id"], uuid.UUID)
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_create_item_from_msgpack(self, test_client, authenticated_user):
+        response = await test_client.post(
+            "/items/",
+            content=packb({"name": "Saw", "quantity": 2}),
+            headers={
+                **authenticated_user["headers"],
+                **self.msgpack_headers,
+                "Content-Type": MSGPACK_MEDIA_TYPE,
+            },
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        item = unpackb(response.content)
+        assert (item["name"], item["quantity"]) == ("Saw", 2)
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_batch_from_msgpack(self, test_client, authenticated_user):
+        response = await test_client.post(
+            "/items/batch",
+            content=packb({"operations": [{"op": "create", "item": {"name": "Saw"}}]}),
+            headers={
+                **authenticated_user["headers"],
+                "Content-Type": MSGPACK_MEDIA_TYPE,
+            },
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["committed"] is True
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_current_user_as_msgpack(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/users/me",
+            headers={**authenticated_user["headers"], **self.msgpack_headers},
+        )
+
+        assert response.headers["content-type"] == MSGPACK_MEDIA_TYPE
+        user = unpackb(response.content)
+        assert user["email"] == "test@example.com"
+        assert user["id"] == authenticated_user["user"].id
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_replay_as_msgpack(self, test_client, authenticated_user):
+        headers = {
+            **authenticated_user["headers"],
+            **self.msgpack_headers,
+            "Idempotency-Key": "create-saw",
+        }
+
+        first = await test_client.post("/items/", json={"name": "Saw"}, headers=headers)
+        replay = await test_client.post(
+            "/items/", json={"name": "Saw"}, headers=headers
+        )
+
+        assert replay.headers["Idempotent-Replayed"] == "true"
+        assert replay.headers["content-type"] == MSGPACK_MEDIA_TYPE
+        item = unpackb(replay.content)
+        assert item == unpackb(first.content)
+        assert isinstance(item["id"], uuid.UUID)
+        assert item["created_at"].tzinfo is not None
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_errors_as_msgpack(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/items/?sort=color",
+            headers={**authenticated_user["headers"], **self.msgpack_headers},
+        )
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert "detail" in unpackb(response.content)
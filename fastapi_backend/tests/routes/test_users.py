@@ -0,0 +1,121 @@
+import pytest
+from fastapi import status
+from sqlalchemy import insert, text
+
+from app.models import Item, User
+from app.routes.users import build_user_list_query
+from app.schemas import UserListQuery
+
+
+@pytest.fixture
+async def superuser(authenticated_user, db_session):
+    authenticated_user["user"].is_superuser = True
+    await db_session.commit()
+    return authenticated_user
+
+
+@pytest.fixture
+async def accounts(db_session, engine, mocker):
+    # The item summaries are read from the users' shards
+    mocker.patch("app.database.shard_engines", [engine])
+    users = [
+        User(email="ada@example.com", hashed_password="x", is_verified=True),
+        User(email="alan@example.com", hashed_password="x", is_verified=False),
+        User(email="al_x@example.com", hashed_password="x", is_verified=True),
+        User(email="grace@example.com", hashed_password="x", is_active=False),
+    ]
+    db_session.add_all(users)
+    await db_session.flush()
+    await db_session.execute(
+        insert(Item),
+        [
+            {"name": "Drill", "quantity": 2, "user_id": users[0].id},
+            {"name": "Saw", "quantity": 3, "user_id": users[0].id},
+            {"name": "Bolt", "quantity": 10, "user_id": users[1].id},
+        ],
+    )
+    await db_session.commit()
+    return users
+
+
+class TestUserList:
+    async def list_users(self, test_client, user, **params):
+        response = await test_client.get(
+            "/users/", params=params, headers=user["headers"]
+        )
+        assert response.status_code == status.HTTP_200_OK
+        return response.json()
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_requires_a_superuser(self, test_client, authenticated_user):
+        response = await test_client.get(
+            "/users/", headers=authenticated_user["headers"]
+        )
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_lists_users_with_item_counts(self, test_client, superuser, accounts):
+        page = await self.list_users(test_client, superuser)
+
+        counts = {
+            user["email"]: (user["item_count"], user["total_quantity"])
+            for user in page["users"]
+        }
+        assert list(counts) == sorted(counts)
+        assert counts["ada@example.com"] == (2, 5)
+        assert counts["alan@example.com"] == (1, 10)
+        assert counts["grace@example.com"] == (0, 0)
+        assert page["has_more"] is False
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_pages_follow_the_cursor(self, test_client, superuser, accounts):
+        emails = []
+        cursor = None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            page = await self.list_users(test_client, superuser, **params)
+            emails += [user["email"] for user in page["users"]]
+            cursor = page["cursor"]
+            if not page["has_more"]:
+                break
+
+        assert emails == sorted(
+            [user.email for user in accounts] + [superuser["user"].email]
+        )
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_email_prefix_is_matched_literally(
+        self, test_client, superuser, accounts
+    ):
+        page = await self.list_users(test_client, superuser, email_prefix="al")
+        underscore = await self.list_users(test_client, superuser, email_prefix="al_")
+
+        assert [user["email"] for user in page["users"]] == [
+            "al_x@example.com",
+            "alan@example.com",
+        ]
+        assert [user["email"] for user in underscore["users"]] == ["al_x@example.com"]
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_filters_by_flags(self, test_client, superuser, accounts):
+        inactive = await self.list_users(test_client, superuser, is_active=False)
+        unverified = await self.list_users(test_client, superuser, is_verified=False)
+
+        assert [user["email"] for user in inactive["users"]] == ["grace@example.com"]
+        assert "alan@example.com" in [user["email"] for user in unverified["users"]]
+        assert all(not user["is_verified"] for user in unverified["users"])
+
+    @pytest.mark.asyncio(loop_scope="function")
+    async def test_prefix_lookup_uses_the_email_index(self, db_session, engine):
+        statement = build_user_list_query(
+            UserListQuery(email_prefix="al", cursor="al_x@example.com")
+        )
+        compiled = statement.compile(
+            dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+
+        await db_session.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = await db_session.execute(text(f"EXPLAIN {compiled}"))
+
+        assert "ix_user_email" in "\n".join(plan.scalars())
@@ -0,0 +1,463 @@
+import asyncio
+
+import pytest
+
+from app.cache import (
+    LRUCache,
+    NearCache,
+    RedisCache,
+    RedisConnection,
+    RedisError,
+    encode_command,
+)
+
+
+class StandInRedis:
+    """A local server speaking enough of the Redis protocol for the caches:
+    strings with expiry, WATCH/MULTI/EXEC and pub/sub."""
+
+    def __init__(self):
+        self.values: dict[bytes, tuple[bytes, float | None]] = {}
+        # Bumped on every write, for WATCH
+        self.versions: dict[bytes, int] = {}
+        # Keys holding something other than a string, which GET refuses
+        self.other_types: set[bytes] = set()
+        self.subscribers: dict[bytes, set[asyncio.StreamWriter]] = {}
+        self.writers: set[asyncio.StreamWriter] = set()
+        self.password: bytes | None = None
+        self.commands: list[list[bytes]] = []
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"redis://{host}:{port}/0"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+
+    async def close(self):
+        self.drop_connections()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def drop_connections(self):
+        for writer in list(self.writers):
+            writer.close()
+
+    def drop_subscribers(self):
+        for subscribers in self.subscribers.values():
+            for writer in list(subscribers):
+                writer.close()
+
+    def write(self, key: bytes, value: bytes, ttl_ms: int | None):
+        expires_at = None
+        if ttl_ms is not None:
+            expires_at = asyncio.get_running_loop().time() + ttl_ms / 1000
+        self.values[key] = (value, expires_at)
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def read(self, key: bytes) -> bytes | None:
+        value, expires_at = self.values.get(key, (None, None))
+        if expires_at is not None and expires_at <= asyncio.get_running_loop().time():
+            del self.values[key]
+            return None
+        return value
+
+    def publish(self, channel: bytes, message: bytes) -> int:
+        subscribers = self.subscribers.get(channel, set())
+        for writer in subscribers:
+            writer.write(encode_command(b"message", channel, message))
+        return len(subscribers)
+
+    async def read_command(self, reader) -> list[bytes]:
+        count = int((await reader.readexactly(1) + await reader.readline())[1:-2])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def serve(self, reader, writer):
+        self.writers.add(writer)
+        watched: dict[bytes, int] | None = None
+        queued: list[list[bytes]] | None = None
+        try:
+            while True:
+                args = await self.read_command(reader)
+                self.commands.append(args)
+                name = args[0].upper()
+                if queued is not None and name not in (b"EXEC", b"DISCARD"):
+                    queued.append(args)
+                    writer.write(b"+QUEUED\r\n")
+                elif name == b"EXEC":
+                    if watched and any(
+                        self.versions.get(key, 0) != version
+                        for key, version in watched.items()
+                    ):
+                        writer.write(b"*-1\r\n")
+                    else:
+                        writer.write(b"*%d\r\n" % len(queued))
+                        for command in queued:
+                            writer.write(self.run(command))
+                    watched = queued = None
+                elif name == b"DISCARD":
+                    watched = queued = None
+                    writer.write(b"+OK\r\n")
+                elif name == b"MULTI":
+                    queued = []
+                    writer.write(b"+OK\r\n")
+                elif name == b"WATCH":
+                    watched = watched or {}
+                    for key in args[1:]:
+                        watched[key] = self.versions.get(key, 0)
+                    writer.write(b"+OK\r\n")
+                elif name == b"UNWATCH":
+                    watched = None
+                    writer.write(b"+OK\r\n")
+                elif name == b"SUBSCRIBE":
+                    for channel in args[1:]:
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        writer.write(
+                            b"*3\r\n$9\r\nsubscribe\r\n$%d\r\n%s\r\n:1\r\n"
+                            % (len(channel), channel)
+                        )
+                else:
+                    writer.write(self.run(args))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            for subscribers in self.subscribers.values():
+                subscribers.discard(writer)
+            writer.close()
+
+    def run(self, args: list[bytes]) -> bytes:
+        name = args[0].upper()
+        if name == b"AUTH":
+            if args[-1] != self.password:
+                return b"-WRONGPASS invalid username-password pair\r\n"
+            return b"+OK\r\n"
+        if name in (b"PING", b"SELECT"):
+            return b"+OK\r\n"
+        if name == b"GET":
+            if args[1] in self.other_types:
+                return b"-WRONGTYPE Operation against a key holding the wrong kind\r\n"
+            value = self.read(args[1])
+            if value is None:
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"SET":
+            ttl_ms = (
+                int(args[4]) if len(args) > 4 and args[3].upper() == b"PX" else None
+            )
+            self.write(args[1], args[2], ttl_ms)
+            return b"+OK\r\n"
+        if name == b"DEL":
+            deleted = sum(self.values.pop(key, None) is not None for key in args[1:])
+            for key in args[1:]:
+                self.versions[key] = self.versions.get(key, 0) + 1
+            return b":%d\r\n" % deleted
+        if name == b"PTTL":
+            if self.read(args[1]) is None:
+                return b":-2\r\n"
+            expires_at = self.values[args[1]][1]
+            if expires_at is None:
+                return b":-1\r\n"
+            ttl = expires_at - asyncio.get_running_loop().time()
+            return b":%d\r\n" % int(ttl * 1000)
+        if name == b"PUBLISH":
+            return b":%d\r\n" % self.publish(args[1], args[2])
+        return b"-ERR unknown command '%s'\r\n" % name
+
+
+@pytest.fixture
+async def server():
+    server = StandInRedis()
+    await server.start()
+    yield server
+    await server.close()
+
+
+@pytest.fixture
+async def shared(server):
+    shared = RedisCache(server.url, pool_size=2, timeout=2)
+    yield shared
+    await shared.close()
+
+
+def near_cache(server) -> NearCache:
+    return NearCache(
+        LRUCache(100),
+        RedisCache(server.url, pool_size=2, timeout=2),
+        channel="invalidation",
+        local_ttl=60,
+    )
+
+
+@pytest.fixture
+async def workers(server):
+    """Two workers' near caches in front of the same shared cache."""
+    caches = [near_cache(server), near_cache(server)]
+    for cache in caches:
+        await cache.start()
+        await cache.wait_until_subscribed(timeout=5)
+    yield caches
+    for cache in caches:
+        await cache.close()
+
+
+async def eventually(condition, timeout=5):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+@pytest.mark.asyncio
+async def test_lru_evicts_the_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    await cache.set("a", b"1")
+    await cache.set("b", b"2")
+    await cache.get("a")
+    await cache.set("c", b"3")
+
+    assert await cache.get("a") == b"1"
+    assert await cache.get("b") is None
+    assert cache.stats.evictions == 1
+    assert cache.tier_stats()["local"]["entries"] == 2
+
+
+@pytest.mark.asyncio
+async def test_lru_entries_expire(mocker):
+    clock = mocker.patch("app.cache.time")
+    clock.monotonic.return_value = 100.0
+    cache = LRUCache(max_entries=10)
+    await cache.set("a", b"1", ttl=5)
+    await cache.set("b", b"2")
+
+    clock.monotonic.return_value = 105.0
+
+    assert await cache.get("a") is None
+    assert await cache.get("b") == b"2"
+    assert cache.stats.expirations == 1
+    assert cache.stats.as_dict()["hit_rate"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_lru_compare_and_set():
+    cache = LRUCache(max_entries=10)
+
+    assert await cache.compare_and_set("a", None, b"1") is True
+    assert await cache.compare_and_set("a", None, b"2") is False
+    assert await cache.compare_and_set("a", b"1", b"2") is True
+    assert await cache.get("a") == b"2"
+    assert cache.stats.cas_conflicts == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_connection_authenticates(server):
+    server.password = b"secret"
+    url = server.url.replace("redis://", "redis://:secret@")
+
+    connection = await RedisConnection.open(url)
+    try:
+        assert await connection.execute("PING") == "OK"
+    finally:
+        connection.close()
+    assert [b"AUTH", b"secret"] in server.commands
+
+
+@pytest.mark.asyncio
+async def test_redis_error_replies_are_raised(server):
+    server.password = b"secret"
+
+    connection = await RedisConnection.open(server.url)
+    try:
+        with pytest.raises(RedisError, match="WRONGPASS"):
+            await connection.execute("AUTH", "wrong")
+        # The connection is still usable after an error reply
+        assert await connection.execute("GET", "missing") is None
+    finally:
+        connection.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_get_set_delete(shared):
+    await shared.set("key", b"\x00binary\r\n")
+
+    assert await shared.get("key") == b"\x00binary\r\n"
+    await shared.delete("key")
+    assert await shared.get("key") is None
+    assert shared.tier_stats()["shared"]["hits"] == 1
+    assert shared.stats.misses == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_entries_expire(server, shared):
+    await shared.set("key", b"value", ttl=0.05)
+
+    assert [b"SET", b"key", b"value", b"PX", b"50"] in server.commands
+    await asyncio.sleep(0.1)
+    assert await shared.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_redis_compare_and_set(shared):
+    assert await shared.compare_and_set("key", None, b"1") is True
+    assert await shared.compare_and_set("key", None, b"2") is False
+    assert await shared.compare_and_set("key", b"1", b"2") is True
+
+    assert await shared.get("key") == b"2"
+    assert shared.stats.cas_conflicts == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_compare_and_set_loses_to_a_concurrent_write(
+    server, shared, mocker
+):
+    execute = RedisConnection.execute
+
+    async def write_after_watch(connection, *args):
+        reply = await execute(connection, *args)
+        if args[0] == "MULTI":
+            # Another worker writes between the check and EXEC
+            server.write(b"key", b"theirs", None)
+        return reply
+
+    mocker.patch.object(RedisConnection, "execute", write_after_watch)
+    server.write(b"key", b"1", None)
+
+    assert await shared.compare_and_set("key", b"1", b"mine") is False
+    assert server.read(b"key") == b"theirs"
+
+
+@pytest.mark.asyncio
+async def test_failed_compare_and_set_leaves_no_watch_behind(server):
+    shared = RedisCache(server.url, pool_size=1, timeout=2)
+    server.other_types.add(b"list")
+
+    with pytest.raises(RedisError, match="WRONGTYPE"):
+        await shared.compare_and_set("list", None, b"1")
+    # Would abort the next transaction if its connection still watched "list"
+    server.write(b"list", b"now a string", None)
+
+    assert await shared.compare_and_set("other", None, b"1") is True
+    await shared.close()
+
+
+@pytest.mark.asyncio
+async def test_an_unreachable_server_is_a_miss(server):
+    cache = near_cache(server)
+    await server.close()
+
+    assert await cache.get("key") is None
+    await cache.set("key", b"value")
+    assert await cache.get("key") is None
+    assert cache.tier_stats()["shared"]["errors"] == 3
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_near_cache_serves_hits_locally(server, workers):
+    cache, _ = workers
+    await cache.set("key", b"value")
+    server.commands.clear()
+
+    assert await cache.get("key") == b"value"
+    assert server.commands == []
+    stats = cache.tier_stats()
+    assert stats["local"]["hits"] == 1
+    assert stats["subscribed"] is True
+
+
+@pytest.mark.asyncio
+async def test_near_cache_fills_locally_from_the_shared_cache(server, workers):
+    first, second = workers
+    await first.set("key", b"value")
+
+    assert await second.get("key") == b"value"
+    assert await second.get("key") == b"value"
+    stats = second.tier_stats()
+    assert (stats["local"]["hits"], stats["local"]["misses"]) == (1, 1)
+    assert stats["shared"]["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_local_copies_expire_with_the_shared_key(workers):
+    first, second = workers
+    await first.set("key", b"value", ttl=0.1)
+
+    assert await second.get("key") == b"value"
+    await asyncio.sleep(0.15)
+    assert await second.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_writes_invalidate_other_workers_local_copies(workers):
+    first, second = workers
+    await first.set("key", b"old")
+    assert await second.get("key") == b"old"
+
+    await first.set("key", b"new")
+    await eventually(lambda: second.local.stats.invalidations == 1)
+
+    assert await second.get("key") == b"new"
+    # A worker's own writes don't invalidate its local copy
+    assert first.local.stats.invalidations == 0
+
+
+@pytest.mark.asyncio
+async def test_deletes_and_compare_and_set_invalidate(workers):
+    first, second = workers
+    await first.set("key", b"1")
+    assert await second.get("key") == b"1"
+
+    assert await first.compare_and_set("key", b"1", b"2") is True
+    await eventually(lambda: second.local.stats.invalidations == 1)
+    assert await second.get("key") == b"2"
+
+    await first.delete("key")
+    await eventually(lambda: second.local.stats.invalidations == 2)
+    assert await second.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_failed_compare_and_set_drops_the_stale_local_copy(workers):
+    first, second = workers
+    await first.set("key", b"1")
+    assert await second.get("key") == b"1"
+    # Changed behind the caches' backs, without an invalidation
+    await first.shared.set("key", b"2")
+
+    assert await second.compare_and_set("key", b"1", b"3") is False
+    assert await second.get("key") == b"2"
+
+
+@pytest.mark.asyncio
+async def test_local_cache_is_bypassed_until_resubscribed(server, workers):
+    first, second = workers
+    await first.set("key", b"old")
+    assert await second.get("key") == b"old"
+
+    server.drop_subscribers()
+    await eventually(lambda: not second.tier_stats()["subscribed"])
+    # Missed by the second worker, which is between subscriptions
+    server.write(b"key", b"new", None)
+
+    assert await second.get("key") == b"new"
+    await second.wait_until_subscribed(timeout=5)
+    assert len(second.local) == 0
+    assert await second.get("key") == b"new"
+
+
+@pytest.mark.asyncio
+async def test_connections_closed_by_the_server_are_replaced(server, shared):
+    await shared.set("key", b"value")
+    server.drop_connections()
+    await asyncio.sleep(0.05)
+
+    assert await shared.get("key") == b"value"
+    assert shared.stats.errors == 0
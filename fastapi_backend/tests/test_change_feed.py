@@ -0,0 +1,158 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.engine import make_url
+
+from app.change_feed import CLOSED, ChangeEvent, ChangeFeed, Subscription
+from app.config import settings
+from app.models import ITEM_CHANGES_CHANNEL, Item, User
+
+TEST_DSN = (
+    make_url(settings.TEST_DATABASE_URL)
+    .set(drivername="postgresql")
+    .render_as_string(hide_password=False)
+)
+
+
+@pytest.fixture
+async def feed(engine):
+    feed = ChangeFeed(TEST_DSN, buffer_size=10, replay_size=5)
+    await feed.start(timeout=5)
+    yield feed
+    await feed.close()
+
+
+@pytest.fixture
+async def user_id(engine):
+    user_id = uuid.uuid4()
+    async with engine.begin() as conn:
+        await conn.execute(
+            insert(User).values(
+                id=user_id, email="feed@example.com", hashed_password=""
+            )
+        )
+    return user_id
+
+
+async def next_event(subscription: Subscription) -> ChangeEvent:
+    return await asyncio.wait_for(subscription.get(), timeout=5)
+
+
+def event(event_id, user_id, op="update"):
+    return ChangeEvent(id=event_id, user_id=user_id, op=op, data={})
+
+
+@pytest.mark.asyncio
+async def test_item_changes_are_pushed_to_the_users_subscribers(engine, feed, user_id):
+    subscription = feed.subscribe(user_id)
+    other_subscription = feed.subscribe(uuid.uuid4())
+
+    async with engine.begin() as conn:
+        item_id = (
+            await conn.execute(
+                insert(Item).values(name="Drill", user_id=user_id).returning(Item.id)
+            )
+        ).scalar_one()
+    async with engine.begin() as conn:
+        await conn.execute(update(Item).values(quantity=2, version=Item.version + 1))
+    async with engine.begin() as conn:
+        await conn.execute(delete(Item))
+
+    inserted = await next_event(subscription)
+    updated = await next_event(subscription)
+    deleted = await next_event(subscription)
+
+    assert [inserted.op, updated.op, deleted.op] == ["insert", "update", "delete"]
+    assert inserted.data == {"id": str(item_id), "version": 1}
+    assert updated.data == {"id": str(item_id), "version": 2}
+    assert inserted.id < updated.id < deleted.id
+    assert other_subscription.queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_bulk_changes_send_a_reset(engine, feed, user_id):
+    subscription = feed.subscribe(user_id)
+
+    async with engine.begin() as conn:
+        await conn.execute(
+            insert(Item),
+            [{"name": f"Item {i}", "user_id": user_id} for i in range(101)],
+        )
+
+    reset = await next_event(subscription)
+    assert reset.op == "reset"
+    assert subscription.queue.empty()
+
+
+def test_resume_replays_the_users_later_events():
+    feed = ChangeFeed("unused", buffer_size=10, replay_size=5)
+    user_id, other_user_id = uuid.uuid4(), uuid.uuid4()
+    for event_id, owner in enumerate([user_id, other_user_id, user_id, user_id]):
+        feed.publish(event(event_id, owner))
+
+    replayed = feed.replay_after(1, user_id)
+    assert [e.id for e in replayed] == [2, 3]
+
+
+def test_resume_from_an_evicted_event_resets():
+    feed = ChangeFeed("unused", buffer_size=10, replay_size=2)
+    user_id = uuid.uuid4()
+    for event_id in range(3):
+        feed.publish(event(event_id, user_id))
+
+    assert [e.op for e in feed.replay_after(0, user_id)] == ["reset"]
+
+
+def test_slow_subscriber_backlog_collapses_into_a_reset():
+    subscription = Subscription(uuid.uuid4(), buffer_size=3)
+    for event_id in range(5):
+        subscription.push(event(event_id, subscription.user_id))
+
+    # Events after the reset are queued as usual
+    assert subscription.queue.get_nowait().op == "reset"
+    assert subscription.queue.get_nowait().id == 4
+    assert subscription.queue.empty()
+
+
+def test_reset_all_notifies_every_subscriber():
+    feed = ChangeFeed("unused", buffer_size=10, replay_size=5)
+    subscriptions = [feed.subscribe(uuid.uuid4()) for _ in range(2)]
+    feed.publish(event(1, subscriptions[0].user_id))
+
+    feed.reset_all()
+
+    assert subscriptions[0].queue.qsize() == 2
+    assert subscriptions[1].queue.get_nowait().op == "reset"
+    assert feed.replay_after(1, subscriptions[0].user_id)[0].op == "reset"
+
+
+@pytest.mark.asyncio
+async def test_close_ends_subscriptions():
+    feed = ChangeFeed("unused", buffer_size=1, replay_size=5)
+    subscription = feed.subscribe(uuid.uuid4())
+    subscription.push(event(1, subscription.user_id))
+
+    await feed.close()
+
+    assert subscription.queue.get_nowait() is CLOSED
+
+
+@pytest.mark.asyncio
+async def test_moved_users_streams_are_ended(engine, feed, user_id):
+    subscription = feed.subscribe(user_id)
+    other_subscription = feed.subscribe(uuid.uuid4())
+
+    payload = json.dumps({"op": "moved", "user_id": str(user_id)})
+    async with engine.begin() as conn:
+        await conn.execute(select(func.pg_notify(ITEM_CHANGES_CHANNEL, payload)))
+        await conn.execute(insert(Item).values(name="Late", user_id=user_id))
+
+    assert (await next_event(subscription)).op == "reset"
+    assert await next_event(subscription) is CLOSED
+    # The insert sent after the move reaches nobody
+    await asyncio.sleep(0.1)
+    assert subscription.queue.empty()
+    assert other_subscription.queue.empty()
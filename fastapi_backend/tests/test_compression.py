@@ -0,0 +1,214 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from httpx import ASGITransport, AsyncClient
+
+from app.compression import (
+    ENCODERS,
+    CompressedBodyCache,
+    CompressionMiddleware,
+    select_encoding,
+)
+
+LARGE_PAYLOAD = [{"name": f"Item {i}", "quantity": i} for i in range(200)]
+
+
+@pytest.fixture
+def compression_app():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=500, cache_size=8)
+
+    @app.get("/large")
+    async def large():
+        return LARGE_PAYLOAD
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/tagged")
+    async def tagged():
+        return JSONResponse(LARGE_PAYLOAD, headers={"ETag": '"v1"'})
+
+    @app.get("/tagged-other")
+    async def tagged_other():
+        return JSONResponse(LARGE_PAYLOAD[::-1], headers={"ETag": '"v1"'})
+
+    @app.get("/stream")
+    async def stream():
+        async def rows():
+            for item in LARGE_PAYLOAD:
+                yield f"{item['name']},{item['quantity']}\n"
+
+        return StreamingResponse(rows(), media_type="text/csv")
+
+    @app.get("/events")
+    async def events():
+        return StreamingResponse(
+            iter(["data: x\n\n"] * 100), media_type="text/event-stream"
+        )
+
+    @app.get("/no-transform")
+    async def no_transform():
+        return PlainTextResponse("x" * 2000, headers={"Cache-Control": "no-transform"})
+
+    return app
+
+
+@pytest.fixture
+async def client(compression_app):
+    async with AsyncClient(
+        transport=ASGITransport(app=compression_app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+async def get_raw(client, url, headers):
+    async with client.stream("GET", url, headers=headers) as response:
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+    return response, raw
+
+
+def middleware_of(app) -> CompressionMiddleware:
+    stack = app.middleware_stack
+    while not isinstance(stack, CompressionMiddleware):
+        stack = stack.app
+    return stack
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("gzip", "gzip"),
+        ("gzip, br", "br"),
+        ("gzip, br, zstd", "zstd"),
+        ("br;q=0.5, gzip;q=0.8", "gzip"),
+        ("*", "zstd"),
+        ("*, zstd;q=0", "br"),
+        ("identity", None),
+        ("", None),
+        ("gzip;q=0", None),
+    ],
+)
+def test_select_encoding(accept_encoding, expected, mocker):
+    # Pin the server's codings so the outcome doesn't depend on optional packages
+    mocker.patch.dict(
+        "app.compression.ENCODERS", {"zstd": None, "br": None, "gzip": None}, clear=True
+    )
+    assert select_encoding(accept_encoding) == expected
+
+
+def decompressor(encoding):
+    if encoding not in ENCODERS:
+        pytest.skip(f"{encoding} support is not installed")
+    if encoding == "br":
+        import brotli
+
+        return brotli.decompress
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress
+    return gzip.decompress
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+@pytest.mark.asyncio
+async def test_compresses_large_json(client, encoding):
+    decompress = decompressor(encoding)
+    response, raw = await get_raw(client, "/large", {"Accept-Encoding": encoding})
+    plain = await client.get("/large", headers={"Accept-Encoding": "identity"})
+
+    assert response.headers["content-encoding"] == encoding
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) == len(raw) < len(plain.content)
+    assert decompress(raw) == plain.content
+
+
+@pytest.mark.asyncio
+async def test_small_body_is_not_compressed(client):
+    response = await client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"ok": True}
+
+
+@pytest.mark.asyncio
+async def test_identity_only_client_gets_plain_body(client):
+    response = await client.get("/large", headers={"Accept-Encoding": "identity"})
+
+    assert "content-encoding" not in response.headers
+    assert response.json() == LARGE_PAYLOAD
+
+
+@pytest.mark.asyncio
+async def test_repeated_responses_reuse_cached_body(client, compression_app, mocker):
+    compress = mocker.spy(gzip, "compress")
+    headers = {"Accept-Encoding": "gzip"}
+
+    first = await client.get("/tagged", headers=headers)
+    second = await client.get("/tagged", headers=headers)
+
+    assert first.content == second.content
+    assert first.headers["etag"] == 'W/"v1"'
+    assert compress.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_untagged_responses_are_cached_by_digest(client, compression_app):
+    headers = {"Accept-Encoding": "gzip"}
+
+    await client.get("/large", headers=headers)
+    await client.get("/large", headers=headers)
+
+    cache = middleware_of(compression_app).cache
+    assert cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_same_etag_with_different_bodies_is_not_shared(client, compression_app):
+    headers = {"Accept-Encoding": "gzip"}
+
+    tagged = await client.get("/tagged", headers=headers)
+    other = await client.get("/tagged-other", headers=headers)
+
+    assert tagged.json() == LARGE_PAYLOAD
+    assert other.json() == LARGE_PAYLOAD[::-1]
+
+
+def test_cache_is_bounded_by_size():
+    cache = CompressedBodyCache(max_entries=10, max_bytes=100)
+
+    cache.set("a", "gzip", b"x" * 60)
+    cache.set("b", "gzip", b"x" * 30)
+    cache.set("c", "gzip", b"x" * 30)
+    cache.set("d", "gzip", b"x" * 200)
+
+    assert cache.get("a", "gzip") is None
+    assert cache.get("b", "gzip") is not None
+    assert cache.get("c", "gzip") is not None
+    assert cache.get("d", "gzip") is None
+    assert cache.size == 60
+
+
+@pytest.mark.asyncio
+async def test_streaming_response_is_compressed_incrementally(client):
+    response, raw = await get_raw(client, "/stream", {"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert gzip.decompress(raw).decode().startswith("Item 0,0\nItem 1,1\n")
+
+
+@pytest.mark.asyncio
+async def test_event_stream_is_not_compressed(client):
+    response = await client.get("/events", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_no_transform_is_respected(client):
+    response = await client.get("/no-transform", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
@@ -1,14 +1,36 @@
+import uuid
+
 import pytest
-from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
+from fastapi import Depends, FastAPI
+from httpx import ASGITransport, AsyncClient
+from pydantic import BaseModel, field_serializer
+from sqlalchemy import NullPool, QueuePool, func, insert, select
+from sqlalchemy.exc import UnboundExecutionError
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, create_async_engine
 from fastapi_users.db import SQLAlchemyUserDatabase
 
 from app.database import (
+    SessionReleasingRoute,
+    StatementCacheStats,
+    UserDirectory,
     async_session_maker,
     create_db_and_tables,
+    delete_user_items,
     get_async_session,
+    get_pool_usage,
     get_user_db,
+    home_shard,
+    release_sessions,
+    shard_session,
+    statement_cache_connect_args,
+    track_statement_cache,
+    warm_up_engine,
+    warm_up_statements,
 )
-from app.models import Base, User
+from app.config import settings
+from app.models import Base, Item, ItemSummary, ItemTombstone, User
+from app.routes.items import build_item_list_query
+from app.schemas import ItemListQuery
 
 
 @pytest.fixture
@@ -46,17 +68,17 @@ async def mock_session(mocker):
 
 @pytest.mark.asyncio
 async def test_create_db_and_tables(mock_engine, mocker):
-    # Replace the real engine with our mock
-    mocker.patch("app.database.engine", mock_engine)
+    # Replace the real engines with our mock, as two shards
+    mocker.patch("app.database.shard_engines", [mock_engine, mock_engine])
 
     await create_db_and_tables()
 
-    # Verify that begin was called
-    mock_engine.begin.assert_called_once()
+    # Verify that begin was called on each shard
+    assert mock_engine.begin.call_count == 2
 
     # Verify that create_all was called
     mock_conn = mock_engine.begin.return_value.__aenter__.return_value
-    mock_conn.run_sync.assert_called_once_with(Base.metadata.create_all)
+    mock_conn.run_sync.assert_called_with(Base.metadata.create_all)
 
 
 @pytest.mark.asyncio
@@ -106,3 +128,217 @@ async def test_session_maker_configuration():
     # Create a test session
     async with async_session_maker() as session:
         assert isinstance(session, AsyncSession)
+
+
+@pytest.mark.asyncio
+async def test_warm_up_engine_primes_each_connection(mocker):
+    mock_conn = mocker.AsyncMock()
+    mock_engine = mocker.MagicMock()
+    mock_engine.connect.return_value.__aenter__.return_value = mock_conn
+    mocker.patch("app.database.shard_engines", [mock_engine, mock_engine])
+
+    await warm_up_engine(3)
+
+    assert mock_engine.connect.call_count == 2 * 3
+    assert mock_conn.execute.await_count == 2 * 3 * len(warm_up_statements())
+
+
+def test_warm_up_primes_the_default_items_list():
+    # Same cache key as the statement GET /items/ runs, whatever the user
+    listed = build_item_list_query(uuid.uuid4(), ItemListQuery())
+    cache_keys = {s._generate_cache_key().key for s in warm_up_statements()}
+
+    assert listed._generate_cache_key().key in cache_keys
+
+
+def test_get_pool_usage_without_pooling(mocker):
+    mock_engine = mocker.Mock()
+    mock_engine.pool = mocker.Mock(spec=NullPool)
+    mocker.patch("app.database.shard_engines", [mock_engine])
+
+    assert get_pool_usage() is None
+
+
+def test_get_pool_usage_with_pooling(mocker):
+    busy, idle = mocker.Mock(), mocker.Mock()
+    busy.pool = mocker.Mock(spec=QueuePool)
+    busy.pool.checkedout.return_value = 3
+    idle.pool = mocker.Mock(spec=QueuePool)
+    idle.pool.checkedout.return_value = 1
+    mocker.patch("app.database.shard_engines", [idle, busy])
+    mocker.patch("app.database.settings.DATABASE_POOL_SIZE", 5)
+    mocker.patch("app.database.settings.DATABASE_MAX_OVERFLOW", 1)
+
+    assert get_pool_usage() == 0.5
+
+
+@pytest.mark.parametrize("transaction_pooler", [False, True])
+@pytest.mark.asyncio
+async def test_statement_cache_stats(engine, mocker, transaction_pooler):
+    # `engine` creates the tables; the stats are taken on a separate engine
+    # configured the way the app configures its own
+    mocker.patch(
+        "app.database.settings.DATABASE_TRANSACTION_POOLER", transaction_pooler
+    )
+    app_engine = create_async_engine(
+        settings.TEST_DATABASE_URL, connect_args=statement_cache_connect_args()
+    )
+    stats = StatementCacheStats()
+    track_statement_cache(app_engine, stats)
+
+    try:
+        async with app_engine.connect() as conn:
+            for _ in range(3):
+                await conn.execute(select(User.id).where(User.email == "x"))
+    finally:
+        await app_engine.dispose()
+
+    compiled = stats.as_dict()["compiled"]
+    assert (compiled["hits"], compiled["misses"]) == (2, 1)
+    prepared = stats.as_dict()["prepared"]
+    if transaction_pooler:
+        assert prepared == {"hits": 0, "misses": 0, "hit_rate": None}
+    else:
+        assert (prepared["hits"], prepared["misses"]) == (2, 1)
+
+
+def test_transaction_pooler_gets_unique_statement_names(mocker):
+    mocker.patch("app.database.settings.DATABASE_TRANSACTION_POOLER", True)
+
+    args = statement_cache_connect_args()
+
+    assert args["prepared_statement_cache_size"] == 0
+    name_func = args["prepared_statement_name_func"]
+    assert name_func() != name_func()
+
+
+def test_home_shards_are_spread_and_stable(mocker):
+    user_ids = [uuid.uuid4() for _ in range(400)]
+    mocker.patch("app.database.shard_engines", [None] * 4)
+    homes = [home_shard(user_id) for user_id in user_ids]
+
+    assert set(homes) == {0, 1, 2, 3}
+    assert homes == [home_shard(user_id) for user_id in user_ids]
+
+    # A new shard only takes users, it doesn't reshuffle the others
+    mocker.patch("app.database.shard_engines", [None] * 5)
+    for user_id, home in zip(user_ids, homes):
+        assert home_shard(user_id) in (home, 4)
+
+
+def test_shard_session_runs_on_its_shard(mocker):
+    shards = [mocker.Mock(), mocker.Mock()]
+    mocker.patch("app.database.shard_engines", shards)
+
+    assert shard_session(1).sync_session.get_bind() is shards[1].sync_engine
+    with pytest.raises(UnboundExecutionError):
+        async_session_maker().sync_session.get_bind()
+
+
+@pytest.mark.asyncio
+async def test_user_directory_places_new_users_on_their_home_shard(db_session, mocker):
+    mocker.patch("app.database.shard_engines", [None] * 3)
+
+    user = await UserDirectory(db_session, User).create(
+        {"email": "placed@example.com", "hashed_password": ""}
+    )
+
+    assert user.shard == home_shard(user.id)
+
+
+@pytest.mark.asyncio
+async def test_delete_user_items(db_session):
+    user_id, other_user_id = uuid.uuid4(), uuid.uuid4()
+    await db_session.execute(
+        insert(Item),
+        [
+            {"name": "Saw", "user_id": user_id},
+            {"name": "Drill", "user_id": other_user_id},
+        ],
+    )
+    await db_session.execute(
+        Item.__table__.delete().where(Item.name == "Saw", Item.user_id == user_id)
+    )
+    await db_session.execute(insert(Item).values(name="Bolt", user_id=user_id))
+
+    await delete_user_items(db_session, user_id)
+
+    for model in (Item, ItemTombstone, ItemSummary):
+        result = await db_session.execute(select(model).where(model.user_id == user_id))
+        assert result.first() is None
+    result = await db_session.execute(select(Item.name))
+    assert result.scalars().all() == ["Drill"]
+
+
+@pytest.mark.asyncio
+async def test_release_sessions_closes_them_when_the_endpoint_returns(mocker):
+    session = mocker.AsyncMock(spec=AsyncSession)
+
+    @release_sessions
+    async def endpoint(db: AsyncSession, name: str):
+        session.close.assert_not_awaited()
+        return name
+
+    assert await endpoint(db=session, name="Drill") == "Drill"
+    session.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_release_sessions_when_the_endpoint_fails(mocker):
+    session = mocker.AsyncMock(spec=AsyncSession)
+
+    @release_sessions
+    async def endpoint(db: AsyncSession):
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        await endpoint(db=session)
+    session.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_release_sessions_can_be_turned_off(mocker):
+    mocker.patch("app.database.settings.DATABASE_EARLY_RELEASE", False)
+    session = mocker.AsyncMock(spec=AsyncSession)
+
+    @release_sessions
+    async def endpoint(db: AsyncSession):
+        pass
+
+    await endpoint(db=session)
+    session.close.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_connection_is_returned_before_the_response_is_serialized(engine):
+    checked_out_while_serializing = []
+
+    class Count(BaseModel):
+        count: int
+
+        @field_serializer("count")
+        def serialize_count(self, count: int):
+            checked_out_while_serializing.append(engine.pool.checkedout())
+            return count
+
+    async def get_session():
+        async with AsyncSession(engine) as session:
+            yield session
+
+    app = FastAPI()
+    app.router.route_class = SessionReleasingRoute
+
+    @app.get("/count", response_model=Count)
+    async def count_items(db: AsyncSession = Depends(get_session)):
+        count = await db.scalar(select(func.count()).select_from(Item))
+        assert engine.pool.checkedout() == 1
+        return Count(count=count)
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        response = await client.get("/count")
+
+    assert response.json() == {"count": 0}
+    assert app.routes[-1].name == "count_items"
+    assert checked_out_while_serializing == [0]
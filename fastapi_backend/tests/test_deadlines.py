@@ -0,0 +1,198 @@
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.deadlines import (
+    LOCK_NOT_AVAILABLE,
+    DeadlineMiddleware,
+    DeadlineStats,
+    RequestDeadline,
+    current_deadline,
+)
+
+
+def database_error(sqlstate: str) -> DBAPIError:
+    return DBAPIError("SELECT 1", None, MagicMock(sqlstate=sqlstate))
+
+
+@pytest.fixture
+def stats():
+    return DeadlineStats()
+
+
+@pytest.fixture
+def deadline_app(stats, engine):
+    app = FastAPI()
+    app.add_middleware(
+        DeadlineMiddleware,
+        default_timeout=5,
+        route_timeouts={"slow": 0.05, "stream": 0.05},
+        stats=stats,
+    )
+
+    @app.get("/slow")
+    async def slow():
+        await asyncio.sleep(5)
+
+    @app.get("/quick")
+    async def quick():
+        await asyncio.sleep(0.1)
+        return {"deadline": current_deadline.get().timeout}
+
+    @app.get("/sleep")
+    async def sleep():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT pg_sleep(5)"))
+
+    @app.get("/locked")
+    async def locked():
+        raise database_error(LOCK_NOT_AVAILABLE)
+
+    @app.get("/failed")
+    async def failed():
+        raise database_error("23505")
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            yield b"first "
+            await asyncio.sleep(0.1)
+            yield b"second"
+
+        return StreamingResponse(chunks())
+
+    return app
+
+
+@pytest.fixture
+async def client(deadline_app):
+    async with AsyncClient(
+        transport=ASGITransport(app=deadline_app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+async def disconnect_after(app, path: str, delay: float) -> list[dict]:
+    """Call the app, disconnecting the client after `delay` seconds."""
+    sent = []
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.sleep(delay)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return sent
+
+
+@pytest.mark.asyncio
+async def test_route_deadline_times_out(client, stats):
+    start = time.monotonic()
+    response = await client.get("/slow")
+
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Request timed out"}
+    assert time.monotonic() - start < 1
+    assert stats.as_dict() == {"cancelled": 0, "timed_out": 1}
+
+
+@pytest.mark.asyncio
+async def test_other_routes_get_the_default_deadline(client, stats):
+    response = await client.get("/quick")
+
+    assert response.status_code == 200
+    assert response.json() == {"deadline": 5}
+    assert stats.as_dict() == {"cancelled": 0, "timed_out": 0}
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_the_query(deadline_app, stats, engine):
+    start = time.monotonic()
+    sent = await disconnect_after(deadline_app, "/sleep", 0.2)
+
+    assert sent == []
+    assert time.monotonic() - start < 2
+    assert stats.as_dict() == {"cancelled": 1, "timed_out": 0}
+    async with engine.connect() as conn:
+        for _ in range(50):
+            sleeping = await conn.scalar(
+                text(
+                    "SELECT count(*) FROM pg_stat_activity "
+                    "WHERE query = 'SELECT pg_sleep(5)' AND state = 'active'"
+                )
+            )
+            if not sleeping:
+                break
+            await asyncio.sleep(0.05)
+    assert sleeping == 0
+
+
+@pytest.mark.asyncio
+async def test_lock_timeout_is_unavailable(client, stats):
+    response = await client.get("/locked")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert stats.timed_out == 1
+
+
+@pytest.mark.asyncio
+async def test_other_database_errors_are_raised(client):
+    with pytest.raises(DBAPIError):
+        await client.get("/failed")
+
+
+@pytest.mark.asyncio
+async def test_started_response_is_not_cut_off(client, stats):
+    response = await client.get("/stream")
+
+    assert response.text == "first second"
+    assert stats.timed_out == 0
+
+
+@pytest.mark.asyncio
+async def test_statement_timeout_is_the_time_left(engine):
+    deadline = RequestDeadline({}, 0.2, {})
+    async with AsyncSession(engine, info={"deadline": deadline}) as session:
+        statement_timeout = await session.scalar(text("SHOW statement_timeout"))
+        lock_timeout = await session.scalar(text("SHOW lock_timeout"))
+        with pytest.raises(DBAPIError) as error:
+            await session.execute(text("SELECT pg_sleep(1)"))
+
+    assert 100 <= int(statement_timeout.removesuffix("ms")) <= 200
+    assert lock_timeout == statement_timeout
+    assert error.value.orig.sqlstate == "57014"
+
+
+@pytest.mark.asyncio
+async def test_sessions_without_a_deadline_have_no_timeout(engine):
+    async with AsyncSession(engine) as session:
+        assert await session.scalar(text("SHOW statement_timeout")) == "0"
@@ -0,0 +1,80 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app import idempotency
+from app.idempotency import (
+    IdempotentRequest,
+    build_claim_statement,
+    clean_up_expired_keys,
+    delete_expired_keys,
+)
+from app.models import IdempotencyKey
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicate_waits_for_the_first_request(engine):
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    user_id = uuid.uuid4()
+    claim = build_claim_statement(user_id, "retry-me", "fingerprint")
+
+    async with session_maker() as first, session_maker() as duplicate:
+        assert (await first.execute(claim)).scalar() == "retry-me"
+
+        waiting = asyncio.create_task(duplicate.execute(claim))
+        await asyncio.sleep(0.2)
+        assert not waiting.done()
+
+        await IdempotentRequest(first, user_id, "retry-me").save_response({"ok": 1})
+        await first.commit()
+
+        # Claimed by the first request, whose response is now stored
+        assert (await asyncio.wait_for(waiting, 5)).scalar() is None
+        stored = await duplicate.get(IdempotencyKey, (user_id, "retry-me"))
+        assert (stored.status_code, stored.response_body) == (200, {"ok": 1})
+
+
+@pytest.mark.asyncio
+async def test_delete_expired_keys(db_session, mocker):
+    mocker.patch.object(idempotency, "CLEANUP_BATCH_SIZE", 2)
+    now = datetime.now(timezone.utc)
+    await db_session.execute(
+        insert(IdempotencyKey),
+        [
+            {
+                "user_id": uuid.uuid4(),
+                "key": "k",
+                "fingerprint": "",
+                "expires_at": now + timedelta(hours=hours),
+            }
+            for hours in (-2, -1, -1, 1)
+        ],
+    )
+    await db_session.commit()
+
+    assert await delete_expired_keys(db_session) == 3
+
+    remaining = await db_session.execute(select(func.count(IdempotencyKey.key)))
+    assert remaining.scalar() == 1
+
+
+@pytest.mark.asyncio
+async def test_cleanup_runs_on_every_shard(mocker):
+    mocker.patch.object(idempotency, "shard_engines", ["shard0", "shard1"])
+    shard_session = mocker.patch.object(idempotency, "shard_session")
+    delete = mocker.patch.object(
+        idempotency,
+        "delete_expired_keys",
+        mocker.AsyncMock(side_effect=[RuntimeError("shard 0 is down"), 4]),
+    )
+
+    cleanup = asyncio.create_task(clean_up_expired_keys(0.01))
+    while delete.await_count < 2:
+        await asyncio.sleep(0.01)
+    cleanup.cancel()
+
+    assert [call.args for call in shard_session.call_args_list[:2]] == [(0,), (1,)]
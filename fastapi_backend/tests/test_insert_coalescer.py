@@ -0,0 +1,92 @@
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+
+from app import insert_coalescer
+from app.insert_coalescer import InsertCoalescer, insert_batch_stats
+from app.models import Item
+from app.schemas import ItemCreate
+
+
+@pytest.fixture
+def shards(mocker, engine):
+    mocker.patch("app.database.shard_engines", [engine])
+
+
+async def item_names(db_session):
+    result = await db_session.execute(select(Item.name).order_by(Item.name))
+    return result.scalars().all()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_inserts_share_one_batch(shards, db_session):
+    coalescer = InsertCoalescer(0, max_size=10, max_delay=0.05)
+    user_ids = [uuid.uuid4(), uuid.uuid4()]
+
+    created = await asyncio.gather(
+        *(
+            coalescer.insert(user_ids[i % 2], ItemCreate(name=f"Item {i}", quantity=i))
+            for i in range(5)
+        )
+    )
+
+    assert [(item.name, item.quantity) for item in created] == [
+        (f"Item {i}", i) for i in range(5)
+    ]
+    assert [item.user_id for item in created] == [user_ids[i % 2] for i in range(5)]
+    assert await item_names(db_session) == [f"Item {i}" for i in range(5)]
+    stats = coalescer.stats.as_dict()
+    assert (stats["batches"], stats["inserts"], stats["largest_batch"]) == (1, 5, 5)
+    assert 0 < stats["max_added_latency_ms"] < 1000
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_written_without_waiting(shards, db_session):
+    coalescer = InsertCoalescer(0, max_size=2, max_delay=60)
+
+    created = await asyncio.wait_for(
+        asyncio.gather(
+            *(coalescer.insert(uuid.uuid4(), ItemCreate(name=name)) for name in "ab")
+        ),
+        timeout=5,
+    )
+
+    assert [item.name for item in created] == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_failed_row_only_fails_its_own_insert(shards, db_session):
+    coalescer = InsertCoalescer(0, max_size=3, max_delay=60)
+    invalid = ItemCreate.model_construct(name=None, description=None, quantity=None)
+
+    results = await asyncio.gather(
+        coalescer.insert(uuid.uuid4(), ItemCreate(name="Drill")),
+        coalescer.insert(uuid.uuid4(), invalid),
+        coalescer.insert(uuid.uuid4(), ItemCreate(name="Saw")),
+        return_exceptions=True,
+    )
+
+    assert results[0].name == "Drill"
+    assert isinstance(results[1], DBAPIError)
+    assert results[2].name == "Saw"
+    assert await item_names(db_session) == ["Drill", "Saw"]
+    assert coalescer.stats.failed_batches == 1
+
+
+def test_stats_are_combined_across_shards(mocker):
+    coalescers = [InsertCoalescer(shard, 10, 0.01) for shard in range(2)]
+    coalescers[0].stats.record(4, [0.001] * 4, failed=False)
+    coalescers[1].stats.record(2, [0.004] * 2, failed=True)
+    mocker.patch.object(insert_coalescer, "insert_coalescers", coalescers)
+
+    stats = insert_batch_stats()
+
+    assert stats["batches"] == 2
+    assert stats["mean_batch_size"] == 3
+    assert stats["largest_batch"] == 4
+    assert stats["failed_batches"] == 1
+    assert stats["mean_added_latency_ms"] == pytest.approx(2)
+    assert stats["max_added_latency_ms"] == pytest.approx(4)
@@ -0,0 +1,89 @@
+import pytest
+from fastapi import HTTPException
+
+from app import item_import
+from app.item_import import decode_lines, parse_csv, parse_ndjson
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(rows):
+    return [row async for row in rows]
+
+
+@pytest.mark.asyncio
+async def test_lines_split_across_chunks():
+    lines = await collect(
+        decode_lines(stream(b"\xef\xbb\xbfone\r\ntw", b"o\n\xc3", b"\xa9\nlast"))
+    )
+
+    assert lines == ["one", "two", "é", "last"]
+
+
+@pytest.mark.asyncio
+async def test_overlong_line_is_refused(mocker):
+    mocker.patch.object(item_import, "MAX_LINE_LENGTH", 10)
+
+    with pytest.raises(HTTPException) as error:
+        await collect(decode_lines(stream(b"x" * 6, b"x" * 6)))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_parse_csv():
+    rows = await collect(
+        parse_csv(
+            stream(
+                b"Name,Quantity,description\n",
+                b'Drill,2,"Cordless,\n18V"\n',
+                b"\n",
+                b'Saw,,"12"" blade"\n',
+                b"Bolt,3\n",
+            )
+        )
+    )
+
+    assert rows == [
+        (2, {"name": "Drill", "quantity": "2", "description": "Cordless,\n18V"}),
+        (5, {"name": "Saw", "description": '12" blade'}),
+        (6, "Expected 3 values, got 2"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_unterminated_quote_is_bounded(mocker):
+    mocker.patch.object(item_import, "MAX_RECORD_LINES", 3)
+    lines = b'name\n"Drill\n' + b"more\n" * 4 + b"Saw\n"
+
+    rows = await collect(parse_csv(stream(lines)))
+
+    assert rows == [
+        (2, "Unterminated quoted value"),
+        (5, {"name": "more"}),
+        (6, {"name": "more"}),
+        (7, {"name": "Saw"}),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_csv_without_a_name_column_is_refused():
+    with pytest.raises(HTTPException) as error:
+        await collect(parse_csv(stream(b"title,quantity\nDrill,1\n")))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_parse_ndjson():
+    rows = await collect(
+        parse_ndjson(stream(b'{"name": "Drill"}\n\n[1]\n{"name": \n{"name": "Saw"}'))
+    )
+
+    assert rows == [
+        (1, {"name": "Drill"}),
+        (3, "Expected a JSON object"),
+        (4, "Invalid JSON"),
+        (5, {"name": "Saw"}),
+    ]
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import signal
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.lifespan import (
+    RequestDrainMiddleware,
+    RequestTracker,
+    install_sigterm_hook,
+    lifespan,
+)
+
+
+@pytest.fixture
+def tracker(mocker):
+    tracker = RequestTracker()
+    mocker.patch("app.lifespan.request_tracker", tracker)
+    return tracker
+
+
+@pytest.fixture
+def mock_dispose(mocker):
+    return mocker.patch("app.lifespan.dispose_engines", mocker.AsyncMock())
+
+
+@pytest.mark.asyncio
+async def test_tracker_waits_for_in_flight_requests():
+    tracker = RequestTracker()
+    tracker.start_request()
+
+    asyncio.get_running_loop().call_later(0.01, tracker.finish_request)
+
+    assert await tracker.wait_until_idle(timeout=1) is True
+    assert tracker.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_tracker_wait_times_out():
+    tracker = RequestTracker()
+    tracker.start_request()
+
+    assert await tracker.wait_until_idle(timeout=0.01) is False
+
+
+def test_sigterm_hook_chains_previous_handler(mocker):
+    previous = mocker.Mock()
+    original = signal.signal(signal.SIGTERM, previous)
+    callback = mocker.Mock()
+    try:
+        restore = install_sigterm_hook(callback)
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+
+        callback.assert_called_once()
+        previous.assert_called_once_with(signal.SIGTERM, None)
+
+        restore()
+        assert signal.getsignal(signal.SIGTERM) is previous
+    finally:
+        signal.signal(signal.SIGTERM, original)
+
+
+@pytest.mark.asyncio
+async def test_lifespan_warms_up_and_disposes(mocker, tracker, mock_dispose):
+    warm_up = mocker.patch("app.lifespan.warm_up_engine", mocker.AsyncMock())
+    mocker.patch("app.lifespan.settings.DATABASE_POOL_SIZE", 5)
+    mocker.patch("app.lifespan.settings.DATABASE_WARM_UP_CONNECTIONS", 3)
+
+    async with lifespan(FastAPI()):
+        warm_up.assert_awaited_once_with(3)
+        assert tracker.draining is False
+
+    assert tracker.draining is True
+    mock_dispose.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_lifespan_skips_warm_up_without_pooling(mocker, tracker, mock_dispose):
+    warm_up = mocker.patch("app.lifespan.warm_up_engine", mocker.AsyncMock())
+    mocker.patch("app.lifespan.settings.DATABASE_POOL_SIZE", 0)
+    mocker.patch("app.lifespan.settings.DATABASE_WARM_UP_CONNECTIONS", 3)
+
+    async with lifespan(FastAPI()):
+        warm_up.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_lifespan_survives_failed_warm_up(mocker, tracker, mock_dispose):
+    mocker.patch("app.lifespan.settings.DATABASE_POOL_SIZE", 5)
+    mocker.patch(
+        "app.lifespan.warm_up_engine",
+        mocker.AsyncMock(side_effect=OSError("connection refused")),
+    )
+
+    async with lifespan(FastAPI()):
+        pass
+
+    mock_dispose.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_lifespan_drains_before_dispose(mocker, tracker, mock_dispose):
+    mocker.patch("app.lifespan.warm_up_engine", mocker.AsyncMock())
+    mocker.patch("app.lifespan.settings.SHUTDOWN_DRAIN_TIMEOUT_SECONDS", 1)
+
+    async with lifespan(FastAPI()):
+        tracker.start_request()
+        asyncio.get_running_loop().call_later(0.01, tracker.finish_request)
+
+    assert tracker.in_flight == 0
+    mock_dispose.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_sigterm_cuts_off_requests_at_the_drain_deadline(
+    mocker, tracker, mock_dispose
+):
+    mocker.patch("app.lifespan.warm_up_engine", mocker.AsyncMock())
+    mocker.patch("app.lifespan.settings.SHUTDOWN_DRAIN_TIMEOUT_SECONDS", 0.1)
+    started = asyncio.Event()
+
+    async def stuck(scope, receive, send):
+        started.set()
+        await asyncio.Event().wait()
+
+    client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=RequestDrainMiddleware(stuck, tracker)),
+        base_url="http://test",
+    )
+    # Stands in for the server's own handler, which would stop the process
+    server_handler = mocker.Mock()
+    original = signal.signal(signal.SIGTERM, server_handler)
+    try:
+        async with lifespan(FastAPI()):
+            request = asyncio.create_task(client.get("/items/"))
+            await started.wait()
+
+            os.kill(os.getpid(), signal.SIGTERM)
+            # The server only shuts the app down once its requests are done
+            response = await asyncio.wait_for(request, timeout=5)
+
+            assert response.status_code == 503
+            assert tracker.draining is True
+            assert tracker.in_flight == 0
+            server_handler.assert_called_once()
+    finally:
+        signal.signal(signal.SIGTERM, original)
@@ -0,0 +1,170 @@
+import json
+import logging
+import queue
+import sys
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from app.log import (
+    ContextFilter,
+    JSONFormatter,
+    NonBlockingQueueHandler,
+    RequestContextMiddleware,
+    configure_logging,
+    current_request_id,
+    current_user_id,
+    stop_logging,
+)
+from app.users import UserManager
+
+
+def make_record(level=logging.INFO, msg="Item %s created", args=("Drill",), **extra):
+    record = logging.makeLogRecord(
+        {"name": "app.test", "levelno": level, "msg": msg, "args": args, **extra}
+    )
+    record.levelname = logging.getLevelName(level)
+    return record
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    yield root
+    stop_logging()
+    root.handlers, root.level = handlers, level
+
+
+def test_json_formatter_includes_extra_fields():
+    record = make_record(request_id="abc", quantity=3)
+
+    entry = json.loads(JSONFormatter().format(record))
+
+    assert entry["message"] == "Item Drill created"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "app.test"
+    assert (entry["request_id"], entry["quantity"]) == ("abc", 3)
+    assert "timestamp" in entry and "args" not in entry
+
+
+def test_context_filter_adds_request_and_user_ids():
+    record = make_record()
+    request_token = current_request_id.set("request-1")
+    user_token = current_user_id.set("user-1")
+    try:
+        assert ContextFilter().filter(record)
+    finally:
+        current_request_id.reset(request_token)
+        current_user_id.reset(user_token)
+
+    assert (record.request_id, record.user_id) == ("request-1", "user-1")
+
+
+def test_sampling_keeps_a_requests_records_together():
+    log_filter = ContextFilter(sample_rate=0.5)
+    kept = []
+    for _ in range(200):
+        token = current_request_id.set(uuid.uuid4().hex)
+        try:
+            decisions = {log_filter.filter(make_record()) for _ in range(5)}
+        finally:
+            current_request_id.reset(token)
+        assert len(decisions) == 1
+        kept.append(decisions.pop())
+
+    assert 50 < sum(kept) < 150
+
+
+def test_sampling_keeps_warnings():
+    log_filter = ContextFilter(sample_rate=0)
+
+    assert not log_filter.filter(make_record(logging.INFO))
+    assert log_filter.filter(make_record(logging.WARNING))
+
+
+def test_queue_handler_renders_records_before_queueing():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    try:
+        raise ValueError("Out of stock")
+    except ValueError:
+        record = make_record(logging.ERROR, exc_info=sys.exc_info())
+
+    handler.handle(record)
+
+    queued = handler.queue.get_nowait()
+    assert (queued.msg, queued.args, queued.exc_info) == (
+        "Item Drill created",
+        None,
+        None,
+    )
+    assert "ValueError: Out of stock" in queued.exc_text
+    assert "Out of stock" in json.loads(JSONFormatter().format(queued))["exception"]
+
+
+def test_queue_handler_drops_records_when_full():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+
+    for _ in range(3):
+        handler.handle(make_record())
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
+
+
+def test_configure_logging_writes_json_lines(root_logger, capsys, mocker):
+    previous_handlers = root_logger.handlers
+    mocker.patch("app.log.settings.LOG_FORMAT", "json")
+    mocker.patch("app.log.settings.LOG_LEVEL", "INFO")
+    configure_logging()
+
+    logging.getLogger("app.test").info("Item %s created", "Drill")
+    logging.getLogger("app.test").debug("Not written")
+    logging.getLogger("uvicorn.access").info("GET /items/ 200")
+    stop_logging()
+
+    assert root_logger.handlers == previous_handlers
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(line["logger"], line["message"]) for line in lines] == [
+        ("app.test", "Item Drill created"),
+        ("uvicorn.access", "GET /items/ 200"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_request_context_middleware():
+    app = FastAPI()
+    app.add_middleware(RequestContextMiddleware)
+
+    @app.get("/request-id")
+    async def request_id():
+        return {"request_id": current_request_id.get()}
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        generated = await client.get("/request-id")
+        given = await client.get("/request-id", headers={"X-Request-ID": "abc-123"})
+        too_long = await client.get("/request-id", headers={"X-Request-ID": "a" * 200})
+
+    assert generated.json()["request_id"] == generated.headers["X-Request-ID"]
+    assert len(generated.headers["X-Request-ID"]) == 32
+    assert given.json() == {"request_id": "abc-123"}
+    assert given.headers["X-Request-ID"] == "abc-123"
+    assert len(too_long.headers["X-Request-ID"]) == 32
+    assert current_request_id.get() is None
+
+
+@pytest.mark.asyncio
+async def test_verification_token_is_only_logged_at_debug(mocker):
+    logger = mocker.patch("app.users.logger")
+    user = mocker.MagicMock(id=uuid.uuid4())
+
+    await UserManager(mocker.MagicMock()).on_after_request_verify(user, "secret")
+
+    logger.info.assert_called_once_with(
+        "Verification requested", extra={"user_id": str(user.id)}
+    )
+    assert "secret" in logger.debug.call_args.args
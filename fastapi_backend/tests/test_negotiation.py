@@ -0,0 +1,149 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import FastAPI, Response
+from httpx import ASGITransport, AsyncClient
+from pydantic import BaseModel
+
+from app.negotiation import (
+    MSGPACK_MEDIA_TYPE,
+    MessagePackMiddleware,
+    MessagePackRoute,
+    NegotiatedResponse,
+    packb,
+    prefers_msgpack,
+    unpackb,
+)
+
+msgpack = pytest.importorskip("msgpack")
+
+ITEM_ID = uuid.UUID("0b0c8a0e-7c9f-4d39-9f55-3c4b1a5f2e61")
+CREATED_AT = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+
+class Part(BaseModel):
+    id: uuid.UUID
+    name: str
+    created_at: datetime
+
+
+@pytest.fixture
+async def client():
+    app = FastAPI()
+    app.router.route_class = MessagePackRoute
+    app.add_middleware(MessagePackMiddleware)
+
+    @app.get("/parts", response_model=list[Part], response_class=NegotiatedResponse)
+    async def read_parts():
+        return [Part(id=ITEM_ID, name="Drill", created_at=CREATED_AT)]
+
+    @app.post("/parts", response_model=Part, response_class=NegotiatedResponse)
+    async def create_part(part: Part, response: Response):
+        response.status_code = 201
+        response.headers["Location"] = f"/parts/{part.id}"
+        return part
+
+    @app.get("/plain")
+    async def read_plain():
+        return {"id": str(ITEM_ID)}
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        ("application/msgpack", True),
+        ("application/x-msgpack", True),
+        ("application/msgpack, application/json", True),
+        ("application/json, application/msgpack;q=0.5", False),
+        ("application/msgpack;q=0", False),
+        ("*/*", False),
+        ("", False),
+    ],
+)
+def test_prefers_msgpack(accept, expected):
+    assert prefers_msgpack(accept) == expected
+
+
+def test_uuids_and_datetimes_are_packed_compactly():
+    packed = packb({"id": ITEM_ID, "created_at": CREATED_AT})
+
+    # 16 bytes for the UUID and a 32-bit timestamp, instead of 36 and 25 characters
+    assert ITEM_ID.bytes in packed and str(ITEM_ID).encode() not in packed
+    assert unpackb(packed) == {"id": ITEM_ID, "created_at": CREATED_AT}
+
+
+def test_unknown_extension_types_are_rejected():
+    with pytest.raises(ValueError):
+        unpackb(msgpack.packb(msgpack.ExtType(42, b"data")))
+
+
+@pytest.mark.asyncio
+async def test_response_model_packed_directly(client):
+    response = await client.get("/parts", headers={"Accept": MSGPACK_MEDIA_TYPE})
+    as_json = await client.get("/parts")
+
+    assert response.headers["content-type"] == MSGPACK_MEDIA_TYPE
+    assert "Accept" in response.headers["vary"]
+    assert unpackb(response.content) == [
+        {"id": ITEM_ID, "name": "Drill", "created_at": CREATED_AT}
+    ]
+    assert len(response.content) < len(as_json.content)
+    assert as_json.json()[0]["id"] == str(ITEM_ID)
+
+
+@pytest.mark.asyncio
+async def test_other_json_responses_are_converted(client):
+    response = await client.get("/plain", headers={"Accept": MSGPACK_MEDIA_TYPE})
+    not_found = await client.get("/missing", headers={"Accept": MSGPACK_MEDIA_TYPE})
+
+    assert response.headers["content-type"] == MSGPACK_MEDIA_TYPE
+    assert int(response.headers["content-length"]) == len(response.content)
+    assert unpackb(response.content) == {"id": str(ITEM_ID)}
+    assert unpackb(not_found.content) == {"detail": "Not Found"}
+
+
+@pytest.mark.asyncio
+async def test_msgpack_request_body(client):
+    body = packb({"id": ITEM_ID, "name": "Saw", "created_at": CREATED_AT})
+
+    response = await client.post(
+        "/parts", content=body, headers={"Content-Type": MSGPACK_MEDIA_TYPE}
+    )
+
+    assert response.status_code == 201
+    assert response.json() == {
+        "id": str(ITEM_ID),
+        "name": "Saw",
+        "created_at": "2024-05-01T12:30:00Z",
+    }
+
+
+@pytest.mark.asyncio
+async def test_malformed_msgpack_request_body(client):
+    response = await client.post(
+        "/parts", content=b"\xc1", headers={"Content-Type": MSGPACK_MEDIA_TYPE}
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "The request body isn't valid MessagePack"}
+
+
+@pytest.mark.asyncio
+async def test_packed_response_keeps_the_endpoints_status_and_headers(client):
+    body = packb({"id": ITEM_ID, "name": "Saw", "created_at": CREATED_AT})
+
+    response = await client.post(
+        "/parts",
+        content=body,
+        headers={"Content-Type": MSGPACK_MEDIA_TYPE, "Accept": MSGPACK_MEDIA_TYPE},
+    )
+
+    assert response.status_code == 201
+    assert response.headers["location"] == f"/parts/{ITEM_ID}"
+    assert unpackb(response.content)["id"] == ITEM_ID
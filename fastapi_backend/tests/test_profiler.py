@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.profiler import ProfileFormat, StackSampler
+
+
+def spin(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def busy_request():
+    spin(0.1)
+
+
+async def busy_neighbour():
+    spin(0.1)
+
+
+def sampled_functions(sampler: StackSampler) -> set[str]:
+    return {frame.split(" ")[0] for stack in sampler.stacks for frame in stack}
+
+
+@pytest.mark.asyncio
+async def test_samples_the_event_loop_and_other_threads():
+    done = threading.Event()
+
+    def work():
+        while not done.is_set():
+            spin(0.01)
+
+    thread = threading.Thread(target=work, name="worker")
+    sampler = StackSampler(0.001, asyncio.get_running_loop())
+    thread.start()
+    sampler.start()
+    await asyncio.create_task(busy_request())
+    sampler.stop()
+    done.set()
+    thread.join()
+
+    roots = {stack[0] for stack in sampler.stacks}
+    assert "task busy_request" in roots
+    assert "thread worker" in roots
+    assert {"busy_request", "spin"} <= sampled_functions(sampler)
+    assert sampler.samples > 0
+
+
+@pytest.mark.asyncio
+async def test_samples_only_the_given_task():
+    loop = asyncio.get_running_loop()
+    request = asyncio.create_task(busy_request())
+    sampler = StackSampler(0.001, loop, request)
+    sampler.start()
+    await asyncio.gather(request, busy_neighbour())
+    sampler.stop()
+
+    assert "busy_request" in sampled_functions(sampler)
+    assert "busy_neighbour" not in sampled_functions(sampler)
+    assert {stack[0] for stack in sampler.stacks} == {"task busy_request"}
+
+
+def test_collapsed_and_speedscope_formats():
+    sampler = StackSampler(0.005, asyncio.new_event_loop())
+    sampler.stacks.update({("task a", "f", "g"): 3, ("task a", "f"): 1})
+
+    assert sampler.collapsed() == "task a;f;g 3\ntask a;f 1\n"
+    profile = sampler.speedscope("Test")
+    assert [frame["name"] for frame in profile["shared"]["frames"]] == [
+        "task a",
+        "f",
+        "g",
+    ]
+    assert profile["profiles"][0]["samples"] == [[0, 1, 2], [0, 1]]
+    assert profile["profiles"][0]["weights"] == [0.015, 0.005]
+    response = sampler.response(ProfileFormat.collapsed, "Test")
+    assert response.body == b"task a;f;g 3\ntask a;f 1\n"
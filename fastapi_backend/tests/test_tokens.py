@@ -0,0 +1,138 @@
+import uuid
+from unittest.mock import AsyncMock, MagicMock
+
+import jwt
+import pytest
+from fastapi_users import exceptions
+
+from app.tokens import CachedJWTStrategy, KeyRing
+from app.users import get_jwt_strategy
+
+
+def make_strategy(key_ring=None, cache_size=10, lifetime_seconds=3600):
+    return CachedJWTStrategy(
+        key_ring or KeyRing("1", "secret"),
+        lifetime_seconds=lifetime_seconds,
+        cache_size=cache_size,
+    )
+
+
+def make_user():
+    return MagicMock(id=uuid.uuid4())
+
+
+def make_user_manager(user):
+    user_manager = MagicMock()
+    user_manager.parse_id.side_effect = uuid.UUID
+    user_manager.get = AsyncMock(return_value=user)
+    return user_manager
+
+
+def test_strategy_is_reused():
+    assert get_jwt_strategy() is get_jwt_strategy()
+
+
+@pytest.mark.asyncio
+async def test_token_names_its_key():
+    strategy = make_strategy()
+    user = make_user()
+
+    token = await strategy.write_token(user)
+
+    assert jwt.get_unverified_header(token)["kid"] == "1"
+    assert await strategy.read_token(token, make_user_manager(user)) is user
+
+
+@pytest.mark.asyncio
+async def test_tokens_signed_with_a_retired_key_stay_valid():
+    user = make_user()
+    old_token = await make_strategy(KeyRing("1", "old secret")).write_token(user)
+    strategy = make_strategy(KeyRing("2", "new secret", {"1": "old secret"}))
+
+    new_token = await strategy.write_token(user)
+
+    assert jwt.get_unverified_header(new_token)["kid"] == "2"
+    assert await strategy.read_token(old_token, make_user_manager(user)) is user
+    assert await strategy.read_token(new_token, make_user_manager(user)) is user
+
+
+@pytest.mark.asyncio
+async def test_unknown_or_mismatched_key_is_rejected():
+    user = make_user()
+    strategy = make_strategy(KeyRing("2", "new secret", {"1": "old secret"}))
+    unknown = await make_strategy(KeyRing("3", "other secret")).write_token(user)
+    mismatched = await make_strategy(KeyRing("1", "new secret")).write_token(user)
+
+    assert await strategy.read_token(unknown, make_user_manager(user)) is None
+    assert await strategy.read_token(mismatched, make_user_manager(user)) is None
+    assert await strategy.read_token("not a token", make_user_manager(user)) is None
+
+
+@pytest.mark.asyncio
+async def test_token_without_key_id_uses_signing_key():
+    user = make_user()
+    strategy = make_strategy()
+    token = jwt.encode(
+        {"sub": str(user.id), "aud": strategy.token_audience}, "secret", "HS256"
+    )
+
+    assert await strategy.read_token(token, make_user_manager(user)) is user
+
+
+@pytest.mark.asyncio
+async def test_verified_token_is_not_decoded_again(mocker):
+    strategy = make_strategy()
+    user = make_user()
+    user_manager = make_user_manager(user)
+    token = await strategy.write_token(user)
+    decode = mocker.spy(jwt, "decode")
+
+    for _ in range(3):
+        assert await strategy.read_token(token, user_manager) is user
+
+    assert decode.call_count == 1
+    # The user is still loaded, so deactivated or deleted users are noticed
+    assert user_manager.get.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_cached_token_expires(mocker):
+    strategy = make_strategy(lifetime_seconds=60)
+    user = make_user()
+    token = await strategy.write_token(user)
+    assert await strategy.read_token(token, make_user_manager(user)) is user
+
+    expires_at = jwt.decode(token, options={"verify_signature": False})["exp"]
+    mocker.patch("app.tokens.time").time.return_value = expires_at + 1
+    decode = mocker.patch("jwt.decode", side_effect=jwt.ExpiredSignatureError)
+
+    assert await strategy.read_token(token, make_user_manager(user)) is None
+    assert decode.call_count == 1
+    assert strategy._verified == {}
+
+
+@pytest.mark.asyncio
+async def test_cache_keeps_most_recently_used_tokens(mocker):
+    strategy = make_strategy(cache_size=2)
+    users = [make_user() for _ in range(3)]
+    token_list = [await strategy.write_token(user) for user in users]
+
+    for user, token in zip(users, token_list):
+        await strategy.read_token(token, make_user_manager(user))
+    decode = mocker.spy(jwt, "decode")
+    await strategy.read_token(token_list[2], make_user_manager(users[2]))
+    await strategy.read_token(token_list[0], make_user_manager(users[0]))
+
+    assert len(strategy._verified) == 2
+    assert decode.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_missing_user_is_rejected():
+    strategy = make_strategy()
+    user = make_user()
+    token = await strategy.write_token(user)
+    user_manager = make_user_manager(user)
+    user_manager.get.side_effect = exceptions.UserNotExists()
+
+    assert await strategy.read_token(token, user_manager) is None
@@ -0,0 +1,65 @@
+import uuid
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from app import tombstones
+from app.models import ItemTombstone, PrunedItemTombstones
+from app.tombstones import delete_expired_tombstones
+
+RETENTION = 24 * 3600
+
+
+@pytest.mark.asyncio
+async def test_delete_expired_tombstones(db_session, mocker):
+    mocker.patch.object(tombstones, "CLEANUP_BATCH_SIZE", 2)
+    user_id, other_user_id = uuid.uuid4(), uuid.uuid4()
+    for owner, age in [
+        (user_id, 3),
+        (user_id, 2),
+        (other_user_id, 2),
+        (user_id, 0),
+    ]:
+        # Separate transactions, so each tombstone has its own xid
+        await db_session.execute(
+            insert(ItemTombstone).values(
+                id=uuid.uuid4(),
+                user_id=owner,
+                deleted_at=func.now() - timedelta(days=age),
+            )
+        )
+        await db_session.commit()
+
+    assert await delete_expired_tombstones(db_session, RETENTION) == 3
+
+    remaining = await db_session.execute(select(ItemTombstone.user_id))
+    assert remaining.scalars().all() == [user_id]
+    pruned = await db_session.execute(
+        select(PrunedItemTombstones.user_id, PrunedItemTombstones.change_xid)
+    )
+    latest = dict(pruned.all())
+    assert set(latest) == {user_id, other_user_id}
+    # The user's latest pruned tombstone is the second one, not the first
+    assert latest[user_id] < latest[other_user_id]
+
+
+@pytest.mark.asyncio
+async def test_pruned_record_only_moves_forward(db_session):
+    user_id = uuid.uuid4()
+    await db_session.execute(
+        insert(PrunedItemTombstones).values(user_id=user_id, change_xid=2**40)
+    )
+    await db_session.execute(
+        insert(ItemTombstone).values(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            deleted_at=func.now() - timedelta(days=2),
+        )
+    )
+    await db_session.commit()
+
+    assert await delete_expired_tombstones(db_session, RETENTION) == 1
+
+    pruned = await db_session.get(PrunedItemTombstones, user_id)
+    assert pruned.change_xid == 2**40
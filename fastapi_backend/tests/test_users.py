@@ -0,0 +1,40 @@
+import uuid
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import User
+from app.users import current_active_user
+
+
+@pytest.fixture
+def user():
+    return User(id=uuid.uuid4(), shard=1, shard_moving=False)
+
+
+def mock_session(mocker):
+    session = mocker.AsyncMock(spec=AsyncSession)
+    session.info = {}
+    return session
+
+
+@pytest.mark.asyncio
+async def test_current_active_user_releases_the_directory_session(user, mocker):
+    user_db = mocker.MagicMock(session=mock_session(mocker))
+    session = mock_session(mocker)
+
+    assert await current_active_user(user, user_db, session) is user
+
+    user_db.session.close.assert_awaited_once()
+    session.close.assert_not_awaited()
+    assert session.info["shard"] == 1
+
+
+@pytest.mark.asyncio
+async def test_current_active_user_keeps_a_shared_session_open(user, mocker):
+    session = mock_session(mocker)
+    user_db = mocker.MagicMock(session=session)
+
+    await current_active_user(user, user_db, session)
+
+    session.close.assert_not_awaited()
@@ -1,5 +1,8 @@
 from fastapi.routing import APIRoute
-from app.utils import simple_generate_unique_route_id
+import time
+
+from app import utils
+from app.utils import simple_generate_unique_route_id, uuid7
 
 
 def test_simple_generate_unique_route_id(mocker):
@@ -11,3 +14,36 @@ def test_simple_generate_unique_route_id(mocker):
     unique_id = simple_generate_unique_route_id(mock_route)
 
     assert unique_id == "auth-authenticate_user"
+
+
+def test_uuid7_layout():
+    before = time.time_ns() // 1_000_000
+    value = uuid7()
+    after = time.time_ns() // 1_000_000
+
+    assert value.version == 7
+    assert value.variant == "specified in RFC 4122"
+    assert before <= value.int >> 80 <= after
+
+
+def test_uuid7_is_increasing_within_a_millisecond(mocker):
+    mocker.patch.object(utils.time, "time_ns", return_value=1_700_000_000_000_000_000)
+    mocker.patch.object(utils, "_uuid7_last_timestamp", 0)
+
+    values = [uuid7() for _ in range(1000)]
+
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
+    assert {value.int >> 80 for value in values} == {1_700_000_000_000}
+
+
+def test_uuid7_counter_overflow_moves_to_the_next_millisecond(mocker):
+    mocker.patch.object(utils.time, "time_ns", return_value=1_700_000_000_000_000_000)
+    mocker.patch.object(utils, "_uuid7_last_timestamp", 0)
+    first = uuid7()
+    mocker.patch.object(utils, "_uuid7_last_counter", (1 << 74) - 1)
+
+    second = uuid7()
+
+    assert second > first
+    assert second.int >> 80 == (first.int >> 80) + 1
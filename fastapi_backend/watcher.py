@@ -1,3 +1,4 @@
+import logging
 import time
 import re
 import subprocess
@@ -6,10 +7,14 @@ from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from threading import Timer
 
+from app.log import configure_logging, stop_logging
+
 # Updated regex to include main.py, schemas.py, and all .py files in app/routes
 WATCHER_REGEX_PATTERN = re.compile(r"(main\.py|schemas\.py|routes/.*\.py)$")
 APP_PATH = "app"
 
+logger = logging.getLogger("watcher")
+
 
 class MyHandler(FileSystemEventHandler):
     def __init__(self):
@@ -30,30 +35,31 @@ class MyHandler(FileSystemEventHandler):
                 self.debounce_timer.start()
 
     def execute_command(self, file_path):
-        print(f"File {file_path} has been modified and saved.")
+        logger.info("File %s has been modified and saved.", file_path)
         self.run_mypy_checks()
         self.run_openapi_schema_generation()
 
     def run_mypy_checks(self):
-        """Run mypy type checks and print output."""
-        print("Running mypy type checks...")
+        """Run mypy type checks and log their output."""
+        logger.info("Running mypy type checks...")
         result = subprocess.run(
             ["uv", "run", "mypy", "app"],
             capture_output=True,
             text=True,
             check=False,
         )
-        print(result.stdout, result.stderr, sep="\n")
-        print(
-            "Type errors detected! We recommend checking the mypy output for "
-            "more information on the issues."
-            if result.returncode
-            else "No type errors detected."
-        )
+        logger.info("mypy output:\n%s%s", result.stdout, result.stderr)
+        if result.returncode:
+            logger.warning(
+                "Type errors detected! We recommend checking the mypy output for "
+                "more information on the issues."
+            )
+        else:
+            logger.info("No type errors detected.")
 
     def run_openapi_schema_generation(self):
         """Run the OpenAPI schema generation command."""
-        print("Proceeding with OpenAPI schema generation...")
+        logger.info("Proceeding with OpenAPI schema generation...")
         try:
             subprocess.run(
                 [
@@ -65,12 +71,13 @@ class MyHandler(FileSystemEventHandler):
                 ],
                 check=True,
             )
-            print("OpenAPI schema generation completed successfully.")
+            logger.info("OpenAPI schema generation completed successfully.")
         except subprocess.CalledProcessError as e:
-            print(f"An error occurred while generating OpenAPI schema: {e}")
+            logger.error("An error occurred while generating OpenAPI schema: %s", e)
 
 
 if __name__ == "__main__":
+    configure_logging()
     observer = Observer()
     observer.schedule(MyHandler(), APP_PATH, recursive=True)
     observer.start()
@@ -80,3 +87,4 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    stop_logging()
@@ -41,14 +41,53 @@ import type {
   UsersDeleteUserData,
   UsersDeleteUserError,
   UsersDeleteUserResponse,
+  ListUsersData,
+  ListUsersError,
+  ListUsersResponse,
+  ReadItemData,
   ReadItemError,
   ReadItemResponse,
   CreateItemData,
   CreateItemError,
   CreateItemResponse,
+  SearchItemsData,
+  SearchItemsError,
+  SearchItemsResponse,
+  ReadItemSummaryError,
+  ReadItemSummaryResponse,
+  ReadItemChangesData,
+  ReadItemChangesError,
+  ReadItemChangesResponse,
+  ItemEventsData,
+  ItemEventsError,
+  ItemEventsResponse,
+  ImportItemsData,
+  ImportItemsError,
+  ImportItemsResponse,
+  UpdateItemData,
+  UpdateItemError,
+  UpdateItemResponse,
   DeleteItemData,
   DeleteItemError,
   DeleteItemResponse,
+  BatchItemsData,
+  BatchItemsError,
+  BatchItemsResponse,
+  LivenessError,
+  LivenessResponse,
+  ReadinessError,
+  ReadinessResponse,
+  StatementCacheError,
+  StatementCacheResponse,
+  InsertBatchingError,
+  InsertBatchingResponse,
+  DeadlinesError,
+  DeadlinesResponse,
+  CacheStatsError,
+  CacheStatsResponse,
+  ProfileData,
+  ProfileError,
+  ProfileResponse,
 } from "./types.gen";
 
 export const client = createClient(createConfig());
@@ -250,11 +289,43 @@ export const usersDeleteUser = <ThrowOnError extends boolean = false>(
   });
 };
 
+/**
+ * List Users
+ * List user accounts in email order, with their item counts. Superusers only.
+ *
+ * `email_prefix` matches the start of the email as stored, case included.
+ * Pass the returned cursor as `cursor` for the next page while `has_more`
+ * is true.
+ *
+ * Item counts come from the per-user summaries kept up to date by triggers
+ * as items change, one primary key lookup per user, rather than from
+ * counting items.
+ */
+export const listUsers = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<ListUsersData, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    ListUsersResponse,
+    ListUsersError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/users/",
+  });
+};
+
 /**
  * Read Item
+ * List the current user's items.
+ *
+ * When `fields` is given, each item only contains `id` and the requested fields.
+ *
+ * To page through the items in creation order, pass `limit` with
+ * `sort=created` or `sort=-created`, then the last item's `created_at` and
+ * `id` as `after` to get the next page (include `created_at` in `fields`).
  */
 export const readItem = <ThrowOnError extends boolean = false>(
-  options?: OptionsLegacyParser<unknown, ThrowOnError>,
+  options?: OptionsLegacyParser<ReadItemData, ThrowOnError>,
 ) => {
   return (options?.client ?? client).get<
     ReadItemResponse,
@@ -268,6 +339,11 @@ export const readItem = <ThrowOnError extends boolean = false>(
 
 /**
  * Create Item
+ * Create an item.
+ *
+ * Send an `Idempotency-Key` to make retries safe: a retry with the same key
+ * gets the first response, with an `Idempotent-Replayed` header, instead of
+ * creating another item. The other item writes accept the header as well.
  */
 export const createItem = <ThrowOnError extends boolean = false>(
   options: OptionsLegacyParser<CreateItemData, ThrowOnError>,
@@ -282,6 +358,139 @@ export const createItem = <ThrowOnError extends boolean = false>(
   });
 };
 
+/**
+ * Search Items
+ */
+export const searchItems = <ThrowOnError extends boolean = false>(
+  options: OptionsLegacyParser<SearchItemsData, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    SearchItemsResponse,
+  ReadItemSummaryError,
+  ReadItemSummaryResponse,
+    SearchItemsError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/items/search",
+  });
+};
+
+/**
+ * Read Item Summary
+ * Count and total quantity of the current user's items.
+ *
+ * Read from a per-user row that triggers on `items` keep up to date, so the
+ * cost doesn't grow with the number of items.
+ */
+export const readItemSummary = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<unknown, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    ReadItemSummaryResponse,
+    ReadItemSummaryError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/items/summary",
+  });
+};
+
+/**
+ * Read Item Changes
+ * Items created, updated or deleted since the previous sync, in order.
+ *
+ * Apply the changes and pass the returned cursor as `since` next time; while
+ * `has_more` is true, call again straight away.
+ *
+ * Changes only become visible once every transaction that started before
+ * them has finished, so a single long-running write transaction anywhere in
+ * the database (a bulk import, a migration, a session left idle in
+ * transaction) stalls the feed for every user until it ends. When some of
+ * the user's changes are held back this way, `pending` is true and a
+ * Retry-After header says when to poll again.
+ *
+ * Cursors older than the tombstone retention period, or from before the
+ * user's items were moved to another database, get a 410 response: drop
+ * the local copy and sync again without `since`.
+ */
+export const readItemChanges = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<ReadItemChangesData, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    ReadItemChangesResponse,
+    ReadItemChangesError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/items/changes",
+  });
+};
+
+/**
+ * Item Events
+ * Stream changes to the current user's items as server-sent events.
+ *
+ * `insert`, `update` and `delete` events carry the item's id and version; on
+ * a `reset` event the client should reload its items. Reconnecting with
+ * `Last-Event-ID` resumes from that event when the server still has it.
+ */
+export const itemEvents = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<ItemEventsData, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    ItemEventsResponse,
+    ItemEventsError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/items/events",
+  });
+};
+
+/**
+ * Import Items
+ * Create items from an uploaded CSV or newline-delimited JSON file.
+ *
+ * CSV files start with a header naming the columns (`name`, and optionally
+ * `description` and `quantity`); NDJSON has one item object per line. The
+ * file is read as it arrives and written with COPY, so its size doesn't
+ * matter. Rows that aren't valid items are skipped and reported by line
+ * number; the other rows are imported together or not at all.
+ */
+export const importItems = <ThrowOnError extends boolean = false>(
+  options: OptionsLegacyParser<ImportItemsData, ThrowOnError>,
+) => {
+  return (options?.client ?? client).post<
+    ImportItemsResponse,
+    ImportItemsError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/items/import",
+  });
+};
+
+/**
+ * Update Item
+ * Apply the provided fields to an item in a single UPDATE ... RETURNING.
+ *
+ * Send the item's ETag in `If-Match` to only update it if it hasn't changed
+ * since; otherwise the response is 412 with the current ETag.
+ */
+export const updateItem = <ThrowOnError extends boolean = false>(
+  options: OptionsLegacyParser<UpdateItemData, ThrowOnError>,
+) => {
+  return (options?.client ?? client).patch<
+    UpdateItemResponse,
+    UpdateItemError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/items/{item_id}",
+  });
+};
+
 /**
  * Delete Item
  */
@@ -297,3 +506,149 @@ export const deleteItem = <ThrowOnError extends boolean = false>(
     url: "/items/{item_id}",
   });
 };
+
+/**
+ * Batch Items
+ * Run several item operations in order, in one request and one transaction.
+ *
+ * Each result carries the status and body the single-item route would have
+ * returned. When `atomic` is true (the default) the first failure rolls back
+ * the whole batch and every other operation reports 424. Otherwise each
+ * operation runs in its own savepoint, so failures are reported without
+ * undoing the rest.
+ */
+export const batchItems = <ThrowOnError extends boolean = false>(
+  options: OptionsLegacyParser<BatchItemsData, ThrowOnError>,
+) => {
+  return (options?.client ?? client).post<
+    BatchItemsResponse,
+    BatchItemsError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/items/batch",
+  });
+};
+
+/**
+ * Liveness
+ */
+export const liveness = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<unknown, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    LivenessResponse,
+    LivenessError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/health/live",
+  });
+};
+
+/**
+ * Readiness
+ */
+export const readiness = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<unknown, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    ReadinessResponse,
+    ReadinessError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/health/ready",
+  });
+};
+
+/**
+ * Statement Cache
+ * This worker's compiled and prepared statement cache hit rates.
+ */
+export const statementCache = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<unknown, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    StatementCacheResponse,
+    StatementCacheError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/health/statement-cache",
+  });
+};
+
+/**
+ * Insert Batching
+ * This worker's coalesced item insert batches and the latency they added.
+ */
+export const insertBatching = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<unknown, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    InsertBatchingResponse,
+    InsertBatchingError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/health/insert-batching",
+  });
+};
+
+/**
+ * Deadlines
+ * This worker's requests cancelled on client disconnect or timed out.
+ */
+export const deadlines = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<unknown, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    DeadlinesResponse,
+    DeadlinesError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/health/deadlines",
+  });
+};
+
+/**
+ * Cache Stats
+ * This worker's cache hit rates and invalidations, by tier.
+ */
+export const cacheStats = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<unknown, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    CacheStatsResponse,
+    CacheStatsError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/health/cache",
+  });
+};
+
+/**
+ * Profile
+ * Sample this worker's stacks for `seconds` and return them as a profile.
+ *
+ * Stacks on the event loop are grouped under the asyncio task that was
+ * running. `speedscope` profiles open in https://www.speedscope.app;
+ * `collapsed` stacks work with flamegraph.pl and most flame graph tools.
+ * Send `X-Profile: speedscope` or `X-Profile: collapsed` with any request
+ * to get the profile of that request instead of its response.
+ */
+export const profile = <ThrowOnError extends boolean = false>(
+  options?: OptionsLegacyParser<ProfileData, ThrowOnError>,
+) => {
+  return (options?.client ?? client).get<
+    ProfileResponse,
+    ProfileError,
+    ThrowOnError
+  >({
+    ...options,
+    url: "/debug/profile",
+  });
+};
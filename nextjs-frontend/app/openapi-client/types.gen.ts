@@ -1,5 +1,42 @@
 // This file is auto-generated by @hey-api/openapi-ts
 
+export type BatchCreate = {
+  op: "create";
+  item: ItemCreate;
+};
+
+export type BatchDelete = {
+  op: "delete";
+  id: string;
+};
+
+export type BatchList = {
+  op: "list";
+  query?: ItemListQuery;
+};
+
+export type BatchRequest = {
+  operations: Array<BatchCreate | BatchUpdate | BatchDelete | BatchList>;
+  atomic?: boolean;
+};
+
+export type BatchResponse = {
+  committed: boolean;
+  results: Array<BatchResult>;
+};
+
+export type BatchResult = {
+  status: number;
+  body?: unknown;
+};
+
+export type BatchUpdate = {
+  op: "update";
+  id: string;
+  item: ItemUpdate;
+  if_match?: string | null;
+};
+
 export type BearerResponse = {
   access_token: string;
   token_type: string;
@@ -34,18 +71,90 @@ export type HTTPValidationError = {
   detail?: Array<ValidationError>;
 };
 
+export type ItemChange = {
+  op: "upsert" | "delete";
+  id: string;
+  item?: ItemRead | null;
+};
+
+export type ItemChanges = {
+  changes: Array<ItemChange>;
+  cursor: string;
+  has_more: boolean;
+  pending?: boolean;
+};
+
 export type ItemCreate = {
   name: string;
   description?: string | null;
   quantity?: number | null;
 };
 
+export type ItemImportError = {
+  line: number;
+  detail: string;
+};
+
+export type ItemImportResult = {
+  imported: number;
+  rejected: number;
+  errors: Array<ItemImportError>;
+};
+
+export type ItemListQuery = {
+  min_quantity?: number | null;
+  max_quantity?: number | null;
+  name_prefix?: string | null;
+  has_description?: boolean | null;
+  sort?: ItemSort;
+  /**
+   * Only return these fields, comma-separated. `id` is always included.
+   */
+  fields?: Array<
+    | "id"
+    | "name"
+    | "description"
+    | "quantity"
+    | "user_id"
+    | "version"
+    | "created_at"
+    | "updated_at"
+  > | null;
+  /**
+   * With the created sorts, only return the items after this one: the last item's `created_at` and `id`, comma-separated.
+   */
+  after?: [string, string] | null;
+  limit?: number | null;
+};
+
 export type ItemRead = {
   name: string;
   description?: string | null;
   quantity?: number | null;
   id: string;
   user_id: string;
+  version: number;
+  created_at: string;
+  updated_at: string;
+};
+
+export type ItemSort =
+  | "name"
+  | "-name"
+  | "quantity"
+  | "-quantity"
+  | "created"
+  | "-created";
+
+export type ItemSummaryRead = {
+  item_count: number;
+  total_quantity: number;
+};
+
+export type ItemUpdate = {
+  name?: string | null;
+  description?: string | null;
+  quantity?: number | null;
 };
 
 export type login = {
@@ -57,6 +166,22 @@ export type login = {
   client_secret?: string | null;
 };
 
+/**
+ * An item limited to the fields requested with `fields`.
+ */
+export type PartialItemRead = {
+  id: string;
+  name?: string | null;
+  description?: string | null;
+  quantity?: number | null;
+  user_id?: string | null;
+  version?: number | null;
+  created_at?: string | null;
+  updated_at?: string | null;
+};
+
+export type ProfileFormat = "speedscope" | "collapsed";
+
 export type UserCreate = {
   email: string;
   password: string;
@@ -73,6 +198,12 @@ export type UserRead = {
   is_verified?: boolean;
 };
 
+export type UserPage = {
+  users: Array<UserWithItemsRead>;
+  cursor: string | null;
+  has_more: boolean;
+};
+
 export type UserUpdate = {
   password?: string | null;
   email?: string | null;
@@ -81,6 +212,16 @@ export type UserUpdate = {
   is_verified?: boolean | null;
 };
 
+export type UserWithItemsRead = {
+  id: string;
+  email: string;
+  is_active?: boolean;
+  is_superuser?: boolean;
+  is_verified?: boolean;
+  item_count: number;
+  total_quantity: number;
+};
+
 export type ValidationError = {
   loc: Array<string | number>;
   msg: string;
@@ -185,19 +326,142 @@ export type UsersDeleteUserResponse = void;
 
 export type UsersDeleteUserError = unknown | HTTPValidationError;
 
-export type ReadItemResponse = Array<ItemRead>;
+export type ListUsersData = {
+  query?: {
+    /**
+     * Cursor returned by the previous page; omit to start over.
+     */
+    cursor?: string | null;
+    email_prefix?: string | null;
+    is_active?: boolean | null;
+    is_verified?: boolean | null;
+    limit?: number;
+  };
+};
+
+export type ListUsersResponse = UserPage;
+
+export type ListUsersError = HTTPValidationError;
+
+export type ReadItemData = {
+  query?: {
+    /**
+     * With the created sorts, only return the items after this one: the last item's `created_at` and `id`, comma-separated.
+     */
+    after?: [string, string] | null;
+    /**
+     * Only return these fields, comma-separated. `id` is always included.
+     */
+    fields?: Array<
+      | "id"
+      | "name"
+      | "description"
+      | "quantity"
+      | "user_id"
+      | "version"
+      | "created_at"
+      | "updated_at"
+    > | null;
+    has_description?: boolean | null;
+    limit?: number | null;
+    max_quantity?: number | null;
+    min_quantity?: number | null;
+    name_prefix?: string | null;
+    sort?: ItemSort;
+  };
+};
+
+export type ReadItemResponse = Array<ItemRead | PartialItemRead>;
 
-export type ReadItemError = unknown;
+export type ReadItemError = HTTPValidationError;
 
 export type CreateItemData = {
   body: ItemCreate;
+  headers?: {
+    /**
+     * Unique per operation; retries with the same key are only applied once and get the first response.
+     */
+    "idempotency-key"?: string | null;
+  };
 };
 
 export type CreateItemResponse = ItemRead;
 
 export type CreateItemError = HTTPValidationError;
 
+export type SearchItemsData = {
+  query: {
+    limit?: number;
+    offset?: number;
+    q: string;
+  };
+};
+
+export type SearchItemsResponse = Array<ItemRead>;
+
+export type SearchItemsError = HTTPValidationError;
+
+export type ReadItemSummaryResponse = ItemSummaryRead;
+
+export type ReadItemSummaryError = unknown;
+
+export type ReadItemChangesData = {
+  query?: {
+    limit?: number;
+    /**
+     * Cursor returned by the previous sync; omit to start over.
+     */
+    since?: string | null;
+  };
+};
+
+export type ReadItemChangesResponse = ItemChanges;
+
+export type ReadItemChangesError = HTTPValidationError;
+
+export type ItemEventsData = {
+  headers?: {
+    "last-event-id"?: number | null;
+  };
+};
+
+export type ItemEventsResponse = unknown;
+
+export type ItemEventsError = HTTPValidationError;
+
+export type ImportItemsData = {
+  body: string;
+};
+
+export type ImportItemsResponse = ItemImportResult;
+
+export type ImportItemsError = unknown;
+
+export type UpdateItemData = {
+  body: ItemUpdate;
+  headers?: {
+    "if-match"?: string | null;
+    /**
+     * Unique per operation; retries with the same key are only applied once and get the first response.
+     */
+    "idempotency-key"?: string | null;
+  };
+  path: {
+    item_id: string;
+  };
+};
+
+export type UpdateItemResponse = ItemRead;
+
+export type UpdateItemError = HTTPValidationError;
+
 export type DeleteItemData = {
+  headers?: {
+    /**
+     * Unique per operation; retries with the same key are only applied once and get the first response.
+     */
+    "idempotency-key"?: string | null;
+  };
   path: {
     item_id: string;
   };
@@ -206,3 +470,52 @@ export type DeleteItemData = {
 export type DeleteItemResponse = unknown;
 
 export type DeleteItemError = HTTPValidationError;
+
+export type BatchItemsData = {
+  body: BatchRequest;
+  headers?: {
+    /**
+     * Unique per operation; retries with the same key are only applied once and get the first response.
+     */
+    "idempotency-key"?: string | null;
+  };
+};
+
+export type BatchItemsResponse = BatchResponse;
+
+export type BatchItemsError = HTTPValidationError;
+
+export type LivenessResponse = unknown;
+
+export type LivenessError = unknown;
+
+export type ReadinessResponse = unknown;
+
+export type ReadinessError = unknown;
+
+export type StatementCacheResponse = unknown;
+
+export type StatementCacheError = unknown;
+
+export type InsertBatchingResponse = unknown;
+
+export type InsertBatchingError = unknown;
+
+export type DeadlinesResponse = unknown;
+
+export type DeadlinesError = unknown;
+
+export type CacheStatsResponse = unknown;
+
+export type CacheStatsError = unknown;
+
+export type ProfileData = {
+  query?: {
+    format?: ProfileFormat;
+    seconds?: number;
+  };
+};
+
+export type ProfileResponse = unknown;
+
+export type ProfileError = HTTPValidationError;